@@ -20,6 +20,7 @@
  * - Buzzer: GPIO 5 (PWM)
  * 
  * MQTT TOPICS:
+ * - home/bedroom/node1/telemetry/tick          (binary, whole sampling tick)
  * - home/bedroom/node1/temperature_sensor/value
  * - home/bedroom/node1/humidity_sensor/value
  * - home/bedroom/node1/gas_sensor/analog_value
@@ -53,6 +54,7 @@ const char* MQTT_SERVER_IP = "192.168.1.3"; // Backup IP
 #define BEDROOM_NODE1_FLAME_TOPIC       "home/bedroom/node1/flame_sensor/alert"
 #define BEDROOM_NODE1_LED_STATUS_TOPIC  "home/bedroom/node1/led_system/status"
 #define BEDROOM_NODE1_BUZZER_TOPIC      "home/bedroom/node1/buzzer/status"
+#define BEDROOM_NODE1_TELEMETRY_TOPIC   "home/bedroom/node1/telemetry/tick"
 
 // ===== SYSTEM STATUS TOPICS =====
 #define SYSTEM_STATUS_TOPIC     "home/system/status"
@@ -66,6 +68,12 @@ const char* MQTT_SERVER_IP = "192.168.1.3"; // Backup IP
 #define HEARTBEAT_INTERVAL      30000  // 30 seconds
 #define SENSOR_READ_INTERVAL    2000   // 2 seconds
 
+// ===== BINARY TELEMETRY =====
+// v1, little-endian, 9 bytes; must match raspberry_pi/telemetry.py
+#define TELEMETRY_VERSION     1
+#define TELEMETRY_TICK_SIZE   9
+#define PUBLISH_TEXT_TOPICS   0   // 1 = also publish the per-field text topics (for tools that cannot decode the tick)
+
 // ===== HARDWARE CONFIGURATION =====
 #define DHTPIN 4
 #define DHTTYPE DHT11
@@ -456,9 +464,31 @@ void playBuzzer(int intensity, bool enable) {
 }
 
 // ===== MQTT PUBLISHING =====
+void encodeTelemetryTick(const SensorData& data, uint8_t* out) {
+  int16_t temperature = (int16_t)lroundf(data.temperature * 10);
+  int16_t humidity = (int16_t)lroundf(data.humidity * 10);
+  uint16_t gasAnalog = (uint16_t)data.gasAnalogValue;
+  
+  out[0] = TELEMETRY_VERSION;
+  out[1] = 0x1F;  // All five fields present
+  out[2] = temperature & 0xFF;
+  out[3] = (temperature >> 8) & 0xFF;
+  out[4] = humidity & 0xFF;
+  out[5] = (humidity >> 8) & 0xFF;
+  out[6] = gasAnalog & 0xFF;
+  out[7] = (gasAnalog >> 8) & 0xFF;
+  out[8] = (uint8_t)data.gasLevel | (data.fireDetected ? 0x04 : 0x00);  // Bits 0-1 gas level, bit 2 fire
+}
+
 void publishSensorData(const SensorData& data) {
   if (!client.connected()) return;
   
+  // Whole tick in one message instead of one per field
+  uint8_t tick[TELEMETRY_TICK_SIZE];
+  encodeTelemetryTick(data, tick);
+  client.publish(BEDROOM_NODE1_TELEMETRY_TOPIC, tick, TELEMETRY_TICK_SIZE);
+  
+#if PUBLISH_TEXT_TOPICS
   // Temperature
   String tempStr = String(data.temperature, 1);
   client.publish(BEDROOM_NODE1_TEMP_TOPIC, tempStr.c_str());
@@ -483,6 +513,7 @@ void publishSensorData(const SensorData& data) {
   // Fire alert
   String fireStatus = data.fireDetected ? "FIRE_DETECTED" : "NO_FIRE";
   client.publish(BEDROOM_NODE1_FLAME_TOPIC, fireStatus.c_str());
+#endif
   
   // LED status
   StaticJsonDocument<200> ledDoc;
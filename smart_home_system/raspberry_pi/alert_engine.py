@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Alert Deduplication & Debouncing Engine
+Giữ các cảnh báo đang mở trong bộ nhớ theo (room, node, alert_type): gộp cảnh báo lặp lại,
+nâng mức độ tại chỗ, tự đóng khi cảm biến về SAFE, và chỉ ghi database khi trạng thái thay đổi
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ===== ALERT CONFIGURATION =====
+SEVERITY_RANK = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2, 'CRITICAL': 3}
+ALERT_CLEAR_DEBOUNCE = 10     # Seconds the sensor must stay clear before the alert auto-resolves
+ALERT_SUBMIT_TIMEOUT = 2.0    # Seconds shutdown keeps retrying alert writes that found the writer queue full
+ALERT_RETRY_PAUSE = 0.05      # Seconds between those retries
+
+
+class OpenAlert:
+    """In-memory state of one unresolved alert"""
+
+    __slots__ = ('message', 'severity', 'occurrences', 'clear_since')
+
+    def __init__(self, message, severity, occurrences=1):
+        self.message = message
+        self.severity = severity
+        self.occurrences = occurrences
+        self.clear_since = None
+
+
+class AlertEngine:
+    """Turn a stream of alert observations into open / escalate / resolve transitions.
+    `clock` stamps the rows and `timer` (seconds) drives the clear debounce; replay.py passes the
+    captured message time for both. observe() never blocks: writes that find the writer queue full wait
+    in order for retry(), which the receiver calls from its background flush thread."""
+
+    def __init__(self, writer, clear_debounce=ALERT_CLEAR_DEBOUNCE, clock=datetime.now, timer=time.monotonic):
+        self.writer = writer
+        self.clear_debounce = clear_debounce
+        self.clock = clock
+        self.timer = timer
+        self._open = {}  # (room, node, alert_type) -> OpenAlert
+        self._unsent = deque()  # (sql, params) of transitions not queued yet, oldest first
+        self._lock = threading.Lock()
+
+    def load(self, conn, owns=None):
+        """Restore open alerts after a restart and collapse legacy duplicate rows. With
+        `owns(room, node)` only those nodes' alerts are restored (ingest_supervisor.py workers)."""
+        collapsed = conn.execute('''
+            UPDATE alerts SET resolved = 1, resolved_at = ?
+            WHERE resolved = 0 AND id NOT IN (
+                SELECT MAX(id) FROM alerts WHERE resolved = 0 GROUP BY room, node, alert_type
+            )
+        ''', (self.clock(),)).rowcount
+        conn.commit()
+
+        rows = conn.execute('''
+            SELECT room, node, alert_type, message, severity, occurrences
+            FROM alerts WHERE resolved = 0
+        ''').fetchall()
+        with self._lock:
+            self._open = {
+                (room, node, alert_type): OpenAlert(message, severity, occurrences or 1)
+                for room, node, alert_type, message, severity, occurrences in rows
+                if owns is None or owns(room, node)
+            }
+
+        if collapsed:
+            logger.info(f"Collapsed {collapsed} duplicate open alerts")
+        return len(self._open)
+
+    def open_alerts(self):
+        """Snapshot {(room, node, alert_type): severity}"""
+        with self._lock:
+            return {key: alert.severity for key, alert in self._open.items()}
+
+    def observe(self, room, node, alert_type, message, severity):
+        """One evaluation of an alert condition; message/severity None means the condition is clear.
+        Returns 'opened', 'escalated', 'resolved' or None (nothing written)."""
+        key = (room, node, alert_type)
+
+        with self._lock:
+            alert = self._open.get(key)
+
+            if message is None:
+                return self._clear(key, alert)
+
+            if alert is None:
+                self._submit('''
+                    INSERT INTO alerts (room, node, alert_type, message, severity, occurrences, timestamp)
+                    VALUES (?, ?, ?, ?, ?, 1, ?)
+                ''', (room, node, alert_type, message, severity, self.clock()))
+                self._open[key] = OpenAlert(message, severity)
+                logger.warning("ALERT: %s/%s - %s: %s", room, node, alert_type, message)
+                return 'opened'
+
+            alert.occurrences += 1
+            alert.clear_since = None
+
+            if SEVERITY_RANK.get(severity, 0) > SEVERITY_RANK.get(alert.severity, 0):
+                self._submit('''
+                    UPDATE alerts SET message = ?, severity = ?, occurrences = ?
+                    WHERE room = ? AND node = ? AND alert_type = ? AND resolved = 0
+                ''', (message, severity, alert.occurrences, room, node, alert_type))
+                alert.message = message
+                alert.severity = severity
+                logger.warning("ALERT escalated: %s/%s - %s: %s (%s)", room, node, alert_type, message, severity)
+                return 'escalated'
+
+            # Repeat of an already open alert: debounced, nothing to write
+            return None
+
+    def _clear(self, key, alert):
+        if alert is None:
+            return None
+
+        now = self.timer()
+        if alert.clear_since is None:
+            alert.clear_since = now
+        if now - alert.clear_since < self.clear_debounce:
+            return None
+
+        room, node, alert_type = key
+        self._submit('''
+            UPDATE alerts SET resolved = 1, resolved_at = ?, occurrences = ?
+            WHERE room = ? AND node = ? AND alert_type = ? AND resolved = 0
+        ''', (self.clock(), alert.occurrences, room, node, alert_type))
+        del self._open[key]
+        logger.info("Alert resolved: %s/%s - %s after %d occurrences", room, node, alert_type, alert.occurrences)
+        return 'resolved'
+
+    def retry(self, timeout=0):
+        """Queue the transitions that found the writer full, oldest first; with `timeout` (shutdown)
+        keep trying that many seconds. Returns how many are still waiting."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                while self._unsent and self.writer.submit(*self._unsent[0]):
+                    self._unsent.popleft()
+                waiting = len(self._unsent)
+            if not waiting or time.monotonic() >= deadline:
+                return waiting
+            time.sleep(ALERT_RETRY_PAUSE)
+
+    def _submit(self, sql, params):
+        # Called with _lock held on the ingest path, so never blocks. Unlike sensor rows, alert transitions
+        # are not dropped when the writer is full: they wait, behind any earlier ones, for retry()
+        if not self._unsent and self.writer.submit(sql, params):
+            return
+        if not self._unsent:
+            logger.error("Alert writes waiting for room in the writer queue: %s", params)
+        self._unsent.append((sql, params))
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Vectorized Sensor Analytics
+Nạp temperature / humidity / gas_analog của một phòng thành mảng NumPy (bảng rollup hoặc dữ liệu
+gốc) và tính trung bình trượt, tốc độ thay đổi, percentile, cờ bất thường theo z-score
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import rollups
+
+# ===== ANALYTICS CONFIGURATION =====
+ANALYTICS_MAX_POINTS = 10000  # Finest rollup with at most this many buckets per node (1 day -> 1m, 30 days -> 1h)
+ANALYTICS_RAW_HOURS = 6       # Up to this range, 'auto' reads raw environmental_data rows
+MOVING_WINDOW = 15            # Points in the trailing moving average / z-score window
+ZSCORE_THRESHOLD = 3.0        # |z| above this is flagged as an anomaly
+PERCENTILES = (5, 25, 50, 75, 95)
+SERIES_POINTS = 500           # Series in the response are averaged down to this many points
+MAX_ANOMALIES = 100           # Strongest anomalies returned per metric
+
+METRICS = rollups.METRICS
+EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(column):
+    # Timestamps are stored as local time without a zone; treat them as UTC so
+    # differences are exact and no timezone database is needed
+    return f"(julianday({column}) - 2440587.5) * 86400.0"
+
+
+def load_series(conn, room, hours, node=None, resolution='auto', max_points=ANALYTICS_MAX_POINTS):
+    """Load a time range as arrays. Returns (resolution name, {node: (t, {metric: values})}),
+    t in seconds (float64), missing values NaN."""
+    if resolution == 'auto':
+        resolution = 'raw' if hours <= ANALYTICS_RAW_HOURS else rollups.choose_resolution(hours * 3600, max_points)[0]
+
+    if resolution == 'raw':
+        table, time_column, fmt = 'environmental_data', 'timestamp', '%Y-%m-%d %H:%M:%S'
+        values = ', '.join(METRICS)
+    else:
+        _, table, _, fmt = next(r for r in rollups.RESOLUTIONS if r[0] == resolution)
+        time_column = 'bucket'
+        values = ', '.join(f"{m}_sum / NULLIF({m}_count, 0)" for m in METRICS)
+    since = (datetime.now() - timedelta(hours=hours)).strftime(fmt)
+
+    if node:
+        nodes = [node]
+    else:
+        nodes = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT node FROM {table} WHERE room = ? AND {time_column} >= ?", (room, since))]
+
+    series = {}
+    for n in nodes:
+        rows = conn.execute(f'''
+            SELECT {_epoch(time_column)}, {values} FROM {table}
+            WHERE room = ? AND node = ? AND {time_column} >= ?
+            ORDER BY {time_column}
+        ''', (room, n, since)).fetchall()
+        if not rows:
+            continue
+        data = np.array(rows, dtype='f8')  # None -> NaN
+        series[n] = (data[:, 0], {m: data[:, i + 1] for i, m in enumerate(METRICS)})
+    return resolution, series
+
+
+def _rolling_sums(values, window):
+    """Trailing-window (sum, sum of squares, count) over non-NaN values, same length as values"""
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    sums = []
+    for column in (filled, filled * filled, valid.astype('f8')):
+        total = np.cumsum(column)
+        total[window:] -= total[:-window].copy()
+        sums.append(total)
+    return sums
+
+
+def moving_average(values, window=MOVING_WINDOW, sums=None):
+    total, _, count = sums or _rolling_sums(values, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total / count
+
+
+def rate_of_change(t, values):
+    """Change per hour between consecutive points (first point NaN)"""
+    rate = np.full(len(values), np.nan)
+    if len(values) > 1:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rate[1:] = np.diff(values) / np.diff(t) * 3600.0
+    return rate
+
+
+def zscores(values, window=MOVING_WINDOW, sums=None):
+    """Each point against the mean / std of the `window` points before it"""
+    total, squares, count = sums or _rolling_sums(values, window)
+    z = np.full(len(values), np.nan)
+    # Window ending one point earlier, so a spike doesn't hide in its own statistics
+    total, squares, count, current = total[:-1], squares[:-1], count[:-1], values[1:]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(squares / count - mean * mean, 0.0))
+        z[1:] = (current - mean) / std
+    z[1:][(count < 2) | (std == 0)] = np.nan
+    return z
+
+
+def downsample(values, points=SERIES_POINTS):
+    """Average consecutive points so at most `points` remain (NaN-aware)"""
+    if len(values) <= points:
+        return values
+    edges = np.linspace(0, len(values), points + 1).astype(int)
+    valid = ~np.isnan(values)
+    sums = np.add.reduceat(np.where(valid, values, 0.0), edges[:-1])
+    counts = np.add.reduceat(valid.astype('f8'), edges[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def _compact(values, decimals=2):
+    """JSON list with NaN -> None"""
+    rounded = np.round(values, decimals)
+    return [None if v != v else v for v in rounded.tolist()]
+
+
+def analyze_metric(t, values, window=MOVING_WINDOW, threshold=ZSCORE_THRESHOLD, points=SERIES_POINTS):
+    valid = values[~np.isnan(values)]
+    if not len(valid):
+        return None
+
+    sums = _rolling_sums(values, window)
+    ma = moving_average(values, window, sums)
+    rate = rate_of_change(t, values)
+    z = zscores(values, window, sums)
+
+    rates = rate[~np.isnan(rate)]
+    with np.errstate(invalid='ignore'):
+        anomalous = np.abs(z) > threshold  # NaN compares False
+    flagged = np.flatnonzero(anomalous)
+    anomaly_count = len(flagged)
+    if anomaly_count > MAX_ANOMALIES:
+        flagged = np.sort(flagged[np.argsort(-np.abs(z[flagged]))[:MAX_ANOMALIES]])
+
+    return {
+        'mean': round(float(valid.mean()), 2),
+        'std': round(float(valid.std()), 2),
+        'min': round(float(valid.min()), 2),
+        'max': round(float(valid.max()), 2),
+        'percentiles': dict(zip((f"p{p}" for p in PERCENTILES),
+                                _compact(np.percentile(valid, PERCENTILES)))),
+        'rate_per_hour': {
+            'last': _compact(rate[-1:])[0],
+            'min': round(float(rates.min()), 2) if len(rates) else None,
+            'max': round(float(rates.max()), 2) if len(rates) else None,
+        },
+        'anomaly_count': anomaly_count,
+        'anomalies': {
+            't': _compact(t[flagged] - t[0], 0),
+            'value': _compact(values[flagged]),
+            'z': _compact(z[flagged]),
+        },
+        'series': {
+            'value': _compact(downsample(values, points)),
+            'moving_average': _compact(downsample(ma, points)),
+            'rate_per_hour': _compact(downsample(rate, points)),
+        },
+    }
+
+
+def analyze(series, window=MOVING_WINDOW, threshold=ZSCORE_THRESHOLD, points=SERIES_POINTS):
+    """{node: analysis} for the output of load_series; times are offsets from 'start' in seconds"""
+    result = {}
+    for node, (t, metrics) in series.items():
+        result[node] = {
+            'start': (EPOCH + timedelta(seconds=float(t[0]))).isoformat(),
+            'samples': len(t),
+            't': _compact(downsample(t - t[0], points), 0),
+            'metrics': {m: analyze_metric(t, values, window, threshold, points) for m, values in metrics.items()},
+        }
+    return result
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Columnar History Archive
+Xuất lịch sử cảm biến theo từng ngày đã đóng sang file cột nén (NumPy .npz hoặc Parquet),
+có manifest để chạy tăng dần / tiếp tục khi bị ngắt, và API đọc memory-map để phân tích nhanh
+
+Usage:
+    python3 archive.py [--format npz|parquet] [--out archive_dir] [db_file]   # Export closed days
+
+Run it daily (cron) so days are archived before retention.py deletes them.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional; .npz only needs NumPy
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+
+# ===== ARCHIVE CONFIGURATION =====
+ARCHIVE_DIR = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/archive"
+ARCHIVE_FORMAT = "npz"        # 'npz' (NumPy, always available) or 'parquet' (needs pyarrow)
+EXPORT_CHUNK_ROWS = 5000      # Rows fetched per round trip while reading a partition
+INT_NULL = -1                 # NULL in integer / boolean columns (sensor values are never negative)
+
+# Column types: 'i8' integer, 'f8' real (NULL -> NaN), 'U' text, 'M8' timestamp (NULL -> NaT).
+# 'pending' marks a day that can still change; it is exported once no row matches.
+ARCHIVE_TABLES = {
+    'environmental_data': {
+        'columns': [('id', 'i8'), ('room', 'U'), ('node', 'U'), ('temperature', 'f8'), ('humidity', 'f8'),
+                    ('gas_analog', 'i8'), ('gas_status', 'U'), ('fire_detected', 'i8'), ('timestamp', 'M8')],
+    },
+    'door_status': {
+        'columns': [('id', 'i8'), ('room', 'U'), ('node', 'U'), ('door_state', 'U'), ('door_angle', 'i8'),
+                    ('presence_detected', 'i8'), ('last_action', 'U'), ('manual_override', 'i8'),
+                    ('timestamp', 'M8')],
+    },
+    'alerts': {
+        'columns': [('id', 'i8'), ('room', 'U'), ('node', 'U'), ('alert_type', 'U'), ('message', 'U'),
+                    ('severity', 'U'), ('resolved', 'i8'), ('occurrences', 'i8'), ('resolved_at', 'M8'),
+                    ('timestamp', 'M8')],
+        'pending': 'resolved = 0',
+    },
+}
+
+MANIFEST = "manifest.json"
+MMAP_CACHE = ".mmap"
+
+
+def to_array(values, kind):
+    """One column of Python values from sqlite3 -> typed NumPy array"""
+    if kind == 'f8':
+        return np.array([np.nan if v is None else v for v in values], dtype='f8')
+    if kind == 'i8':
+        return np.array([INT_NULL if v is None else int(v) for v in values], dtype='i8')
+    if kind == 'M8':
+        return np.array(['NaT' if v is None else v for v in values], dtype='M8[us]')
+    strings = ['' if v is None else str(v) for v in values]
+    return np.array(strings, dtype=f"U{max(map(len, strings), default=1) or 1}")
+
+
+def _atomic_write(path, write):
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+class ArchiveExporter:
+    """Export one file per (table, closed day); the manifest records what is done"""
+
+    def __init__(self, db_file, archive_dir=ARCHIVE_DIR, fmt=ARCHIVE_FORMAT, tables=ARCHIVE_TABLES,
+                 chunk_rows=EXPORT_CHUNK_ROWS):
+        if fmt == 'parquet' and pq is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip3 install pyarrow), or use --format npz")
+        self.db_file = db_file
+        self.archive_dir = archive_dir
+        self.fmt = fmt
+        self.tables = tables
+        self.chunk_rows = chunk_rows
+        self.manifest = load_manifest(archive_dir)
+
+    def _connect(self):
+        # Read-only: the export never takes a write lock on the live database
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+
+    def pending_days(self, conn, table, today=None):
+        """Closed days of `table` not in the manifest yet, oldest first"""
+        today = today or date.today()
+        done = self.manifest['tables'].get(table, {})
+        first = conn.execute(f"SELECT MIN(timestamp) FROM {table}").fetchone()[0]
+        if first is None:
+            return []
+        day = datetime.fromisoformat(first).date()
+        days = []
+        while day < today:
+            if day.isoformat() not in done:
+                days.append(day)
+            day += timedelta(days=1)
+        return days
+
+    def export_day(self, conn, table, day):
+        """Write one partition; returns its manifest entry, or None if the day isn't settled yet"""
+        spec = self.tables[table]
+        bounds = (day.isoformat(), (day + timedelta(days=1)).isoformat())
+
+        if spec.get('pending') and conn.execute(
+                f"SELECT 1 FROM {table} WHERE timestamp >= ? AND timestamp < ? AND {spec['pending']} LIMIT 1",
+                bounds).fetchone():
+            return None
+
+        names = [name for name, _ in spec['columns']]
+        values = [[] for _ in names]
+        cursor = conn.execute(
+            f"SELECT {', '.join(names)} FROM {table} WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+            bounds)
+        while True:
+            rows = cursor.fetchmany(self.chunk_rows)
+            if not rows:
+                break
+            for column, row_values in zip(values, zip(*rows)):
+                column.extend(row_values)
+
+        rows = len(values[0])
+        if not rows:
+            # Recorded so the day isn't queried again, but no file is written
+            return {'file': None, 'format': self.fmt, 'rows': 0,
+                    'exported_at': datetime.now().isoformat(timespec='seconds')}
+        arrays = {name: to_array(column, kind) for (name, kind), column in zip(spec['columns'], values)}
+
+        os.makedirs(os.path.join(self.archive_dir, table), exist_ok=True)
+        relative = os.path.join(table, f"{day.isoformat()}.{self.fmt}")
+        path = os.path.join(self.archive_dir, relative)
+        if self.fmt == 'parquet':
+            _atomic_write(path, lambda tmp: pq.write_table(pa.table(arrays), tmp, compression='zstd'))
+        else:
+            # np.savez_compressed appends .npz to names without it; write through a file object
+            def write_npz(tmp):
+                with open(tmp, 'wb') as f:
+                    np.savez_compressed(f, **arrays)
+            _atomic_write(path, write_npz)
+
+        return {
+            'file': relative,
+            'format': self.fmt,
+            'rows': rows,
+            'bytes': os.path.getsize(path),
+            'min_id': int(arrays['id'].min()),
+            'max_id': int(arrays['id'].max()),
+            'exported_at': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def run_once(self, today=None):
+        """Export every pending closed day. Safe to interrupt: finished days stay recorded."""
+        started = time.monotonic()
+        exported = {}
+        conn = self._connect()
+        try:
+            for table in self.tables:
+                count = 0
+                for day in self.pending_days(conn, table, today):
+                    entry = self.export_day(conn, table, day)
+                    if entry is None:
+                        continue
+                    self.manifest['tables'].setdefault(table, {})[day.isoformat()] = entry
+                    save_manifest(self.archive_dir, self.manifest)
+                    count += 1
+                exported[table] = count
+        finally:
+            conn.close()
+
+        logger.info(f"Archive export: {sum(exported.values())} partitions in "
+                    f"{time.monotonic() - started:.2f}s {exported}")
+        return exported
+
+
+def load_manifest(archive_dir):
+    path = os.path.join(archive_dir, MANIFEST)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 1, 'tables': {}}
+
+
+def save_manifest(archive_dir, manifest):
+    os.makedirs(archive_dir, exist_ok=True)
+
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+    _atomic_write(os.path.join(archive_dir, MANIFEST), write)
+
+
+class ArchiveReader:
+    """Read archived partitions. .npz files are unpacked once into plain .npy files under
+    .mmap/ and memory-mapped, so scanning a month maps files instead of decompressing them."""
+
+    def __init__(self, archive_dir=ARCHIVE_DIR):
+        self.archive_dir = archive_dir
+        self.manifest = load_manifest(archive_dir)
+
+    def days(self, table, start=None, end=None):
+        """Archived days of `table` with start <= day < end (ISO strings or dates)"""
+        start = str(start) if start else ''
+        end = str(end) if end else '9999'
+        return sorted(day for day in self.manifest['tables'].get(table, {}) if start <= day < end)
+
+    def partitions(self, table, start=None, end=None, columns=None):
+        """Yield (day, {column: array}) per archived day, arrays memory-mapped where possible"""
+        for day in self.days(table, start, end):
+            entry = self.manifest['tables'][table][day]
+            if entry['file'] is None:
+                continue
+            path = os.path.join(self.archive_dir, entry['file'])
+            if entry['format'] == 'parquet':
+                if pq is None:
+                    raise RuntimeError("Reading Parquet partitions needs pyarrow")
+                data = pq.read_table(path, columns=columns, memory_map=True)
+                yield day, {name: data.column(name).to_numpy() for name in data.column_names}
+            else:
+                yield day, self._mapped_npz(table, day, path, columns)
+
+    def scan(self, table, start=None, end=None, columns=None):
+        """All partitions in range concatenated into one array per column"""
+        parts = [arrays for _, arrays in self.partitions(table, start, end, columns)]
+        if not parts:
+            return {}
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    def month(self, table, year, month, columns=None):
+        start = date(year, month, 1)
+        end = date(year + month // 12, month % 12 + 1, 1)
+        return self.scan(table, start, end, columns)
+
+    def _mapped_npz(self, table, day, path, columns):
+        cache = os.path.join(self.archive_dir, MMAP_CACHE, table, day)
+        stamp = os.path.join(cache, ".complete")
+        if not os.path.exists(stamp) or os.path.getmtime(stamp) < os.path.getmtime(path):
+            os.makedirs(cache, exist_ok=True)
+            with np.load(path) as npz:
+                for name in npz.files:
+                    _atomic_write(os.path.join(cache, f"{name}.npy"),
+                                  lambda tmp, name=name: _save_npy(tmp, npz[name]))
+            open(stamp, 'w').close()
+
+        names = columns or [f[:-4] for f in sorted(os.listdir(cache)) if f.endswith('.npy')]
+        return {name: np.load(os.path.join(cache, f"{name}.npy"), mmap_mode='r') for name in names}
+
+
+def _save_npy(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    args = sys.argv[1:]
+    fmt = ARCHIVE_FORMAT
+    out = ARCHIVE_DIR
+    if "--format" in args:
+        i = args.index("--format")
+        fmt = args[i + 1]
+        del args[i:i + 2]
+    if "--out" in args:
+        i = args.index("--out")
+        out = args[i + 1]
+        del args[i:i + 2]
+
+    ArchiveExporter(args[0] if args else DB_FILE, out, fmt).run_once()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Async Ingest Pipeline
+Tách xử lý message MQTT thành các stage asyncio (receive → parse → route → persist / alert)
+nối với nhau bằng queue có giới hạn, mỗi stage có số worker và số liệu latency riêng
+
+Paho keeps its network loop (keep-alives, acks) on its own thread via loop_start();
+the callback only hands the raw message to the event loop.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import MQTT_MESSAGES, REGISTRY
+from topic_router import ROUTER, payload_for
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = REGISTRY.histogram('smarthome_ingest_stage_seconds', 'Time spent in one pipeline stage', ('stage',))
+STAGE_FAILURES = REGISTRY.counter('smarthome_ingest_stage_failures_total', 'Items a pipeline stage failed on',
+                                  ('stage',))
+
+# ===== PIPELINE CONFIGURATION =====
+ASYNC_QUEUE_SIZE = 1000       # Per-stage queue bound; a full queue pushes back on the stage before it
+STAGE_CONCURRENCY = {
+    'parse': 1,               # Must stay 1, like route: two parse workers can swap a node's messages
+    'route': 1,               # Must stay 1: the reading assembler relies on per-node message order
+    'persist': 1,
+    'alert': 1,
+}
+STATS_INTERVAL = 60           # Seconds between stage latency summaries in the log
+WRITER_FULL_BACKOFF = 0.01    # Seconds to wait when the DB writer queue is full
+
+
+class StageStats:
+    """Counters and recent latency samples for one pipeline stage"""
+
+    def __init__(self, name, samples=1000):
+        self.name = name
+        self.processed = 0
+        self.errors = 0
+        self.max_ms = 0.0
+        self._samples = deque(maxlen=samples)
+
+    def record(self, ms, ok=True):
+        if ok:
+            self.processed += 1
+        else:
+            self.errors += 1
+        self._samples.append(ms)
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, p):
+        if not self._samples:
+            return 0.0
+        data = sorted(self._samples)
+        return data[min(len(data) - 1, int(len(data) * p / 100))]
+
+    def summary(self):
+        return {
+            'processed': self.processed,
+            'errors': self.errors,
+            'p50_ms': round(self.percentile(50), 3),
+            'p95_ms': round(self.percentile(95), 3),
+            'max_ms': round(self.max_ms, 3),
+        }
+
+
+class AsyncIngestPipeline:
+    """Staged asyncio ingest for SmartHomeMQTTReceiver, same topic handling as on_message"""
+
+    def __init__(self, receiver, queue_size=ASYNC_QUEUE_SIZE, concurrency=STAGE_CONCURRENCY):
+        self.receiver = receiver
+        self.concurrency = concurrency
+        self.queues = {stage: asyncio.Queue(maxsize=queue_size) for stage in ('parse', 'route', 'persist', 'alert')}
+        self.stats = {name: StageStats(name) for name in ('receive', 'parse', 'route', 'persist', 'alert', 'end_to_end')}
+        self.loop = None
+        self._stop = asyncio.Event()
+        REGISTRY.callback('smarthome_ingest_queue_depth', 'Items waiting in front of each pipeline stage',
+                          lambda: {(stage,): queue.qsize() for stage, queue in self.queues.items()},
+                          labels=('stage',))
+
+    # ----- Stage 0: receive (runs on paho's network thread) -----
+    def on_message(self, client, userdata, msg):
+        if self.receiver.capture is not None:
+            self.receiver.capture.record(msg.topic, msg.payload)
+        self.loop.call_soon_threadsafe(self._receive, time.monotonic(), msg.topic, msg.payload)
+
+    def _receive(self, received, topic, payload):
+        # Latency here is the thread -> event loop hand-off
+        handoff_ms = (time.monotonic() - received) * 1000
+        try:
+            self.queues['parse'].put_nowait((received, topic, payload))
+            self.stats['receive'].record(handoff_ms)
+        except asyncio.QueueFull:
+            self.stats['receive'].record(handoff_ms, ok=False)
+
+    # ----- Stage 1: parse / validate -----
+    async def _parse(self, item):
+        received, topic, payload = item
+        match = ROUTER.resolve(topic)
+        MQTT_MESSAGES.inc((match.route.kind if match is not None and match.route is not None else 'other',))
+        if match is None:
+            raise ValueError(f"Unexpected topic {topic}")
+        payload = payload_for(match, payload)
+        self.receiver.message_log.record(topic, payload)
+        await self.queues['route'].put((received, topic, payload))
+
+    # ----- Stage 2: route (topic -> statements + alert observations) -----
+    async def _route(self, item):
+        received, topic, payload = item
+        writes, alerts = self.receiver.route_message(topic, payload)
+        if writes:
+            await self.queues['persist'].put((received, writes))
+        for alert in alerts:
+            await self.queues['alert'].put(alert)
+
+    # ----- Stage 3: persist (hand off to the DB writer thread) -----
+    async def _persist(self, item):
+        received, writes = item
+        writer = self.receiver.writer
+        for sql, params in writes:
+            # Wait instead of dropping: back-pressure flows up through the bounded queues
+            while writer.queue.full():
+                await asyncio.sleep(WRITER_FULL_BACKOFF)
+            writer.submit(sql, params)
+        self.stats['end_to_end'].record((time.monotonic() - received) * 1000)
+
+    # ----- Stage 4: alert -----
+    async def _alert(self, alert):
+        # The engine takes a lock shared with the background flush thread: keep it off the event loop
+        await self.loop.run_in_executor(None, self.receiver.observe_alert, *alert)
+
+    async def _worker(self, stage, handler):
+        inbox = self.queues[stage]
+        stats = self.stats[stage]
+        while True:
+            item = await inbox.get()
+            started = time.perf_counter()
+            ok = True
+            try:
+                await handler(item)
+            except Exception as e:
+                ok = False
+                STAGE_FAILURES.inc((stage,))
+                logger.error("Error in %s stage: %s", stage, e)
+            finally:
+                elapsed = time.perf_counter() - started
+                STAGE_SECONDS.observe(elapsed, (stage,))
+                stats.record(elapsed * 1000, ok)
+                inbox.task_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            depths = {stage: q.qsize() for stage, q in self.queues.items()}
+            logger.info(f"Pipeline queues {depths}")
+            for stats in self.stats.values():
+                logger.info(f"Stage {stats.name}: {stats.summary()}")
+
+    def stop(self):
+        """Ask run() to drain and return (thread-safe)"""
+        self.loop.call_soon_threadsafe(self._stop.set)
+
+    async def run(self, broker, port):
+        """Connect, run all stages until stop() or cancellation, then drain the queues"""
+        self.loop = asyncio.get_running_loop()
+        handlers = {'parse': self._parse, 'route': self._route, 'persist': self._persist, 'alert': self._alert}
+        tasks = [
+            asyncio.create_task(self._worker(stage, handler))
+            for stage, handler in handlers.items()
+            for _ in range(self.concurrency.get(stage, 1))
+        ]
+        tasks.append(asyncio.create_task(self._report()))
+
+        client = self.receiver.client
+        client.on_message = self.on_message
+        client.connect(broker, port, 60)
+        client.loop_start()
+
+        try:
+            await self._stop.wait()
+        finally:
+            client.loop_stop()
+            client.disconnect()
+            # Stage order matters: a drained route stage can still feed persist/alert
+            for stage in ('parse', 'route', 'persist', 'alert'):
+                try:
+                    await asyncio.wait_for(self.queues[stage].join(), timeout=2)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Dropped {self.queues[stage].qsize()} items in {stage} stage on shutdown")
+            for task in tasks:
+                task.cancel()
+            logger.info(f"Pipeline stopped: { {name: s.summary() for name, s in self.stats.items()} }")
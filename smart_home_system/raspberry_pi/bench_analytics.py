@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Analytics Benchmark
+Đo /api/analytics với 30 ngày dữ liệu 1 Hz của tất cả node: nạp mảng từ rollup / dữ liệu gốc
+và tính toán vector hoá, so với ngân sách latency tương tác
+
+Usage:
+    python3 bench_analytics.py [days] [nodes]
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import analytics
+import rollups
+import schema
+
+INTERACTIVE_BUDGET_MS = 1000  # What a dashboard click may cost on the Pi
+PI_SLOWDOWN = 6               # Rough Raspberry Pi 4 vs desktop x86 single-core factor (assumption)
+REPEATS = 5
+
+
+def synthetic(seconds, seed):
+    """1 Hz temperature / humidity / gas with a daily cycle, noise and a few injected spikes"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(seconds, dtype='f8')
+    day = np.sin(2 * np.pi * t / 86400)
+    temperature = 27 + 3 * day + rng.normal(0, 0.2, seconds)
+    humidity = 65 - 8 * day + rng.normal(0, 0.5, seconds)
+    gas = 800 + rng.normal(0, 15, seconds)
+    spikes = rng.choice(seconds, 20, replace=False)
+    gas[spikes] += 1500
+    temperature[spikes] += 15
+    return {'temperature': temperature, 'humidity': humidity, 'gas_analog': gas}
+
+
+def build_database(path, nodes, seconds, end):
+    """Rollups for the whole range (aggregated in NumPy), raw rows for the last raw window"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    schema.migrate(conn)
+    start = end - timedelta(seconds=seconds)
+    raw_seconds = min(seconds, int(analytics.ANALYTICS_RAW_HOURS * 3600))
+
+    for i, (room, node) in enumerate(nodes):
+        data = synthetic(seconds, i)
+        for _, table, width, fmt in rollups.RESOLUTIONS:
+            buckets = np.arange(seconds) // width
+            edges = np.flatnonzero(np.diff(buckets, prepend=-1))
+            counts = np.diff(np.append(edges, seconds))
+            rows = []
+            stats = [(np.add.reduceat(v, edges), np.minimum.reduceat(v, edges), np.maximum.reduceat(v, edges))
+                     for v in data.values()]
+            for b, first in enumerate(edges):
+                bucket = (start + timedelta(seconds=int(first))).strftime(fmt)
+                row = [room, node, bucket, int(counts[b])]
+                for sums, mins, maxs in stats:
+                    row += [int(counts[b]), float(sums[b]), float(mins[b]), float(maxs[b])]
+                rows.append(row)
+            conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+
+        offset = seconds - raw_seconds
+        conn.executemany('''
+            INSERT INTO environmental_data (room, node, temperature, humidity, gas_analog, gas_status, fire_detected, timestamp)
+            VALUES (?, ?, ?, ?, ?, 'SAFE', 0, ?)
+        ''', ((room, node, float(data['temperature'][s]), float(data['humidity'][s]), int(data['gas_analog'][s]),
+               start + timedelta(seconds=s)) for s in range(offset, seconds)))
+        conn.commit()
+    return conn
+
+
+def best_ms(fn):
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+def report(name, ms):
+    pi = ms * PI_SLOWDOWN
+    verdict = "OK" if pi <= INTERACTIVE_BUDGET_MS else "OVER BUDGET"
+    print(f"  {name:<44} {ms:9.1f} ms   ~{pi:8.0f} ms on a Pi   {verdict}")
+
+
+def run(days, node_count):
+    seconds = days * 86400
+    rooms = ['bedroom', 'livingroom']
+    nodes = [(rooms[i % len(rooms)], f"node{i // len(rooms) + 1}") for i in range(node_count)]
+    path = os.path.join(tempfile.mkdtemp(), "bench_analytics.db")
+
+    print(f"{days} days x 1 Hz x {node_count} nodes = {seconds * node_count:,} readings")
+    started = time.perf_counter()
+    conn = build_database(path, nodes, seconds, datetime.now())
+    print(f"  (database built in {time.perf_counter() - started:.1f}s: {path})")
+
+    full = {f"{room}/{node}": synthetic(seconds, i) for i, (room, node) in enumerate(nodes)}
+    t = np.arange(seconds, dtype='f8')
+    room = nodes[0][0]
+    hours = days * 24
+
+    print("Full-resolution compute (in memory, per node):")
+    report(f"analyze {seconds:,} points x 3 metrics",
+           best_ms(lambda: analytics.analyze({'n': (t, full[f"{nodes[0][0]}/{nodes[0][1]}"])})))
+
+    print(f"Endpoint path for room '{room}' (load + analyze + JSON):")
+    for label, h, resolution in ((f"{days} days, auto", hours, 'auto'),
+                                 (f"{days} days, 1m rollup", hours, '1m'),
+                                 (f"last {analytics.ANALYTICS_RAW_HOURS} h, raw rows",
+                                  analytics.ANALYTICS_RAW_HOURS, 'raw')):
+        def endpoint():
+            chosen, series = analytics.load_series(conn, room, h, resolution=resolution)
+            json.dumps({'resolution': chosen, 'nodes': analytics.analyze(series)})
+        chosen, series = analytics.load_series(conn, room, h, resolution=resolution)
+        points = sum(len(s[0]) for s in series.values())
+        report(f"{label} ({chosen}, {points:,} points)", best_ms(endpoint))
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+"""
+End-to-End Ingest Benchmark
+Giả lập N node ESP32 (cùng topic và payload như các sketch .ino) gửi vào mqtt_receiver.py và
+web_dashboard.py, đo latency message → commit DB, throughput, tốc độ tăng database và số emit Socket.IO
+
+Usage:
+    python3 bench_ingest.py [--nodes 40] [--rate 0.5] [--door-rate 0.05] [--duration 60]
+                            [--payload text|tick] [--broker host[:port]] [--out results.json]
+
+--rate is sampling ticks per second per monitor node (0.5 = the sketches' 2 s); 0 publishes flat out.
+Without --broker, messages go straight into the receiver / dashboard callbacks (no network);
+with it, a paho client publishes to a real broker the receiver and dashboard are subscribed to.
+Results are printed and saved as JSON (default bench_ingest_<time>.json) to track regressions.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+import mqtt_receiver
+import telemetry
+import web_dashboard
+from node_registry import HEARTBEAT_INTERVAL
+
+# ===== BENCHMARK CONFIGURATION =====
+DEFAULT_NODES = 40            # Half monitor nodes (node1), half door nodes (node2), two per room
+DEFAULT_RATE = 0.5            # Monitor ticks per second per node (SENSOR_READ_INTERVAL = 2 s)
+DEFAULT_DOOR_RATE = 0.05      # Door events per second per door node (doors publish on change)
+DEFAULT_DURATION = 60         # Seconds of publishing
+DRAIN_TIMEOUT = 30            # Max seconds to wait for the receiver to catch up afterwards
+PUBLISH_QOS = 1               # QoS 1 keeps per-topic order, which the latency probe relies on
+ROOM_NAMES = ('bedroom', 'livingroom', 'kitchen', 'bathroom', 'garage', 'office')
+COUNTED_TABLES = ('environmental_data', 'door_status', 'system_status', 'alerts')
+
+Message = namedtuple('Message', ['topic', 'payload'])
+
+
+class SimulatedNode:
+    """One ESP32 node producing the .ino sketches' topics and payload shapes"""
+
+    def __init__(self, room, node, kind, payload_format, rng):
+        self.room = room
+        self.node = node
+        self.kind = kind  # 'monitor' or 'door'
+        self.payload_format = payload_format
+        self.rng = rng
+        self.started = time.monotonic()
+        self.temperature = rng.uniform(24, 30)
+        self.humidity = rng.uniform(55, 75)
+        self.door_open = False
+        self.presence = False
+
+    def _topic(self, device, attribute):
+        return f"home/{self.room}/{self.node}/{device}/{attribute}"
+
+    def _uptime(self):
+        return int(time.monotonic() - self.started)
+
+    def tick(self):
+        """One sampling tick of a monitor node (publishSensorData)"""
+        rng = self.rng
+        self.temperature += rng.gauss(0, 0.1)
+        self.humidity += rng.gauss(0, 0.2)
+        gas_analog = int(rng.gauss(900, 60))
+        # An occasional gas warning / fire keeps the alert path exercised
+        gas_status = 'WARNING' if rng.random() < 0.005 else 'SAFE'
+        fire = rng.random() < 0.001
+        fields = {
+            'temperature': round(self.temperature, 1),
+            'humidity': round(self.humidity, 1),
+            'gas_analog': gas_analog,
+            'gas_status': gas_status,
+            'fire_detected': fire,
+        }
+
+        if self.payload_format == 'tick':
+            messages = [Message(self._topic('telemetry', 'tick'), telemetry.encode(fields))]
+        else:
+            messages = [Message(self._topic(device, attribute), text.encode())
+                        for device, attribute, text in telemetry.legacy_messages(fields)]
+
+        alarm = fire or gas_status != 'SAFE'
+        messages.append(Message(self._topic('led_system', 'status'), json.dumps(
+            {'green': int(not alarm), 'yellow': int(gas_status == 'WARNING'), 'red': int(fire)}).encode()))
+        messages.append(Message(self._topic('buzzer', 'status'), json.dumps(
+            {'active': alarm, 'level': 'FIRE' if fire else (gas_status if alarm else 'OFF')}).encode()))
+        return messages
+
+    def door(self):
+        """Presence change plus the resulting door status (readSensorData / publishDoorStatus)"""
+        self.presence = not self.presence
+        self.door_open = self.presence
+        return [
+            Message(self._topic('ir_sensor', 'value'), json.dumps({
+                'presence': self.presence, 'sensor_type': 'IR_digital',
+                'signal_strength': self.rng.randint(-80, -40), 'timestamp': self._uptime()}).encode()),
+            Message(self._topic('door', 'status'), json.dumps({
+                'angle': 90 if self.door_open else 0, 'state': 'open' if self.door_open else 'closed',
+                'presence': self.presence, 'seconds_since_person': 0, 'last_action': 'auto',
+                'manual_override': False, 'override_remaining': 0, 'uptime': self._uptime(),
+                'free_heap': 200000, 'wifi_rssi': self.rng.randint(-80, -40),
+                'timestamp': self._uptime()}).encode()),
+        ]
+
+    def heartbeat(self):
+        return [Message("home/system/heartbeat", json.dumps({
+            'room': self.room, 'node': self.node,
+            'type': 'environmental_monitor' if self.kind == 'monitor' else 'smart_door',
+            'uptime': self._uptime(), 'free_heap': 200000, 'wifi_rssi': self.rng.randint(-80, -40),
+            'timestamp': self._uptime()}).encode())]
+
+    def online(self):
+        return [Message("home/system/status", json.dumps({
+            'room': self.room, 'node': self.node, 'status': 'online',
+            'ip': f"192.168.1.{self.rng.randint(10, 250)}", 'timestamp': 0}).encode())]
+
+
+def build_fleet(count, payload_format, seed=1):
+    rng = random.Random(seed)
+    fleet = []
+    for i in range(count):
+        pair, door = divmod(i, 2)
+        room = ROOM_NAMES[pair % len(ROOM_NAMES)] + (str(pair // len(ROOM_NAMES) + 1) if pair >= len(ROOM_NAMES) else '')
+        fleet.append(SimulatedNode(room, f"node{door + 1}", 'door' if door else 'monitor', payload_format, rng))
+    return fleet
+
+
+class LatencyProbe:
+    """Message -> commit latency. Publish times are queued per topic (delivery is in order per
+    topic); the first statement a message produces is tagged and timed when its batch commits."""
+
+    def __init__(self, receiver):
+        self.receiver = receiver
+        self.samples = []
+        self.received = 0
+        self.last_received = None
+        self._sent = defaultdict(deque)
+        self._tagged = {}  # id(params) -> (params, sent)
+        self._local = threading.local()
+
+        self._on_message = receiver.on_message
+        self._persist = receiver.persist
+        receiver.on_message = self.on_message
+        receiver.client.on_message = self.on_message
+        receiver.persist = self.persist
+        receiver.writer.on_commit = self.on_commit
+
+    def published(self, topic):
+        self._sent[topic].append(time.monotonic())
+
+    def on_message(self, client, userdata, msg):
+        queue = self._sent.get(msg.topic)
+        self._local.sent = queue.popleft() if queue else None  # None: the receiver's own liveness
+        self._on_message(client, userdata, msg)
+        self._local.sent = None
+        now = time.monotonic()
+        self.last_received = now
+        self.received += 1
+
+    def persist(self, writes):
+        sent = getattr(self._local, 'sent', None)
+        if sent is not None and writes:
+            params = writes[0][1]
+            self._tagged[id(params)] = (params, sent)
+            self._local.sent = None
+        self._persist(writes)
+
+    def on_commit(self, batch, committed):
+        for _, params in batch:
+            tagged = self._tagged.pop(id(params), None)
+            if tagged is not None and tagged[0] is params:
+                self.samples.append((committed - tagged[1]) * 1000)
+
+    def pending(self):
+        return sum(len(queue) for queue in self._sent.values())
+
+
+class EmitCounter:
+    """Count Socket.IO emits from the dashboard's broadcaster, flushed once per frame"""
+
+    def __init__(self):
+        self.emits = defaultdict(int)
+        self.updates = 0
+        self._stop = threading.Event()
+        web_dashboard.socketio.emit = self.emit
+        # One browser watching everything, as on the default dashboard page
+        web_dashboard.subscriptions.set_view('bench', web_dashboard.normalize_view({}))
+
+    def emit(self, event, data=None, **kwargs):
+        self.emits[event] += 1
+        if isinstance(data, dict):
+            self.updates += len(data.get('updates', ()))
+
+    def run(self):
+        while not self._stop.wait(web_dashboard.broadcaster.frame):
+            web_dashboard.broadcaster.flush()
+
+    def stop(self):
+        self._stop.set()
+        web_dashboard.broadcaster.flush()
+
+
+class InProcessTransport:
+    """Hand messages straight to the receiver and dashboard callbacks, as paho would"""
+
+    name = 'in-process'
+
+    def __init__(self, receiver_callback):
+        self.receiver_callback = receiver_callback
+
+    def start(self):
+        pass
+
+    def publish(self, message):
+        self.receiver_callback(None, None, message)
+        web_dashboard.on_mqtt_message(None, None, message)
+
+    def stop(self):
+        pass
+
+
+class BrokerTransport:
+    """Publish through a real broker; the receiver and dashboard clients subscribe as in production"""
+
+    def __init__(self, receiver, host, port):
+        self.name = f"broker {host}:{port}"
+        self.receiver = receiver
+        self.host = host
+        self.port = port
+        self.publisher = mqtt.Client(client_id=f"bench-ingest-{os.getpid()}")
+
+    def start(self):
+        for client in (self.receiver.client, web_dashboard.mqtt_client, self.publisher):
+            client.connect(self.host, self.port, 60)
+            client.loop_start()
+        time.sleep(1)  # Let the subscriptions land before the first publish
+
+    def publish(self, message):
+        self.publisher.publish(message.topic, message.payload, qos=PUBLISH_QOS)
+
+    def stop(self):
+        for client in (self.publisher, web_dashboard.mqtt_client, self.receiver.client):
+            client.loop_stop()
+            client.disconnect()
+
+
+def percentile(ordered, p):
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2)
+
+
+def database_size(path):
+    return sum(os.path.getsize(f) for f in (path, path + "-wal") if os.path.exists(f))
+
+
+def count_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in COUNTED_TABLES}
+    finally:
+        conn.close()
+
+
+def run(nodes, rate, door_rate, duration, payload_format, broker=None, db_file=None):
+    db_file = db_file or os.path.join(tempfile.mkdtemp(), "bench_ingest.db")
+    mqtt_receiver.DB_FILE = db_file
+    receiver = mqtt_receiver.SmartHomeMQTTReceiver()
+    probe = LatencyProbe(receiver)
+    emits = EmitCounter()
+    if broker:
+        host, _, port = broker.partition(':')
+        transport = BrokerTransport(receiver, host, int(port or mqtt_receiver.MQTT_PORT))
+    else:
+        transport = InProcessTransport(probe.on_message)
+
+    fleet = build_fleet(nodes, payload_format)
+    size_before = database_size(db_file)
+    rows_before = count_rows(db_file)
+
+    receiver.start_background()
+    threading.Thread(target=emits.run, name="bench-broadcast", daemon=True).start()
+    transport.start()
+
+    # (due, seq, node, event) heap; ticks are staggered so nodes don't publish in lockstep
+    tick_period = 1 / rate if rate else 0.0
+    door_period = 1 / door_rate if door_rate else None
+    started_at = datetime.now().isoformat(timespec='seconds')
+    started = time.monotonic()
+    seq = itertools.count()
+    events = []
+    for node in fleet:
+        heapq.heappush(events, (started, next(seq), node, 'online'))
+        if node.kind == 'monitor':
+            heapq.heappush(events, (started + node.rng.uniform(0, tick_period), next(seq), node, 'tick'))
+        elif door_period:
+            heapq.heappush(events, (started + node.rng.uniform(0, door_period), next(seq), node, 'door'))
+
+    periods = {'tick': tick_period, 'door': door_period, 'heartbeat': HEARTBEAT_INTERVAL}
+    sent = defaultdict(int)
+    max_lag = 0.0
+    deadline = started + duration
+    while events:
+        due, _, node, event = heapq.heappop(events)
+        if due >= deadline:
+            break
+        now = time.monotonic()
+        if due > now:
+            time.sleep(due - now)
+        else:
+            max_lag = max(max_lag, now - due)
+
+        messages = getattr(node, event)()
+        for message in messages:
+            probe.published(message.topic)
+            transport.publish(message)
+        sent[event] += len(messages)
+
+        if event == 'online':
+            heapq.heappush(events, (due, next(seq), node, 'heartbeat'))
+            continue
+        next_due = due + periods[event]
+        if not rate:
+            # Flat out: schedule from now, so heartbeats still interleave
+            next_due = max(next_due, time.monotonic())
+        heapq.heappush(events, (next_due, next(seq), node, event))
+    publish_seconds = time.monotonic() - started
+
+    # Drain: everything delivered, assembled (READING_WINDOW) and committed
+    drain_deadline = time.monotonic() + DRAIN_TIMEOUT
+    while probe.pending() and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+    time.sleep(receiver.assembler.window + receiver.writer.batch_interval * 2)
+    while receiver.writer.queue.qsize() and time.monotonic() < drain_deadline:
+        time.sleep(0.05)
+    drained_seconds = time.monotonic() - started
+
+    transport.stop()
+    emits.stop()
+    receiver.shutdown()
+
+    total_sent = sum(sent.values())
+    latencies = sorted(probe.samples)
+    processing_seconds = ((probe.last_received or started) - started) or publish_seconds
+    size_after = database_size(db_file)
+    rows_after = count_rows(db_file)
+    readings = rows_after['environmental_data'] - rows_before['environmental_data']
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    size_checkpointed = database_size(db_file)
+
+    return {
+        'benchmark': 'ingest',
+        'started_at': started_at,
+        'config': {
+            'transport': transport.name,
+            'nodes': nodes,
+            'monitor_nodes': sum(node.kind == 'monitor' for node in fleet),
+            'rate_per_node': rate,
+            'door_rate_per_node': door_rate,
+            'duration_s': duration,
+            'payload': payload_format,
+            'database': db_file,
+        },
+        'messages': {
+            'sent': total_sent,
+            'sent_by_event': dict(sent),
+            'received': probe.received,
+            'offered_per_s': round(total_sent / publish_seconds, 1),
+            'processed_per_s': round(probe.received / processing_seconds, 1),
+            'max_publish_lag_ms': round(max_lag * 1000, 1),
+            'undelivered': probe.pending(),
+        },
+        'latency_ms': {
+            'samples': len(latencies),
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'p50': percentile(latencies, 50),
+            'p90': percentile(latencies, 90),
+            'p99': percentile(latencies, 99),
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+        'database': {
+            'rows_added': {table: rows_after[table] - rows_before[table] for table in COUNTED_TABLES},
+            'bytes_added': size_after - size_before,
+            'bytes_per_s': round((size_after - size_before) / drained_seconds, 1),
+            'bytes_per_reading': round((size_checkpointed - size_before) / readings, 1) if readings else None,
+            'projected_mb_per_day': round((size_checkpointed - size_before) / drained_seconds * 86400 / 2 ** 20, 1),
+        },
+        'socketio': {
+            'emits': dict(emits.emits),
+            'emits_per_s': round(sum(emits.emits.values()) / drained_seconds, 1),
+            'updates_per_s': round(emits.updates / drained_seconds, 1),
+            'skipped_unchanged': web_dashboard.broadcaster.skipped,
+        },
+        'writer': receiver.writer.stats(),
+    }
+
+
+def report(result):
+    config, messages, latency = result['config'], result['messages'], result['latency_ms']
+    database, socketio = result['database'], result['socketio']
+    print(f"{config['nodes']} nodes ({config['monitor_nodes']} monitors @ {config['rate_per_node']} ticks/s, "
+          f"{config['payload']} payloads) for {config['duration_s']}s via {config['transport']}")
+    print(f"  messages     sent {messages['sent']:,}  received {messages['received']:,}  "
+          f"offered {messages['offered_per_s']:,}/s  processed {messages['processed_per_s']:,}/s  "
+          f"max publish lag {messages['max_publish_lag_ms']} ms")
+    print(f"  latency      msg -> commit p50 {latency['p50']} ms  p90 {latency['p90']} ms  "
+          f"p99 {latency['p99']} ms  max {latency['max']} ms  ({latency['samples']:,} samples)")
+    print(f"  database     {database['rows_added']}  {database['bytes_per_s']:,} B/s  "
+          f"{database['bytes_per_reading']} B/reading  ~{database['projected_mb_per_day']} MB/day")
+    print(f"  socket.io    {socketio['emits_per_s']} emits/s  {socketio['updates_per_s']} updates/s")
+    print(f"  writer       {result['writer']}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {'--nodes': DEFAULT_NODES, '--rate': DEFAULT_RATE, '--door-rate': DEFAULT_DOOR_RATE,
+               '--duration': DEFAULT_DURATION, '--payload': 'text', '--broker': None, '--out': None,
+               '--db': None}
+    for name in options:
+        if name in args:
+            i = args.index(name)
+            options[name] = args[i + 1]
+            del args[i:i + 2]
+    if options['--payload'] not in ('text', 'tick'):
+        sys.exit("--payload must be 'text' or 'tick'")
+
+    # Per-topic "Received" lines would swamp the output
+    logging.getLogger('mqtt_receiver').setLevel(logging.WARNING)
+
+    result = run(int(options['--nodes']), float(options['--rate']), float(options['--door-rate']),
+                 float(options['--duration']), options['--payload'], options['--broker'], options['--db'])
+    report(result)
+
+    out = options['--out'] or f"bench_ingest_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {out}")
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Topic Router Microbenchmark
+Đo chi phí dispatch mỗi message: split/if-elif cũ so với TopicRouter
+
+Usage:
+    python3 bench_topic_router.py [iterations]
+"""
+
+import sys
+import timeit
+
+from topic_router import TopicRouter, Route
+
+# One sampling tick of a monitor node plus door / system traffic, as seen in mqtt_receiver.log
+TOPICS = [
+    "home/bedroom/node1/temperature_sensor/value",
+    "home/bedroom/node1/humidity_sensor/value",
+    "home/bedroom/node1/gas_sensor/analog_value",
+    "home/bedroom/node1/gas_sensor/status",
+    "home/bedroom/node1/flame_sensor/alert",
+    "home/bedroom/node1/led_system/status",
+    "home/bedroom/node1/buzzer/status",
+    "home/livingroom/node2/door/status",
+    "home/system/heartbeat",
+]
+
+
+def legacy_dispatch(topic):
+    """The split + if/elif chain both services used before topic_router"""
+    topic_parts = topic.split('/')
+    if len(topic_parts) >= 5 and topic_parts[0] == "home":
+        device = topic_parts[3]
+        attribute = topic_parts[4]
+        if device == "temperature_sensor" and attribute == "value":
+            return 'temperature'
+        elif device == "humidity_sensor" and attribute == "value":
+            return 'humidity'
+        elif device == "gas_sensor":
+            if attribute == "analog_value":
+                return 'gas_analog'
+            elif attribute == "status":
+                return 'gas_status'
+        elif device == "flame_sensor" and attribute == "alert":
+            return 'fire_detected'
+        elif device == "door" and attribute == "status":
+            return 'door'
+    elif topic.startswith("home/system/"):
+        return 'system'
+    return None
+
+
+def run(iterations):
+    router = TopicRouter()
+    # Extra sensor types: free for the router, one more elif for the legacy chain
+    for i in range(20):
+        router.register(f"extra_sensor_{i}", "value", Route('reading', f'extra_{i}', float))
+
+    cases = {
+        'legacy split + if/elif': lambda: [legacy_dispatch(t) for t in TOPICS],
+        'TopicRouter (cached)': lambda: [router.resolve(t) for t in TOPICS],
+        'TopicRouter (cold, no cache)': lambda: [router._compile(t) for t in TOPICS],
+    }
+
+    print(f"{len(TOPICS)} topics x {iterations} iterations")
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=iterations, repeat=5))
+        per_message_ns = best / (iterations * len(TOPICS)) * 1e9
+        print(f"  {name:<30} {per_message_ns:8.1f} ns/message")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+MQTT Traffic Capture
+Ghi lại mọi message nhận được (timestamp, topic, payload) vào file nhị phân chỉ-ghi-thêm, gọn
+(topic được đánh số một lần), để phát lại bằng replay.py
+
+Usage:
+    python3 mqtt_receiver.py --capture /home/pi/captures/house.cap   # Record while ingesting
+    python3 capture.py /home/pi/captures/house.cap                   # Summary of a capture
+"""
+
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ===== CAPTURE CONFIGURATION =====
+CAPTURE_FLUSH_INTERVAL = 1.0  # Seconds of records that may sit in the write buffer (lost on a crash)
+CAPTURE_BUFFER = 64 * 1024
+
+# File: MAGIC, then records. A topic is written once ('T' record) and referenced by id afterwards.
+#   'T' id:uint16 length:uint16 topic
+#   'M' timestamp:float64 (epoch seconds) topic_id:uint16 length:uint32 payload
+MAGIC = b"SHCAP\x00\x01\n"
+TOPIC_RECORD = struct.Struct('<cHH')
+MESSAGE_RECORD = struct.Struct('<cdHI')
+MAX_TOPICS = 0xFFFF
+
+
+class CaptureWriter:
+    """Append (time, topic, payload) records; safe to call from paho's network thread"""
+
+    def __init__(self, path, flush_interval=CAPTURE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.topics = {}
+        self.messages = 0
+        self._lock = threading.Lock()
+
+        # Reopening an existing capture continues it: reload its topic ids and drop a torn last record
+        end = len(MAGIC)
+        if os.path.exists(path) and os.path.getsize(path):
+            reader = CaptureReader(path)
+            for _ in reader:
+                pass
+            self.topics = {topic: i for i, topic in enumerate(reader.topics)}
+            end = reader.end
+        else:
+            with open(path, 'wb') as f:
+                f.write(MAGIC)
+        self._file = open(path, 'r+b', buffering=CAPTURE_BUFFER)
+        self._file.truncate(end)
+        self._file.seek(end)
+        self._flushed = time.monotonic()
+
+    def record(self, topic, payload, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._file is None:
+                return
+            topic_id = self.topics.get(topic)
+            if topic_id is None:
+                if len(self.topics) >= MAX_TOPICS:
+                    return
+                topic_id = self.topics[topic] = len(self.topics)
+                encoded = topic.encode('utf-8')
+                self._file.write(TOPIC_RECORD.pack(b'T', topic_id, len(encoded)) + encoded)
+            self._file.write(MESSAGE_RECORD.pack(b'M', timestamp, topic_id, len(payload)))
+            self._file.write(payload)
+            self.messages += 1
+
+            now = time.monotonic()
+            if now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        logger.info(f"Capture {self.path}: {self.messages} messages recorded")
+
+
+class CaptureReader:
+    """Iterate (timestamp, topic, payload) in recording order. Stops cleanly at a torn last record;
+    `end` is then the offset just after the last complete one."""
+
+    def __init__(self, path):
+        self.path = path
+        self.topics = []
+        self.end = len(MAGIC)
+
+    def __iter__(self):
+        with open(self.path, 'rb', buffering=CAPTURE_BUFFER) as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a capture file (or an unsupported version)")
+            while True:
+                tag = f.read(1)
+                if tag == b'T':
+                    rest = f.read(TOPIC_RECORD.size - 1)
+                    if len(rest) < TOPIC_RECORD.size - 1:
+                        return
+                    _, topic_id, length = TOPIC_RECORD.unpack(tag + rest)
+                    topic = f.read(length)
+                    if len(topic) < length:
+                        return
+                    if topic_id != len(self.topics):
+                        raise ValueError(f"{self.path}: topic ids out of order at offset {self.end}")
+                    self.topics.append(topic.decode('utf-8'))
+                elif tag == b'M':
+                    rest = f.read(MESSAGE_RECORD.size - 1)
+                    if len(rest) < MESSAGE_RECORD.size - 1:
+                        return
+                    _, timestamp, topic_id, length = MESSAGE_RECORD.unpack(tag + rest)
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        return
+                    self.end = f.tell()
+                    yield timestamp, self.topics[topic_id], payload
+                    continue
+                elif not tag:
+                    return
+                else:
+                    raise ValueError(f"{self.path}: corrupt record at offset {self.end}")
+                self.end = f.tell()
+
+
+def summarize(path):
+    messages = 0
+    size = 0
+    first = last = None
+    per_topic = Counter()
+    for timestamp, topic, payload in CaptureReader(path):
+        messages += 1
+        size += len(payload)
+        first = first or timestamp
+        last = timestamp
+        per_topic[topic] += 1
+
+    print(f"{path}: {messages:,} messages, {len(per_topic)} topics, {os.path.getsize(path):,} bytes "
+          f"({size:,} payload bytes)")
+    if messages:
+        span = last - first
+        print(f"  {datetime.fromtimestamp(first)} -> {datetime.fromtimestamp(last)} "
+              f"({span:.0f}s, {messages / span if span else 0:.1f} msg/s)")
+        for topic, count in per_topic.most_common(10):
+            print(f"  {count:10,}  {topic}")
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        summarize(arg)
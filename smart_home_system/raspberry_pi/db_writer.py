@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+SQLite Write-Behind Writer
+Thread ghi database riêng: giữ một connection lâu dài (WAL) và commit theo batch
+"""
+
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COMMIT_SECONDS = REGISTRY.histogram('smarthome_db_commit_seconds', 'Time to execute and commit one write batch')
+BATCH_STATEMENTS = REGISTRY.histogram('smarthome_db_batch_statements', 'Statements per committed write batch',
+                                      buckets=(1, 10, 50, 100, 250, 500, 1000))
+
+_TABLE_PATTERN = re.compile(r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE|DELETE\s+FROM)\s+(\w+)', re.IGNORECASE)
+
+
+class DatabaseWriter(threading.Thread):
+    """Dedicated writer thread that owns one SQLite connection and drains a bounded queue"""
+
+    def __init__(self, db_file, batch_size=500, batch_interval=0.25, queue_size=10000):
+        super().__init__(name="db-writer", daemon=True)
+        self.db_file = db_file
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+        # Back-pressure / throughput counters
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.commits = 0
+        self.max_depth = 0
+        self.last_commit_ms = 0.0
+        self._statement_tables = {}  # sql text -> table it writes (statements repeat, so parse once)
+        # Optional callback(batch, committed_monotonic) after each successful commit (benchmarks, metrics)
+        self.on_commit = None
+
+    def submit(self, sql, params=(), timeout=None):
+        """Enqueue one statement; without `timeout` never blocks. Returns False if the queue is (still) full."""
+        try:
+            if timeout:
+                self.queue.put((sql, params), timeout=timeout)
+            else:
+                self.queue.put_nowait((sql, params))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                dropped = self.dropped
+            if dropped == 1 or dropped % 1000 == 0:
+                logger.warning(f"DB write queue full, dropped {dropped} statements so far")
+            return False
+
+        depth = self.queue.qsize()
+        with self._lock:
+            self.enqueued += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def stats(self):
+        """Snapshot of writer counters"""
+        with self._lock:
+            return {
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'written': self.written,
+                'failed': self.failed,
+                'commits': self.commits,
+                'queue_depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'last_commit_ms': round(self.last_commit_ms, 2),
+            }
+
+    def stop(self, timeout=None):
+        """Flush everything still queued, then close the connection"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is durable across application crashes in WAL mode and avoids an fsync per commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def run(self):
+        conn = self._connect()
+        try:
+            while not (self._stop_event.is_set() and self.queue.empty()):
+                batch = self._collect_batch()
+                if batch:
+                    self._write_batch(conn, batch)
+        finally:
+            conn.close()
+            logger.info(f"DB writer stopped: {self.stats()}")
+
+    def _collect_batch(self):
+        """Wait for the first statement, then gather more until size or time threshold"""
+        try:
+            batch = [self.queue.get(timeout=self.batch_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _table_of(self, sql):
+        table = self._statement_tables.get(sql)
+        if table is None and sql not in self._statement_tables:
+            match = _TABLE_PATTERN.match(sql)
+            table = match.group(1) if match else None
+            self._statement_tables[sql] = table
+        return table
+
+    def _write_batch(self, conn, batch):
+        """Execute a batch in one transaction; a bad statement doesn't sink the others"""
+        started = time.monotonic()
+        ok = 0
+        failed = 0
+        tables = set()
+
+        for sql, params in batch:
+            try:
+                conn.execute(sql, params)
+                ok += 1
+                tables.add(self._table_of(sql))
+            except sqlite3.Error as e:
+                failed += 1
+                logger.error(f"Database error: {e}")
+
+        try:
+            # Change signal for readers (dashboard response cache), committed with the data
+            tables.discard(None)
+            if tables:
+                conn.executemany('''
+                    INSERT INTO table_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT (name) DO UPDATE SET version = version + 1
+                ''', [(table,) for table in tables])
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Batch commit error: {e}")
+            conn.rollback()
+            failed += ok
+            ok = 0
+
+        if ok and self.on_commit is not None:
+            self.on_commit(batch, time.monotonic())
+
+        elapsed = time.monotonic() - started
+        COMMIT_SECONDS.observe(elapsed)
+        BATCH_STATEMENTS.observe(len(batch))
+        with self._lock:
+            self.written += ok
+            self.failed += failed
+            self.commits += 1
+            self.last_commit_ms = elapsed * 1000
+
+
+class ForwardingWriter(DatabaseWriter):
+    """DatabaseWriter front end for a database another process writes (ingest_supervisor.py): same
+    bounded queue, drop accounting and batching, but each batch goes to `sink` as (key, batch).
+    'written' counts statements handed over; commits happen in the process that reads `sink`."""
+
+    def __init__(self, sink, key, batch_size=500, batch_interval=0.25, queue_size=10000):
+        super().__init__(None, batch_size, batch_interval, queue_size)
+        self.name = f"db-forward-{key}"
+        self.sink = sink
+        self.key = key
+
+    def run(self):
+        try:
+            while not (self._stop_event.is_set() and self.queue.empty()):
+                batch = self._collect_batch()
+                if batch:
+                    # Blocks while the writer process is behind; submit() then fills up and drops
+                    self.sink.put((self.key, batch))
+                    with self._lock:
+                        self.written += len(batch)
+                        self.commits += 1
+        finally:
+            logger.info(f"DB forwarder {self.key} stopped: {self.stats()}")
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Multi-Process Ingest Supervisor
+Chạy N worker process để ingest dùng nhiều core: supervisor giữ kết nối MQTT duy nhất và chia message
+cho worker theo hash của node, mỗi shard database chỉ do một writer process ghi; process chết thì tự
+khởi động lại, throughput của từng process được log và xuất ra /metrics
+
+Usage:
+    python3 ingest_supervisor.py [--workers 4] [--writers 1]   # Default: one worker per CPU core, one writer
+
+The supervisor is the only MQTT subscriber. It resolves each topic (a dict lookup; the node of a
+home/system/... message is read from its small JSON body) and queues (topic, payload) for worker
+crc32(home/room/node) % workers, in batches over a bounded multiprocessing queue. A node's messages
+therefore always reach the same worker, in order, while payload decoding, tick assembly, alerts and
+liveness are spread over all workers, the nodes of a single house included. Workers connect to the
+broker only to publish liveness transitions.
+
+Workers don't write the shards: their statement batches go over a multiprocessing queue to writer
+process crc32(home) % writers, which runs the shard's single DatabaseWriter thread and its retention.
+Each shard keeps exactly one writer, and each node's rows are committed in order.
+
+MQTT shared subscriptions ($share/...) are not used: the broker hands each message to any member of
+the group, which would split one node's status / door / reading sequence across processes.
+
+Worker i serves its own /metrics on METRICS_PORT + 1 + i, writer j on METRICS_PORT + 1 + workers + j;
+the supervisor's /metrics (METRICS_PORT) has the per-process totals and the dispatch counters.
+Workers and writers log through a queue to the supervisor, which alone writes mqtt_receiver.log
+(each line prefixed with the process name, e.g. "ingest-worker-2: ...").
+"""
+
+import functools
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import paho.mqtt.client as mqtt
+
+import mqtt_receiver
+import shards
+from db_writer import DatabaseWriter, ForwardingWriter
+from metrics import REGISTRY
+from retention import RetentionEngine
+from topic_router import ROUTER
+
+logger = logging.getLogger(__name__)
+
+# ===== SUPERVISOR CONFIGURATION =====
+DISPATCH_INTERVAL = 0.05      # Seconds a message may wait in the supervisor for its worker batch...
+DISPATCH_BATCH = 500          # ...or until the batch has this many messages
+WORKER_QUEUE_SIZE = 1000      # Batches waiting per worker; more are dropped (and counted)
+WRITER_QUEUE_SIZE = 1000      # Statement batches waiting per writer; workers block, then drop locally
+WRITER_SUBMIT_TIMEOUT = 30    # Seconds a writer process waits for room in a shard's write queue
+WORKER_REPORT_INTERVAL = 5    # Seconds between a process's counter reports to the supervisor
+THROUGHPUT_LOG_INTERVAL = 60  # Seconds between per-process throughput lines in the log
+SUPERVISE_INTERVAL = 1.0      # Seconds between process liveness checks
+WORKER_RESTART_DELAY = 1      # First restart delay; doubles while a process keeps crashing...
+WORKER_MAX_BACKOFF = 60       # ...up to this many seconds
+WORKER_STABLE_SECONDS = 300   # A process up this long counts as healthy again (backoff reset)
+WORKER_STOP_TIMEOUT = 15      # Seconds a process gets to flush before it is killed
+
+WorkerReport = namedtuple('WorkerReport', ['kind', 'index', 'pid', 'handled', 'homes', 'written', 'dropped'])
+Message = namedtuple('Message', ['topic', 'payload'])
+
+
+def partition(home, room, node, workers):
+    """Worker index that owns a node; stable across processes and restarts, unlike hash()"""
+    return zlib.crc32(f"{home}/{room}/{node}".encode('utf-8')) % workers
+
+
+def writer_for(home, writers):
+    """Writer process index that owns a home's shard"""
+    return zlib.crc32(home.encode('utf-8')) % writers
+
+
+def node_of(match, payload):
+    """(room, node) of a resolved message; system messages carry theirs in the JSON body"""
+    if match.device != 'system':
+        return match.room, match.node
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None, None
+    return (data.get('room'), data.get('node')) if isinstance(data, dict) else (None, None)
+
+
+def _interrupt(signum, frame):
+    # A second SIGTERM or Ctrl-C (systemd, an impatient user) must not cut the flush short
+    signal.signal(signum, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def _report_forever(make_report, reports):
+    while True:
+        time.sleep(WORKER_REPORT_INTERVAL)
+        reports.put(make_report())
+
+
+# ===== WORKER PROCESS =====
+class PartitionWorker(mqtt_receiver.MultiHomeReceiver):
+    """Worker `index`: the nodes partition() assigns to it, in every home. Messages come from the
+    supervisor's queue instead of a subscription; statements go to each home's writer process."""
+
+    def __init__(self, index, workers, inbox, writer_queues):
+        self.index = index
+        self.workers = workers
+        self.inbox = inbox
+        self.writer_queues = writer_queues
+        self.handled = 0
+        super().__init__()
+
+    def owns(self, home, room, node):
+        return partition(home, room, node, self.workers) == self.index
+
+    def create_receiver(self, home):
+        sink = self.writer_queues[writer_for(home, len(self.writer_queues))]
+        writer = ForwardingWriter(sink, home, mqtt_receiver.WRITE_BATCH_SIZE, mqtt_receiver.WRITE_BATCH_INTERVAL,
+                                  mqtt_receiver.WRITE_QUEUE_SIZE)
+        return mqtt_receiver.SmartHomeMQTTReceiver(
+            home=home, db_file=shards.shard_file(home, mqtt_receiver.DB_FILE, self.shard_dir), client=self.client,
+            writer=writer, owns=functools.partial(self.owns, home), stats_name=f"worker-{self.index}")
+
+    def on_connect(self, client, userdata, flags, rc):
+        # Publish-only connection: the supervisor does the subscribing
+        if rc == 0:
+            logger.info(f"Worker {self.index} connected to MQTT broker (publish only)")
+        else:
+            logger.error(f"Failed to connect to MQTT broker. Code: {rc}")
+
+    def report(self):
+        writers = [r.writer.stats() for r in list(self.homes.values())]
+        return WorkerReport('worker', self.index, os.getpid(), self.handled, len(self.homes),
+                            sum(w['written'] for w in writers), sum(w['dropped'] for w in writers))
+
+    def run(self):
+        logger.info(f"Starting ingest worker {self.index} with {len(self.homes)} homes...")
+        mqtt_receiver.start_metrics_server()
+        self.client.connect_async(mqtt_receiver.MQTT_BROKER, mqtt_receiver.MQTT_PORT, 60)
+        self.client.loop_start()
+        try:
+            # None: the supervisor has queued its last batch, so the inbox is drained once it arrives
+            for batch in iter(self.inbox.get, None):
+                for topic, payload in batch:
+                    self.on_message(self.client, None, Message(topic, payload))
+                    self.handled += 1
+            logger.info(f"Shutting down ingest worker {self.index}...")
+        finally:
+            self.client.loop_stop()
+            self.shutdown()
+
+
+def worker_main(index, workers, inbox, writer_queues, reports, logs, metrics_port):
+    """Entry point of worker `index`"""
+    mqtt_receiver.forward_logs(logs)
+    # Ctrl-C and systemd's SIGTERM reach the whole process group; only the supervisor reacts, and ends a
+    # worker with None behind its last batch so nothing queued is lost (flush every shard to its writer)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    reports.cancel_join_thread()  # Never block exit on reports nobody reads any more
+
+    mqtt_receiver.METRICS_PORT = metrics_port
+    worker = PartitionWorker(index, workers, inbox, writer_queues)
+    threading.Thread(target=_report_forever, args=(worker.report, reports),
+                     name="worker-report", daemon=True).start()
+    worker.run()
+
+
+# ===== WRITER PROCESS =====
+class ShardWriters:
+    """Writer `index`: the DatabaseWriter thread and retention of every home writer_for() assigns to
+    it, fed with the statement batches of all workers"""
+
+    def __init__(self, index, writers, inbox, shard_dir=shards.SHARD_DIR):
+        self.index = index
+        self.inbox = inbox
+        self.shard_dir = shard_dir
+        self.homes = {}  # home -> DatabaseWriter
+        self.received = 0
+        self._stop_event = threading.Event()
+
+        # Shards that already exist get their retention running now
+        os.makedirs(shard_dir, exist_ok=True)
+        for home in shards.list_homes(shard_dir):
+            if writer_for(home, writers) == index:
+                self.writer_of(home)
+
+    def writer_of(self, home):
+        writer = self.homes.get(home)
+        if writer is None:
+            db_file = shards.shard_file(home, mqtt_receiver.DB_FILE, self.shard_dir)
+            writer = DatabaseWriter(db_file, mqtt_receiver.WRITE_BATCH_SIZE, mqtt_receiver.WRITE_BATCH_INTERVAL,
+                                    mqtt_receiver.WRITE_QUEUE_SIZE)
+            writer.start()
+            threading.Thread(target=RetentionEngine(db_file).run_forever,
+                             args=(self._stop_event, mqtt_receiver.RETENTION_INTERVAL),
+                             name=f"retention-{home}", daemon=True).start()
+            self.homes[home] = writer
+            logger.info(f"Writer {self.index}: writing home {home} to {db_file}")
+        return writer
+
+    def report(self):
+        writers = [writer.stats() for writer in list(self.homes.values())]
+        return WorkerReport('writer', self.index, os.getpid(), self.received, len(self.homes),
+                            sum(w['written'] for w in writers), sum(w['dropped'] for w in writers))
+
+    def run(self):
+        logger.info(f"Starting shard writer {self.index} with {len(self.homes)} homes...")
+        mqtt_receiver.start_metrics_server()
+        try:
+            # None: the supervisor has stopped every worker, nothing more will arrive
+            for home, batch in iter(self.inbox.get, None):
+                writer = self.writer_of(home)
+                for sql, params in batch:
+                    writer.submit(sql, params, timeout=WRITER_SUBMIT_TIMEOUT)
+                self.received += len(batch)
+        finally:
+            self._stop_event.set()
+            for writer in self.homes.values():
+                writer.stop()
+
+
+def writer_main(index, writers, inbox, reports, logs, metrics_port):
+    """Entry point of writer `index`"""
+    mqtt_receiver.forward_logs(logs)
+    # Workers flush into the writers while they shut down, so only the supervisor's None ends a writer:
+    # Ctrl-C and systemd's SIGTERM to the whole group are ignored here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    reports.cancel_join_thread()
+
+    mqtt_receiver.METRICS_PORT = metrics_port
+    shard_writers = ShardWriters(index, writers, inbox)
+    threading.Thread(target=_report_forever, args=(shard_writers.report, reports),
+                     name="writer-report", daemon=True).start()
+    shard_writers.run()
+
+
+# ===== SUPERVISOR =====
+class Worker:
+    """One process slot (ingest worker or shard writer): its queue, current process, restart backoff
+    and last report. The queue outlives restarts, so a replacement picks up where the last one stopped."""
+
+    def __init__(self, kind, index, inbox):
+        self.kind = kind
+        self.index = index
+        self.name = f"{kind.capitalize()} {index}"
+        self.inbox = inbox
+        self.process = None
+        self.started = 0.0
+        self.restarts = 0
+        self.backoff = WORKER_RESTART_DELAY
+        self.next_start = None
+        self.report = None
+        self.reported_at = None
+        self.rate = 0.0
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class IngestSupervisor:
+    def __init__(self, workers, writers=1):
+        # Spawn, not fork: children must not inherit the supervisor's threads, log listener or sockets
+        self.context = multiprocessing.get_context('spawn')
+        self.reports = self.context.Queue()
+        # Child records, written out here by the same handlers as the supervisor's own
+        self.logs = self.context.Queue()
+        self.log_listener = logging.handlers.QueueListener(self.logs, *mqtt_receiver.log_handlers,
+                                                           respect_handler_level=True)
+        self.workers = [Worker('worker', i, self.context.Queue(WORKER_QUEUE_SIZE)) for i in range(workers)]
+        self.writers = [Worker('writer', j, self.context.Queue(WRITER_QUEUE_SIZE)) for j in range(writers)]
+
+        # Per-worker message batches, filled on paho's network thread and sent by the dispatch thread
+        self._pending = [[] for _ in self.workers]
+        self._dispatch_lock = threading.Lock()
+        self.dispatched = [0] * workers
+        self.dropped = [0] * workers
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+
+        for kind, slots in (('worker', self.workers), ('writer', self.writers)):
+            REGISTRY.callback(f'smarthome_{kind}_up', f'Ingest {kind} process running',
+                              functools.partial(lambda slots: {(str(w.index),): int(w.alive()) for w in slots}, slots),
+                              labels=(kind,))
+            REGISTRY.callback(f'smarthome_{kind}_restarts_total', f'Ingest {kind} restarts after an unexpected exit',
+                              functools.partial(lambda slots: {(str(w.index),): w.restarts for w in slots}, slots),
+                              labels=(kind,), kind='counter')
+        REGISTRY.callback('smarthome_worker_messages_total',
+                          'Messages handled per ingest worker (restarts from 0 with the worker)',
+                          lambda: {(str(w.index),): w.report.handled for w in self.workers if w.report},
+                          labels=('worker',), kind='counter')
+        REGISTRY.callback('smarthome_worker_messages_per_second', 'Messages handled per second, last report',
+                          lambda: {(str(w.index),): w.rate for w in self.workers}, labels=('worker',))
+        REGISTRY.callback('smarthome_worker_homes', 'Home shards open in each ingest worker',
+                          lambda: {(str(w.index),): w.report.homes for w in self.workers if w.report},
+                          labels=('worker',))
+        REGISTRY.callback('smarthome_worker_queue_depth', 'Message batches waiting for each ingest worker',
+                          lambda: {(str(w.index),): w.inbox.qsize() for w in self.workers}, labels=('worker',))
+        REGISTRY.callback('smarthome_dispatch_messages_total', 'Messages the supervisor queued or dropped per worker',
+                          lambda: dict([((str(i), 'queued'), n) for i, n in enumerate(self.dispatched)]
+                                       + [((str(i), 'dropped'), n) for i, n in enumerate(self.dropped)]),
+                          labels=('worker', 'result'), kind='counter')
+        REGISTRY.callback('smarthome_writer_statements_total', 'Statements committed per shard writer process',
+                          lambda: {(str(w.index),): w.report.written for w in self.writers if w.report},
+                          labels=('writer',), kind='counter')
+
+    # ----- Dispatch -----
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logger.info("Connected to MQTT broker successfully")
+            for topic in mqtt_receiver.MULTI_HOME_TOPICS:
+                client.subscribe(topic)
+                logger.info(f"Subscribed to: {topic}")
+        else:
+            logger.error(f"Failed to connect to MQTT broker. Code: {rc}")
+
+    def on_disconnect(self, client, userdata, rc):
+        logger.warning("Disconnected from MQTT broker")
+
+    def on_message(self, client, userdata, msg):
+        match = ROUTER.resolve(msg.topic)
+        if match is None:
+            return
+        room, node = node_of(match, msg.payload)
+        index = partition(match.home, room, node, len(self.workers))
+        with self._dispatch_lock:
+            pending = self._pending[index]
+            pending.append((msg.topic, msg.payload))
+            if len(pending) >= DISPATCH_BATCH:
+                self._send(index)
+
+    def _send(self, index):
+        # Called with _dispatch_lock held, so a worker's batches leave in arrival order
+        batch, self._pending[index] = self._pending[index], []
+        try:
+            self.workers[index].inbox.put_nowait(batch)
+            self.dispatched[index] += len(batch)
+        except queue.Full:
+            self.dropped[index] += len(batch)
+            if self.dropped[index] == len(batch):
+                logger.warning(f"Worker {index} is not keeping up: dropping its messages while its queue is full")
+
+    def flush(self):
+        with self._dispatch_lock:
+            for index, pending in enumerate(self._pending):
+                if pending:
+                    self._send(index)
+
+    def dispatch_forever(self, stop_event):
+        while not stop_event.wait(DISPATCH_INTERVAL):
+            self.flush()
+
+    # ----- Processes -----
+    def start(self, slot):
+        if slot.kind == 'worker':
+            offset = 1 + slot.index
+            target = worker_main
+            args = (slot.index, len(self.workers), slot.inbox, [w.inbox for w in self.writers], self.reports,
+                    self.logs)
+        else:
+            offset = 1 + len(self.workers) + slot.index
+            target = writer_main
+            args = (slot.index, len(self.writers), slot.inbox, self.reports, self.logs)
+        port = mqtt_receiver.METRICS_PORT + offset if mqtt_receiver.METRICS_PORT else None
+        slot.process = self.context.Process(target=target, args=args + (port,), name=f"ingest-{slot.kind}-{slot.index}")
+        slot.process.start()
+        slot.started = time.monotonic()
+        slot.report = slot.reported_at = None
+        slot.rate = 0.0
+        logger.info(f"Started {slot.kind} {slot.index} (pid {slot.process.pid}, metrics port {port})")
+
+    def check(self, slot, now):
+        """Restart a dead process, waiting longer each time it dies again soon after starting"""
+        if slot.alive():
+            if now - slot.started >= WORKER_STABLE_SECONDS:
+                slot.backoff = WORKER_RESTART_DELAY
+            return
+        if slot.next_start is None:
+            logger.error(f"{slot.name} (pid {slot.process.pid}) exited with code "
+                         f"{slot.process.exitcode}; restarting in {slot.backoff:.0f}s")
+            slot.next_start = now + slot.backoff
+            slot.backoff = min(slot.backoff * 2, WORKER_MAX_BACKOFF)
+        elif now >= slot.next_start:
+            slot.next_start = None
+            slot.restarts += 1
+            self.start(slot)
+
+    def collect(self, timeout):
+        """Take the reports that arrive within `timeout` and update per-process rates"""
+        try:
+            report = self.reports.get(timeout=timeout)
+        except queue.Empty:
+            return
+        while report is not None:
+            slot = (self.workers if report.kind == 'worker' else self.writers)[report.index]
+            now = time.monotonic()
+            previous = slot.report
+            if previous is not None and previous.pid == report.pid:
+                slot.rate = (report.handled - previous.handled) / max(now - slot.reported_at, 1e-6)
+            elif slot.process is not None and report.pid == slot.process.pid:
+                slot.rate = report.handled / max(now - slot.started, 1e-6)
+            else:
+                report = None  # Late report of a process that has since been replaced
+            if report is not None:
+                slot.report, slot.reported_at = report, now
+            try:
+                report = self.reports.get_nowait()
+            except queue.Empty:
+                report = None
+
+    def log_throughput(self):
+        for slot in self.workers + self.writers:
+            report = slot.report
+            if report is None:
+                logger.info(f"{slot.name}: no report yet ({'up' if slot.alive() else 'down'}, "
+                            f"{slot.restarts} restarts)")
+            elif slot.kind == 'worker':
+                logger.info(f"{slot.name} (pid {report.pid}): {slot.rate:,.1f} msg/s, {report.handled:,} handled, "
+                            f"{report.homes} homes, {report.written:,} statements forwarded, "
+                            f"{report.dropped:,} dropped, {self.dropped[slot.index]:,} messages dropped "
+                            f"in dispatch, {slot.restarts} restarts")
+            else:
+                logger.info(f"{slot.name} (pid {report.pid}): {slot.rate:,.1f} statements/s, "
+                            f"{report.homes} homes, {report.written:,} rows written, {report.dropped:,} dropped, "
+                            f"{slot.restarts} restarts")
+        logger.info(f"All workers: {sum(w.rate for w in self.workers):,.1f} msg/s")
+
+    def _stop_slots(self, slots, ask):
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for slot in slots:
+            if slot.alive():
+                ask(slot)
+        for slot in slots:
+            if slot.process is None:
+                continue
+            slot.process.join(max(0.0, deadline - time.monotonic()))
+            if slot.process.is_alive():
+                logger.warning(f"{slot.name} did not stop in {WORKER_STOP_TIMEOUT}s; killing it")
+                slot.process.kill()
+                slot.process.join()
+
+    def _end(self, slot):
+        try:
+            slot.inbox.put(None, timeout=WORKER_STOP_TIMEOUT)
+        except queue.Full:
+            pass  # Killed after the deadline
+
+    def stop(self):
+        """End the workers once they have handled their queued batches and flushed into the writers;
+        then end the writers once their queues are drained. Whatever doesn't finish in time is killed."""
+        self._stop_slots(self.workers, self._end)
+        self._stop_slots(self.writers, self._end)
+        for slot in self.workers + self.writers:
+            slot.inbox.cancel_join_thread()  # Batches for processes that are gone are lost anyway
+
+    def run(self):
+        logger.info(f"Starting Smart Home ingest supervisor with {len(self.workers)} workers "
+                    f"and {len(self.writers)} writers...")
+        for home in shards.list_homes():
+            logger.info(f"Home {home} -> writer {writer_for(home, len(self.writers))}")
+        mqtt_receiver.start_metrics_server()
+        self.log_listener.start()
+        for slot in self.writers + self.workers:
+            self.start(slot)
+
+        stop_dispatch = threading.Event()
+        dispatch = threading.Thread(target=self.dispatch_forever, args=(stop_dispatch,), name="dispatch", daemon=True)
+        dispatch.start()
+        self.client.connect_async(mqtt_receiver.MQTT_BROKER, mqtt_receiver.MQTT_PORT, 60)
+        self.client.loop_start()
+
+        next_log = time.monotonic() + THROUGHPUT_LOG_INTERVAL
+        try:
+            while True:
+                self.collect(SUPERVISE_INTERVAL)
+                now = time.monotonic()
+                for slot in self.workers + self.writers:
+                    self.check(slot, now)
+                if now >= next_log:
+                    self.log_throughput()
+                    next_log = now + THROUGHPUT_LOG_INTERVAL
+        except KeyboardInterrupt:
+            logger.info("Shutting down ingest workers...")
+        finally:
+            self.client.disconnect()
+            self.client.loop_stop()
+            stop_dispatch.set()
+            dispatch.join()
+            self.flush()  # The last batches go ahead of the workers' None
+            self.stop()
+            self.log_listener.stop()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = int(args[args.index("--workers") + 1]) if "--workers" in args else os.cpu_count() or 1
+    writers = int(args[args.index("--writers") + 1]) if "--writers" in args else 1
+    if workers < 1 or writers < 1:
+        sys.exit("--workers and --writers must be at least 1")
+    signal.signal(signal.SIGTERM, _interrupt)  # systemctl stop: shut the workers down cleanly too
+    IngestSupervisor(workers, writers).run()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Runtime Metrics & Profiling
+Counter / histogram / gauge dùng chung cho mqtt_receiver.py và web_dashboard.py, xuất ra dạng text
+Prometheus (/metrics), kèm profiler lấy mẫu stack theo yêu cầu (/debug/profile) cho flame graph
+
+Usage:
+    curl http://raspberrypi.local:5000/metrics                              # Dashboard
+    curl http://raspberrypi.local:9101/metrics                              # Receiver
+    curl "http://localhost:9101/debug/profile?seconds=10" > receiver.folded    # On the Pi itself
+    flamegraph.pl receiver.folded > receiver.svg                            # or speedscope.app
+"""
+
+import logging
+import math
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# ===== METRICS CONFIGURATION =====
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Seconds
+PROFILE_INTERVAL = 0.005      # Seconds between stack samples (~200 Hz)
+PROFILE_MAX_SECONDS = 60      # Longest profile one request may ask for
+PROFILE_CLIENTS = ('127.0.0.1', '::1')  # /debug/profile answers only these addresses (ssh to the Pi first)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """One metric family; samples are keyed by their label values tuple"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self):
+        help_text = self.help.replace('\\', '\\\\').replace('\n', '\\n')
+        return [f"# HELP {self.name} {help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, labels=()):
+        """Context manager observing the seconds spent in its block"""
+        return _Timer(self, labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for labels, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = (('le', _number(bound)),)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class Callback(Metric):
+    """Gauge (or counter) read from the owning object at scrape time: queue depths, existing
+    counters. `read()` returns a number, or {label values tuple: number}."""
+
+    def __init__(self, name, help_text, read, labels=(), kind='gauge'):
+        super().__init__(name, help_text, labels)
+        self.kind = kind
+        self.read = read
+
+    def render(self):
+        try:
+            values = self.read()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} failed: {e}")
+            return self.header()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}"
+                                for k, v in sorted(values.items())]
+
+
+class Registry:
+    """Named metrics of one process. Creating a name twice returns the existing metric, so a module
+    imported next to another (bench scripts) shares it instead of failing."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._get_or_create(name, lambda: Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get_or_create(name, lambda: Histogram(name, help_text, labels, buckets))
+
+    def callback(self, name, help_text, read, labels=(), kind='gauge'):
+        """Register (or re-point) a metric read at scrape time"""
+        with self._lock:
+            metric = self._metrics[name] = Callback(name, help_text, read, labels, kind)
+            return metric
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+# Shared default registry
+REGISTRY = Registry()
+
+# ===== SHARED METRICS =====
+# Both services subscribe to the same topics; each process exports its own counts
+# Labelled by route kind, not topic: any client can publish under home/#, and every label value is a series
+MQTT_MESSAGES = REGISTRY.counter('smarthome_mqtt_messages_total', 'MQTT messages received, per route kind', ('kind',))
+MQTT_FAILURES = REGISTRY.counter('smarthome_mqtt_failures_total',
+                                 'MQTT messages that failed to decode or process, per route kind', ('kind',))
+
+
+# ===== SAMPLING PROFILER =====
+def _frame_name(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def profile_allowed(address):
+    """A profile holds a thread for up to PROFILE_MAX_SECONDS: only local clients may ask for one"""
+    return address in PROFILE_CLIENTS
+
+
+def sample_stacks(seconds, interval=PROFILE_INTERVAL):
+    """Sample every thread's Python stack for `seconds` (wall clock: waiting threads show up too).
+    Returns folded stacks, "thread;outer;...;inner count" per line, as flamegraph.pl / speedscope read them."""
+    seconds = max(0.0, min(float(seconds), PROFILE_MAX_SECONDS))
+    me = threading.get_ident()
+    names = {}
+    tally = _Tally()
+    deadline = time.monotonic() + seconds
+
+    while True:
+        for thread in threading.enumerate():
+            names.setdefault(thread.ident, thread.name)
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}").replace(';', '_'))
+            tally[';'.join(reversed(stack))] += 1
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(interval)
+
+    return ''.join(f"{stack} {count}\n" for stack, count in tally.most_common())
+
+
+# ===== HTTP ENDPOINT (processes without a web server) =====
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/metrics':
+            body = self.registry.render()
+            content_type = CONTENT_TYPE
+        elif url.path == '/debug/profile':
+            if not profile_allowed(self.client_address[0]):
+                self.send_error(403, "profiling is only served to local clients")
+                return
+            query = parse_qs(url.query)
+            try:
+                seconds = float(query.get('seconds', ['10'])[0])
+            except ValueError:
+                self.send_error(400, "seconds must be a number")
+                return
+            body = sample_stacks(seconds)
+            content_type = "text/plain; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the service log
+        pass
+
+
+def serve(port, host='0.0.0.0', registry=REGISTRY):
+    """Serve /metrics and /debug/profile on a daemon thread; returns the server"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -2,15 +2,41 @@
 """
 IoT Home MQTT Data Receiver & Logger
 Nhận dữ liệu từ tất cả các ESP32 nodes và log vào database
+
+Usage:
+    python3 mqtt_receiver.py [--async] [--capture file.cap]   # --capture records traffic for replay.py
+    python3 mqtt_receiver.py --multi-home [--capture file.cap] # Also homes/<home>/..., one DB shard per home
+    python3 ingest_supervisor.py --workers 4                   # Multi-home, nodes spread over 4 processes
 """
 
 import paho.mqtt.client as mqtt
+import asyncio
 import json
 import sqlite3
 import logging
+import logging.handlers
+import atexit
+import queue
+import sys
+import threading
+import time
 from datetime import datetime
 import os
 
+import metrics
+import rollups
+import schema
+import shards
+from alert_engine import ALERT_SUBMIT_TIMEOUT, AlertEngine
+from capture import CaptureWriter
+from db_writer import DatabaseWriter
+from metrics import MQTT_FAILURES, MQTT_MESSAGES, REGISTRY
+from node_registry import NodeRegistry
+from retention import RetentionEngine
+from shards import DEFAULT_HOME
+from system_stats import STATS_NAME, SystemStats
+from topic_router import ROUTER, payload_for
+
 # ===== MQTT CONFIGURATION =====
 MQTT_BROKER = "localhost"  # Chạy trên chính Raspberry Pi
 MQTT_PORT = 1883
@@ -19,100 +45,260 @@ MQTT_PASSWORD = "1234"
 
 # ===== DATABASE CONFIGURATION =====
 DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+WRITE_BATCH_SIZE = 500        # Commit after this many queued statements...
+WRITE_BATCH_INTERVAL = 0.25   # ...or after this many seconds, whichever comes first
+WRITE_QUEUE_SIZE = 10000      # Bounded queue; on_message drops (and counts) when full
+RETENTION_INTERVAL = 3600     # Seconds between retention runs (policies live in retention.py)
+READING_WINDOW = 1.5          # Max seconds to wait for the rest of a sampling tick (nodes sample every 2s)
 
 # ===== LOGGING CONFIGURATION =====
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/mqtt_receiver.log'),
-        logging.StreamHandler()
-    ]
-)
+LOG_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/mqtt_receiver.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024   # Rotate mqtt_receiver.log at 5 MB...
+LOG_BACKUP_COUNT = 3              # ...keeping this many old files
+MESSAGE_LOG_INTERVAL = 60         # Log the first message per topic, then one summary per topic, per window
+
+# ===== METRICS CONFIGURATION =====
+METRICS_PORT = 9101               # /metrics (Prometheus) and /debug/profile; None disables
+
+# Handlers run on a QueueListener thread, so logging never blocks on file / console I/O
+log_queue = queue.Queue(-1)
+log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# The listener's handlers do the real formatting; the queue side only merges msg % args
+queue_handler = logging.handlers.QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
 logger = logging.getLogger(__name__)
 
+def forward_logs(target):
+    """Child processes (ingest_supervisor.py): hand records to `target`, a multiprocessing queue the
+    parent's listener writes out, instead of this process's own handlers. Several
+    RotatingFileHandlers on one LOG_FILE would rotate it from under each other."""
+    log_listener.stop()
+    atexit.unregister(log_listener.stop)
+    for handler in log_handlers:
+        handler.close()
+    queue_handler.setFormatter(logging.Formatter('%(processName)s: %(message)s'))
+    queue_handler.queue = target
+
+class MessageLogSampler:
+    """Per-topic message logging: first message of each window, then an "N messages" summary"""
+    
+    def __init__(self, interval=MESSAGE_LOG_INTERVAL):
+        self.interval = interval
+        self._counts = {}
+        self._window_start = time.monotonic()
+        
+    def record(self, topic, payload):
+        now = time.monotonic()
+        if now - self._window_start >= self.interval:
+            self.summarize(now)
+            
+        count = self._counts.get(topic, 0)
+        self._counts[topic] = count + 1
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received [%s]: %s", topic, payload)
+        elif count == 0:
+            logger.info("Received [%s]: %s", topic, payload)
+            
+    def summarize(self, now=None):
+        """Log and reset the counts of the window that just ended"""
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        for topic, count in self._counts.items():
+            logger.info("%d messages on topic %s in the last %.0fs", count, topic, elapsed)
+        self._counts = {}
+        self._window_start = now
+
+# Columns assembled from the separate per-attribute topics of one sampling tick
+READING_FIELDS = ('temperature', 'humidity', 'gas_analog', 'gas_status', 'fire_detected')
+
+def gas_alert(status):
+    if status in ("WARNING", "DANGER"):
+        return (f"Gas level: {status}", "HIGH" if status == "DANGER" else "MEDIUM")
+    return None
+
+def fire_alert(fire_detected):
+    return ("Fire detected!", "CRITICAL") if fire_detected else None
+
+# Reading field -> (alert_type, function(value) returning (message, severity), or None when clear)
+ALERT_RULES = {
+    'gas_status': ('GAS_ALERT', gas_alert),
+    'fire_detected': ('FIRE_ALERT', fire_alert),
+}
+
+class ReadingAssembler:
+    """Merge the per-attribute messages of one sampling tick into a single environmental row"""
+    
+    def __init__(self, window=READING_WINDOW, clock=datetime.now, timer=time.monotonic):
+        self.window = window
+        self.clock = clock  # Row timestamp of a new tick (replay.py substitutes the captured time)
+        self.timer = timer  # Seconds for the assembly window
+        self._pending = {}  # (room, node) -> [started, timestamp, {field: value}]
+        self._lock = threading.Lock()
+        
+    def add(self, room, node, field, value):
+        """Add one attribute. Returns the rows that became complete (usually zero or one)."""
+        key = (room, node)
+        finished = []
+        
+        with self._lock:
+            pending = self._pending.get(key)
+            
+            # Same attribute twice means the node already started its next tick
+            if pending is not None and field in pending[2]:
+                finished.append(self._to_row(key, self._pending.pop(key)))
+                pending = None
+                
+            if pending is None:
+                pending = [self.timer(), self.clock(), {}]
+                self._pending[key] = pending
+                
+            pending[2][field] = value
+            
+            if len(pending[2]) == len(READING_FIELDS):
+                finished.append(self._to_row(key, self._pending.pop(key)))
+                
+        return finished
+        
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+            
+    def pop_expired(self):
+        """Rows whose window ran out before every attribute arrived"""
+        deadline = self.timer() - self.window
+        
+        with self._lock:
+            expired = [key for key, pending in self._pending.items() if pending[0] <= deadline]
+            return [self._to_row(key, self._pending.pop(key)) for key in expired]
+            
+    def drain(self):
+        """All partially assembled rows (used on shutdown)"""
+        with self._lock:
+            rows = [self._to_row(key, pending) for key, pending in self._pending.items()]
+            self._pending.clear()
+        return rows
+        
+    @staticmethod
+    def _to_row(key, pending):
+        room, node = key
+        fields = pending[2]
+        return (room, node) + tuple(fields.get(f) for f in READING_FIELDS) + (pending[1],)
+
+# Live receivers by home; the scrape-time metrics below read their own counters
+RECEIVERS = {}
+
+def _per_home(read):
+    return lambda: {(home,): read(receiver) for home, receiver in list(RECEIVERS.items())}
+
+REGISTRY.callback('smarthome_db_write_queue_depth', 'Statements waiting for the DB writer',
+                  _per_home(lambda r: r.writer.queue.qsize()), labels=('home',))
+REGISTRY.callback('smarthome_db_statements_total', 'Statements by outcome', lambda: {
+    (home, result): value for home, receiver in list(RECEIVERS.items())
+    for result, value in receiver.writer.stats().items() if result in ('enqueued', 'dropped', 'written', 'failed')
+}, labels=('home', 'result'), kind='counter')
+REGISTRY.callback('smarthome_readings_assembling', 'Sampling ticks waiting for their remaining fields',
+                  _per_home(lambda r: len(r.assembler)), labels=('home',))
+REGISTRY.callback('smarthome_nodes_online', 'Nodes currently online',
+                  _per_home(lambda r: r.registry.online_count()), labels=('home',))
+REGISTRY.callback('smarthome_alerts_open', 'Open alerts',
+                  _per_home(lambda r: len(r.alert_engine.open_alerts())), labels=('home',))
+
+def start_metrics_server():
+    if METRICS_PORT:
+        try:
+            metrics.serve(METRICS_PORT)
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
+
 class SmartHomeMQTTReceiver:
-    def __init__(self):
-        self.client = mqtt.Client()
-        # self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)  # Tạm thời tắt auth
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
-        self.client.on_disconnect = self.on_disconnect
+    def __init__(self, capture_file=None, home=DEFAULT_HOME, db_file=None, client=None, clock=None,
+                 writer=None, owns=None, stats_name=STATS_NAME):
+        """One home's ingest. With `client` (multi-home mode) the MQTT connection is shared and
+        messages arrive through MultiHomeReceiver instead of this object's own callbacks.
+        `clock` (replay.py: the captured message time) replaces both datetime.now and time.monotonic.
+        With `writer` (ingest_supervisor.py workers) another process writes and prunes the database;
+        `owns(room, node)` limits the restored alerts / nodes / counters to this worker's nodes,
+        whose stats are published as row `stats_name`."""
+        self.home = home
+        self.db_file = db_file or DB_FILE
+        if client is None:
+            client = mqtt.Client()
+            # client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)  # Tạm thời tắt auth
+            client.on_connect = self.on_connect
+            client.on_message = self.on_message
+            client.on_disconnect = self.on_disconnect
+        self.client = client
         
         # Initialize database
         self.init_database()
         
+        # All writes go through one long-lived connection on a dedicated thread
+        self.writer = writer or DatabaseWriter(self.db_file, WRITE_BATCH_SIZE, WRITE_BATCH_INTERVAL, WRITE_QUEUE_SIZE)
+        
+        # Timestamps of rows, alerts and liveness, and the seconds behind windows, debounces and timeouts
+        self.clock = clock or datetime.now
+        self.timer = time.monotonic if clock is None else lambda: clock().timestamp()
+        
+        # One environmental row per sampling tick instead of INSERT + 4 UPDATEs
+        self.assembler = ReadingAssembler(clock=self.clock, timer=self.timer)
+        # Nodes that send binary ticks; their per-field text topics (kept for Node-RED) aren't stored twice
+        self.tick_nodes = set()
+        self._other_homes = set()  # Homes whose messages reached this receiver and were skipped
+        self._stop_event = threading.Event()
+        
+        # Open alerts live in memory; repeats are debounced, only transitions are written
+        self.alert_engine = AlertEngine(self.writer, clock=self.clock, timer=self.timer)
+        
+        # One registry row per node; offline after missed heartbeats, pushed over MQTT
+        self.registry = NodeRegistry(self.writer, on_change=self.publish_liveness, clock=self.clock,
+                                     timer=self.timer)
+        
+        # Counters behind /api/system_stats, rebuilt from the database on every start
+        self.stats = SystemStats(self.alert_engine, self.registry, stats_name, owns)
+        
+        conn = sqlite3.connect(self.db_file)
+        self.alert_engine.load(conn, owns)
+        self.registry.load(conn, owns)
+        self.stats.reconcile(conn)
+        conn.close()
+        
+        # Sampled per-topic logging instead of one INFO line per message
+        self.message_log = MessageLogSampler()
+        
+        # Optional raw traffic recording (replay it with replay.py)
+        self.capture = CaptureWriter(capture_file) if capture_file else None
+        
+        # Prunes old history in small transactions so it never blocks the writer (next to it, if elsewhere)
+        self.retention = RetentionEngine(self.db_file) if writer is None else None
+        
+        RECEIVERS[home] = self
+        
     def init_database(self):
         """Initialize SQLite database with tables for sensor data"""
         # Ensure directory exists
-        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-        
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Environmental data table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS environmental_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room TEXT NOT NULL,
-                node TEXT NOT NULL,
-                temperature REAL,
-                humidity REAL,
-                gas_analog INTEGER,
-                gas_status TEXT,
-                fire_detected BOOLEAN,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Door status table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS door_status (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room TEXT NOT NULL,
-                node TEXT NOT NULL,
-                door_state TEXT,
-                door_angle INTEGER,
-                presence_detected BOOLEAN,
-                last_action TEXT,
-                manual_override BOOLEAN,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # System status table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS system_status (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room TEXT,
-                node TEXT,
-                device_type TEXT,
-                status TEXT,
-                ip_address TEXT,
-                uptime INTEGER,
-                free_heap INTEGER,
-                wifi_rssi INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Alerts table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS alerts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                room TEXT NOT NULL,
-                node TEXT NOT NULL,
-                alert_type TEXT NOT NULL,
-                message TEXT,
-                severity TEXT,
-                resolved BOOLEAN DEFAULT FALSE,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        
+        conn = sqlite3.connect(self.db_file)
+        # Only takes effect on a brand-new file, and must come before WAL / the first table
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        
+        # Create tables / indexes and upgrade older databases in place
+        version = schema.migrate(conn)
         conn.close()
-        logger.info("Database initialized successfully")
+        logger.info(f"Database {self.db_file} initialized successfully (schema v{version})")
         
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -135,154 +321,270 @@ class SmartHomeMQTTReceiver:
         logger.warning("Disconnected from MQTT broker")
         
     def on_message(self, client, userdata, msg):
+        match = None
+        if self.capture is not None:
+            self.capture.record(msg.topic, msg.payload)
         try:
             topic = msg.topic
-            payload = msg.payload.decode('utf-8')
-            
-            logger.info(f"Received [{topic}]: {payload}")
+            match = ROUTER.resolve(topic)
+            MQTT_MESSAGES.inc((match.route.kind if match is not None and match.route is not None else 'other',))
+            payload = payload_for(match, msg.payload)
             
-            # Parse topic
-            topic_parts = topic.split('/')
+            self.message_log.record(topic, payload)
             
-            if len(topic_parts) >= 5 and topic_parts[0] == "home":
-                room = topic_parts[1]
-                node = topic_parts[2]
-                device = topic_parts[3]
-                attribute = topic_parts[4]
-                
-                self.process_sensor_data(room, node, device, attribute, payload)
-                
-            elif topic.startswith("home/system/"):
-                self.process_system_data(topic, payload)
+            writes, alerts = self.route_message(topic, payload)
+            self.persist(writes)
+            for alert in alerts:
+                self.observe_alert(*alert)
                 
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            MQTT_FAILURES.inc((match.route.kind if match is not None and match.route is not None else 'unknown',))
+            logger.error("Error processing message: %s", e)
+            
+    def route_message(self, topic, payload):
+        """Map one decoded message to (statements to write, alert observations)"""
+        match = ROUTER.resolve(topic)
+        
+        if match is None or match.route is None:
+            return [], []
             
-    def process_sensor_data(self, room, node, device, attribute, payload):
-        """Process sensor data and store in database"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        if match.home != self.home:
+            # Never mix another home's rows into this database (e.g. a multi-home capture in replay.py)
+            if match.home not in self._other_homes:
+                self._other_homes.add(match.home)
+                logger.warning(f"Skipping messages of home {match.home}: this receiver serves {self.home}")
+            return [], []
+            
+        if match.device == 'system':
+            return self.process_system_data(match, payload)
+            
+        return self.process_sensor_data(match, payload)
+        
+    def process_sensor_data(self, match, payload):
+        """Process sensor data. Returns (statements, alert observations); raises on malformed payloads."""
+        room, node, route = match.room, match.node, match.route
+        value = route.decode(payload)
         
+        if route.kind == 'telemetry':
+            # Complete tick: straight to a row, no assembly window
+            self.tick_nodes.add((room, node))
+            row = (room, node) + tuple(value[f] for f in READING_FIELDS) + (self.clock(),)
+            return self.reading_statements([row]), [
+                (room, node, alert_type) + (evaluate(value[field]) or (None, None))
+                for field, (alert_type, evaluate) in ALERT_RULES.items() if value[field] is not None
+            ]
+            
+        if route.kind == 'reading':
+            if (room, node) in self.tick_nodes:
+                return [], []
+            writes = self.reading_statements(self.assembler.add(room, node, route.field, value))
+            rule = ALERT_RULES.get(route.field)
+            if rule is None:
+                return writes, []
+            # Clear readings are observations too: they let the engine auto-resolve
+            alert_type, evaluate = rule
+            return writes, [(room, node, alert_type) + (evaluate(value) or (None, None))]
+            
+        if route.kind == 'liveness':
+            # Our own node registry announcements coming back from the broker
+            return [], []
+            
+        # Door status JSON
+        return [('''
+            INSERT INTO door_status 
+            (room, node, door_state, door_angle, presence_detected, last_action, manual_override, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (room, node, value.get('state'), value.get('angle'),
+              value.get('presence'), value.get('last_action'),
+              value.get('manual_override'), self.clock()))], []
+        
+    def reading_statements(self, rows):
+        """INSERT plus rollup upserts for assembled environmental rows"""
+        statements = []
+        self.stats.record_readings(len(rows))
+        for row in rows:
+            statements.append(('''
+                INSERT INTO environmental_data 
+                (room, node, temperature, humidity, gas_analog, gas_status, fire_detected, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', row))
+            
+            room, node, temperature, humidity, gas_analog, _, _, timestamp = row
+            statements += rollups.rollup_statements(room, node, timestamp, temperature, humidity, gas_analog)
+        return statements
+        
+    def persist(self, writes):
+        """Queue statements for the database writer"""
+        for sql, params in writes:
+            self.writer.submit(sql, params)
+            
+    def flush_expired_readings(self):
+        """Background loop: write ticks that never completed within READING_WINDOW, and alert
+        transitions that found the writer queue full"""
+        while not self._stop_event.wait(self.assembler.window / 2):
+            self.persist(self.reading_statements(self.assembler.pop_expired()))
+            self.alert_engine.retry()
+            
+    def process_system_data(self, match, payload):
+        """Process system status data. Returns (statements, alerts)."""
+        data = match.route.decode(payload)
+        room, node = data.get('room'), data.get('node')
+        
+        if match.route.kind == 'heartbeat':
+            return self.registry.heartbeat(room, node, data), []
+            
+        return self.registry.status(room, node, data.get('status'), data.get('ip')), []
+        
+    def publish_liveness(self, room, node, status, last_seen):
+        """Push a node's online / offline transition (retained, so late subscribers see it too)"""
+        self.client.publish(f"{shards.topic_prefix(self.home)}/{room}/{node}/liveness/status", json.dumps({
+            'status': status,
+            'last_seen': datetime.fromtimestamp(last_seen).isoformat() if last_seen else None,
+        }), qos=1, retain=True)
+        
+    def observe_alert(self, room, node, alert_type, message, severity):
+        """Feed one alert evaluation to the engine; only state transitions reach the database"""
+        return self.alert_engine.observe(room, node, alert_type, message, severity)
+        
+    def start_background(self):
+        """Start the writer, reading flush, liveness, stats and retention threads"""
+        self.writer.start()
+        threading.Thread(target=self.flush_expired_readings, name="reading-flush", daemon=True).start()
+        threading.Thread(target=self.registry.run_forever, args=(self._stop_event,),
+                         name="node-liveness", daemon=True).start()
+        threading.Thread(target=self.stats.run_forever, args=(self.writer, self._stop_event),
+                         name="system-stats", daemon=True).start()
+        if self.retention is not None:
+            threading.Thread(target=self.retention.run_forever, args=(self._stop_event, RETENTION_INTERVAL),
+                             name="retention", daemon=True).start()
+        
+    def shutdown(self):
+        """Flush whatever is still queued before exiting"""
+        self._stop_event.set()
+        self.persist(self.reading_statements(self.assembler.drain()))
+        unsent = self.alert_engine.retry(ALERT_SUBMIT_TIMEOUT)
+        if unsent:
+            logger.error(f"{unsent} alert writes never found room in the writer queue")
+        self.stats.publish(self.writer)
+        self.writer.stop()
+        self.message_log.summarize()
+        if self.capture is not None:
+            self.capture.close()
+            
+    def run(self):
+        """Start the MQTT receiver"""
         try:
-            if device == "temperature_sensor" and attribute == "value":
-                # Store temperature data
-                cursor.execute('''
-                    INSERT OR REPLACE INTO environmental_data 
-                    (room, node, temperature, timestamp) 
-                    VALUES (?, ?, ?, ?)
-                ''', (room, node, float(payload), datetime.now()))
-                
-            elif device == "humidity_sensor" and attribute == "value":
-                # Store humidity data
-                cursor.execute('''
-                    UPDATE environmental_data 
-                    SET humidity = ?, timestamp = ?
-                    WHERE room = ? AND node = ? AND date(timestamp) = date('now')
-                ''', (float(payload), datetime.now(), room, node))
-                
-            elif device == "gas_sensor":
-                if attribute == "analog_value":
-                    cursor.execute('''
-                        UPDATE environmental_data 
-                        SET gas_analog = ?, timestamp = ?
-                        WHERE room = ? AND node = ? AND date(timestamp) = date('now')
-                    ''', (int(payload), datetime.now(), room, node))
-                elif attribute == "status":
-                    cursor.execute('''
-                        UPDATE environmental_data 
-                        SET gas_status = ?, timestamp = ?
-                        WHERE room = ? AND node = ? AND date(timestamp) = date('now')
-                    ''', (payload, datetime.now(), room, node))
-                    
-                    # Check for gas alerts
-                    if payload in ["WARNING", "DANGER"]:
-                        self.create_alert(room, node, "GAS_ALERT", f"Gas level: {payload}", 
-                                        "HIGH" if payload == "DANGER" else "MEDIUM")
-                        
-            elif device == "flame_sensor" and attribute == "alert":
-                cursor.execute('''
-                    UPDATE environmental_data 
-                    SET fire_detected = ?, timestamp = ?
-                    WHERE room = ? AND node = ? AND date(timestamp) = date('now')
-                ''', (payload == "FIRE_DETECTED", datetime.now(), room, node))
-                
-                # Fire alert
-                if payload == "FIRE_DETECTED":
-                    self.create_alert(room, node, "FIRE_ALERT", "Fire detected!", "CRITICAL")
-                    
-            elif device == "door" and attribute == "status":
-                # Parse door status JSON
-                door_data = json.loads(payload)
-                cursor.execute('''
-                    INSERT INTO door_status 
-                    (room, node, door_state, door_angle, presence_detected, last_action, manual_override, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (room, node, door_data.get('state'), door_data.get('angle'),
-                      door_data.get('presence'), door_data.get('last_action'),
-                      door_data.get('manual_override'), datetime.now()))
-                      
-            conn.commit()
+            logger.info("Starting Smart Home MQTT Receiver...")
+            self.start_background()
+            start_metrics_server()
+            self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            self.client.loop_forever()
             
+        except KeyboardInterrupt:
+            logger.info("Shutting down MQTT receiver...")
+            self.client.disconnect()
         except Exception as e:
-            logger.error(f"Database error: {e}")
+            logger.error(f"Error running MQTT receiver: {e}")
         finally:
-            conn.close()
+            self.shutdown()
             
-    def process_system_data(self, topic, payload):
-        """Process system status data"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+    def run_async(self):
+        """Start the MQTT receiver with the staged asyncio ingest pipeline"""
+        from async_ingest import AsyncIngestPipeline
         
         try:
-            data = json.loads(payload)
-            
-            if topic == "home/system/heartbeat":
-                cursor.execute('''
-                    INSERT INTO system_status 
-                    (room, node, device_type, status, uptime, free_heap, wifi_rssi, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (data.get('room'), data.get('node'), data.get('type'), 'online',
-                      data.get('uptime'), data.get('free_heap'), data.get('wifi_rssi'), 
-                      datetime.now()))
-                      
-            elif topic == "home/system/status":
-                cursor.execute('''
-                    INSERT INTO system_status 
-                    (room, node, status, ip_address, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (data.get('room'), data.get('node'), data.get('status'),
-                      data.get('ip'), datetime.now()))
-                      
-            conn.commit()
+            logger.info("Starting Smart Home MQTT Receiver (async pipeline)...")
+            self.start_background()
+            start_metrics_server()
+            asyncio.run(AsyncIngestPipeline(self).run(MQTT_BROKER, MQTT_PORT))
             
+        except KeyboardInterrupt:
+            logger.info("Shutting down MQTT receiver...")
         except Exception as e:
-            logger.error(f"System data processing error: {e}")
+            logger.error(f"Error running MQTT receiver: {e}")
         finally:
-            conn.close()
+            self.shutdown()
+
+# The original house plus every homes/<home>/... shard
+MULTI_HOME_TOPICS = ("home/+/+/+/+", "home/system/+",
+                     f"{shards.HOMES_TOPIC_ROOT}/+/+/+/+/+", f"{shards.HOMES_TOPIC_ROOT}/+/system/+")
+
+class MultiHomeReceiver:
+    """One MQTT connection for several homes: each message goes to its home's receiver, which has
+    its own database shard, writer thread, alerts and node registry (see shards.py)"""
+    
+    def __init__(self, capture_file=None, shard_dir=shards.SHARD_DIR, max_homes=shards.MAX_HOMES):
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.shard_dir = shard_dir
+        self.max_homes = max_homes
+        self.homes = {}
+        self._lock = threading.Lock()
+        self._refused = set()
+        self.capture = CaptureWriter(capture_file) if capture_file else None
+        
+        # Homes that already have a shard start now, so their nodes can time out as offline
+        os.makedirs(shard_dir, exist_ok=True)
+        for home in shards.list_homes(shard_dir)[:max_homes]:
+            self.receiver_for(home)
             
-    def create_alert(self, room, node, alert_type, message, severity):
-        """Create alert in database"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+    def receiver_for(self, home):
+        """The receiver of `home`, created (and its shard migrated) on first use; None over the limit"""
+        receiver = self.homes.get(home)
+        if receiver is not None:
+            return receiver
+        with self._lock:
+            receiver = self.homes.get(home)
+            if receiver is None:
+                if len(self.homes) >= self.max_homes:
+                    if home not in self._refused:
+                        self._refused.add(home)
+                        logger.warning(f"Ignoring home {home}: already serving {self.max_homes} homes")
+                    return None
+                receiver = self.create_receiver(home)
+                receiver.start_background()
+                self.homes[home] = receiver
+                logger.info(f"Serving home {home} from {receiver.db_file}")
+        return receiver
         
-        try:
-            cursor.execute('''
-                INSERT INTO alerts (room, node, alert_type, message, severity, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (room, node, alert_type, message, severity, datetime.now()))
+    def create_receiver(self, home):
+        return SmartHomeMQTTReceiver(home=home, db_file=shards.shard_file(home, DB_FILE, self.shard_dir),
+                                     client=self.client)
+        
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logger.info("Connected to MQTT broker successfully")
+            for topic in MULTI_HOME_TOPICS:
+                client.subscribe(topic)
+                logger.info(f"Subscribed to: {topic}")
+        else:
+            logger.error(f"Failed to connect to MQTT broker. Code: {rc}")
             
-            conn.commit()
-            logger.warning(f"ALERT: {room}/{node} - {alert_type}: {message}")
+    def on_disconnect(self, client, userdata, rc):
+        logger.warning("Disconnected from MQTT broker")
+        
+    def on_message(self, client, userdata, msg):
+        if self.capture is not None:
+            self.capture.record(msg.topic, msg.payload)
+        match = ROUTER.resolve(msg.topic)
+        if match is None:
+            return
+        receiver = self.receiver_for(match.home)
+        if receiver is not None:
+            receiver.on_message(client, userdata, msg)
             
-        except Exception as e:
-            logger.error(f"Alert creation error: {e}")
-        finally:
-            conn.close()
+    def shutdown(self):
+        for receiver in list(self.homes.values()):
+            receiver.shutdown()
+        if self.capture is not None:
+            self.capture.close()
             
     def run(self):
-        """Start the MQTT receiver"""
         try:
-            logger.info("Starting Smart Home MQTT Receiver...")
+            logger.info(f"Starting Smart Home MQTT Receiver for {len(self.homes)} homes...")
+            start_metrics_server()
             self.client.connect(MQTT_BROKER, MQTT_PORT, 60)
             self.client.loop_forever()
             
@@ -291,7 +593,17 @@ class SmartHomeMQTTReceiver:
             self.client.disconnect()
         except Exception as e:
             logger.error(f"Error running MQTT receiver: {e}")
+        finally:
+            self.shutdown()
 
 if __name__ == "__main__":
-    receiver = SmartHomeMQTTReceiver()
-    receiver.run()
+    args = sys.argv[1:]
+    capture_file = args[args.index("--capture") + 1] if "--capture" in args else None
+    if "--multi-home" in args:
+        MultiHomeReceiver(capture_file).run()
+    else:
+        receiver = SmartHomeMQTTReceiver(capture_file)
+        if "--async" in args:
+            receiver.run_async()
+        else:
+            receiver.run()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Node Registry & Liveness Tracker
+Một dòng node_registry cho mỗi node (upsert thay vì append mỗi heartbeat), lịch sử system_status
+được lấy mẫu, và phát hiện node offline bằng timer wheel khi bỏ lỡ N heartbeat
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ===== LIVENESS CONFIGURATION =====
+HEARTBEAT_INTERVAL = 30       # Seconds between node heartbeats (HEARTBEAT_INTERVAL in the .ino sketches)
+MISSED_HEARTBEATS = 3         # A node is offline after missing this many heartbeats in a row
+HISTORY_SAMPLE_INTERVAL = 300 # At most one system_status row per node per 5 minutes (0 = every heartbeat)
+WHEEL_TICK = 1.0              # Timer wheel resolution in seconds
+WHEEL_SLOTS = 128             # Slots per revolution; longer timeouts just take extra rounds
+
+# Fields a message doesn't carry (heartbeats have no ip, status messages no uptime) keep their value
+REGISTRY_UPSERT = '''
+    INSERT INTO node_registry
+    (room, node, device_type, status, ip_address, uptime, free_heap, wifi_rssi, last_seen, status_since)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (room, node) DO UPDATE SET
+        device_type = COALESCE(excluded.device_type, device_type),
+        status_since = CASE WHEN status = excluded.status THEN status_since ELSE excluded.status_since END,
+        status = excluded.status,
+        ip_address = COALESCE(excluded.ip_address, ip_address),
+        uptime = COALESCE(excluded.uptime, uptime),
+        free_heap = COALESCE(excluded.free_heap, free_heap),
+        wifi_rssi = COALESCE(excluded.wifi_rssi, wifi_rssi),
+        last_seen = COALESCE(excluded.last_seen, last_seen)
+'''
+
+HISTORY_INSERT = '''
+    INSERT INTO system_status
+    (room, node, device_type, status, ip_address, uptime, free_heap, wifi_rssi, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) schedule / cancel, one slot inspected per tick"""
+
+    def __init__(self, tick=WHEEL_TICK, slots=WHEEL_SLOTS, now=None):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]  # key -> revolutions still to wait
+        self._where = {}  # key -> slot index
+        self._ticks = 0
+        self._origin = time.monotonic() if now is None else now
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay, now=None):
+        """(Re)arm the timer for key to fire `delay` seconds from now"""
+        now = time.monotonic() if now is None else now
+        self.cancel(key)
+        due = int((now - self._origin + delay) / self.tick + 0.999999)
+        ahead = max(1, due - self._ticks)
+        slot = (self._ticks + ahead) % len(self._slots)
+        self._slots[slot][key] = (ahead - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    def advance(self, now=None):
+        """Process every tick up to `now`; returns the keys whose timers fired"""
+        now = time.monotonic() if now is None else now
+        target = int((now - self._origin) / self.tick)
+        expired = []
+        while self._ticks < target:
+            self._ticks += 1
+            slot = self._ticks % len(self._slots)
+            timers = self._slots[slot]
+            for key, rounds in list(timers.items()):
+                if rounds:
+                    timers[key] = rounds - 1
+                else:
+                    del timers[key]
+                    del self._where[key]
+                    expired.append(key)
+        return expired
+
+
+class NodeState:
+    __slots__ = ('status', 'device_type', 'last_seen', 'last_history')
+
+    def __init__(self, status, device_type=None, last_seen=None):
+        self.status = status
+        self.device_type = device_type
+        self.last_seen = last_seen
+        self.last_history = None
+
+
+class NodeRegistry:
+    """Liveness of every (room, node): upserted registry row, sampled history, offline on timeout.
+    on_change(room, node, status, last_seen) is called on every online/offline transition.
+    `clock` stamps rows and last_seen, `timer` (seconds) turns the wheel; replay.py passes the
+    captured message time for both."""
+
+    def __init__(self, writer, on_change=None, interval=HEARTBEAT_INTERVAL, missed=MISSED_HEARTBEATS,
+                 history_interval=HISTORY_SAMPLE_INTERVAL, clock=datetime.now, timer=time.monotonic):
+        self.writer = writer
+        self.on_change = on_change
+        self.timeout = interval * missed
+        self.missed = missed
+        self.history_interval = history_interval
+        self.clock = clock
+        self.timer = timer
+        self.wheel = TimerWheel(now=timer())
+        self._nodes = {}  # (room, node) -> NodeState
+        self._lock = threading.Lock()
+
+    def load(self, conn, owns=None):
+        """Restore nodes after a restart; online ones get whatever is left of their timeout.
+        With `owns(room, node)` only those nodes are tracked (ingest_supervisor.py workers)."""
+        rows = conn.execute("SELECT room, node, device_type, status, last_seen FROM node_registry").fetchall()
+        rows = [row for row in rows if owns is None or owns(row[0], row[1])]
+        now = self.clock().timestamp()
+        with self._lock:
+            for room, node, device_type, status, last_seen in rows:
+                seen = datetime.fromisoformat(last_seen).timestamp() if last_seen else None
+                self._nodes[(room, node)] = NodeState(status, device_type, seen)
+                if status == 'online':
+                    self.wheel.schedule((room, node), max(0, self.timeout - (now - (seen or 0))), now=self.timer())
+        return len(rows)
+
+    def online_count(self):
+        with self._lock:
+            return sum(1 for state in self._nodes.values() if state.status == 'online')
+
+    def nodes(self):
+        """Snapshot {(room, node): (status, last_seen)}"""
+        with self._lock:
+            return {key: (state.status, state.last_seen) for key, state in self._nodes.items()}
+
+    def heartbeat(self, room, node, data):
+        """Heartbeat JSON -> statements to persist; re-arms the node's offline timer"""
+        if room is None or node is None:
+            return []
+        stamp = self.clock()
+        now = stamp.timestamp()
+        row = (room, node, data.get('type'), 'online', None,
+               data.get('uptime'), data.get('free_heap'), data.get('wifi_rssi'))
+
+        with self._lock:
+            state = self._nodes.get((room, node))
+            if state is None:
+                state = self._nodes[(room, node)] = NodeState(None)
+            came_online = state.status != 'online'
+            state.status = 'online'
+            state.device_type = data.get('type') or state.device_type
+            state.last_seen = now
+            self.wheel.schedule((room, node), self.timeout, now=self.timer())
+
+            statements = [(REGISTRY_UPSERT, row + (stamp, stamp))]
+            if came_online or self._history_due(state, now):
+                state.last_history = now
+                statements.append((HISTORY_INSERT, row + (stamp,)))
+
+        if came_online:
+            self._changed(room, node, 'online', now)
+        return statements
+
+    def status(self, room, node, status, ip_address=None):
+        """home/system/status JSON -> statements; always recorded in history (these are rare)"""
+        if room is None or node is None or status is None:
+            return []
+        stamp = self.clock()
+        now = stamp.timestamp()
+
+        with self._lock:
+            state = self._nodes.get((room, node))
+            if state is None:
+                state = self._nodes[(room, node)] = NodeState(None)
+            changed = state.status != status
+            state.status = status
+            state.last_seen = now
+            state.last_history = now
+            if status == 'online':
+                self.wheel.schedule((room, node), self.timeout, now=self.timer())
+            else:
+                self.wheel.cancel((room, node))
+
+        if changed:
+            self._changed(room, node, status, now)
+        return [
+            (REGISTRY_UPSERT, (room, node, None, status, ip_address, None, None, None, stamp, stamp)),
+            (HISTORY_INSERT, (room, node, None, status, ip_address, None, None, None, stamp)),
+        ]
+
+    def expire(self, now=None):
+        """Mark nodes whose timers fired as offline. Returns the (room, node) keys."""
+        with self._lock:
+            expired = self.wheel.advance(self.timer() if now is None else now)
+            for key in expired:
+                self._nodes[key].status = 'offline'
+
+        stamp = self.clock()
+        for room, node in expired:
+            last_seen = self._nodes[(room, node)].last_seen
+            logger.warning("Node %s/%s offline: missed %d heartbeats", room, node, self.missed)
+            # last_seen stays at the last heartbeat; status_since records when we noticed
+            self.writer.submit(REGISTRY_UPSERT, (room, node, None, 'offline', None, None, None, None, None, stamp))
+            self.writer.submit(HISTORY_INSERT, (room, node, None, 'offline', None, None, None, None, stamp))
+            self._changed(room, node, 'offline', last_seen)
+        return expired
+
+    def run_forever(self, stop_event, tick=WHEEL_TICK):
+        """Background loop for the receiver: turn the wheel once per tick"""
+        while not stop_event.wait(tick):
+            self.expire()
+
+    def _history_due(self, state, now):
+        return state.last_history is None or now - state.last_history >= self.history_interval
+
+    def _changed(self, room, node, status, last_seen):
+        if self.on_change is None:
+            return
+        try:
+            self.on_change(room, node, status, last_seen)
+        except Exception as e:
+            logger.error(f"Node status callback failed: {e}")
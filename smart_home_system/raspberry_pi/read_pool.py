@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Read-Only SQLite Connection Pool
+Pool connection chỉ-đọc (mode=ro, query_only) cho dashboard: tái sử dụng connection và
+prepared statement thay vì mở connection mới cho mỗi request
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# ===== POOL CONFIGURATION =====
+POOL_SIZE = 4                 # Connections kept open; one per concurrently serving request thread
+STATEMENT_CACHE = 64          # Prepared statements cached per connection (keyed by SQL text)
+
+
+class ReadPool:
+    """Bounded LIFO pool of read-only connections, opened lazily"""
+
+    def __init__(self, db_file, size=POOL_SIZE):
+        self.db_file = db_file
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True,
+                               check_same_thread=False, cached_statements=STATEMENT_CACHE)
+        conn.execute("PRAGMA query_only=ON")
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; blocks only when `size` requests already hold one"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._opened < self.size
+                if grow:
+                    self._opened += 1
+            if grow:
+                try:
+                    conn = self._open()
+                except sqlite3.Error:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                conn = self._idle.get()
+
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def dedicated(self):
+        """A fresh read-only connection outside the pool, for long reads (exports) that
+        shouldn't hold a pool slot"""
+        conn = self._open()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def query(self, sql, params=()):
+        """All rows as dicts. Keep `sql` constant and bind values so the statement is reused."""
+        with self.connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def query_one(self, sql, params=()):
+        with self.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+            return dict(row) if row is not None else None
+
+    def close(self):
+        """Close idle connections (ones still borrowed are closed when the pool is dropped)"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
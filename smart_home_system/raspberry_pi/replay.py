@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+MQTT Capture Replay
+Phát lại file capture (capture.py) qua pipeline xử lý của receiver, không cần broker, ở tốc độ 1x,
+Nx hoặc tối đa: dựng lại database, thử thay đổi schema, benchmark ingest với dữ liệu thật
+
+Usage:
+    python3 replay.py house.cap [--speed 1|10|max] [--db replay.db] [--start 2024-05-01T08:00] [--end ...]
+
+The receiver runs on the captured clock: sensor and door rows, alert open / resolve times and node
+liveness keep the captured timestamps, and alert debounce and heartbeat timeouts count captured
+seconds, so a max-speed replay opens, resolves and expires exactly like the live run did. System
+stats refreshes still follow the wall clock. Only the default home (home/... topics) is rebuilt;
+homes/<home>/... messages of a --multi-home capture are skipped with a warning.
+"""
+
+import logging
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import mqtt_receiver
+from capture import CaptureReader
+
+logger = logging.getLogger(__name__)
+
+# ===== REPLAY CONFIGURATION =====
+REPLAY_QUEUE_HEADROOM = 100   # Pause while the writer queue is this close to full (the live receiver would drop)
+REPLAY_BACKOFF = 0.001        # Seconds between queue checks while paused
+REPORT_INTERVAL = 10          # Seconds between progress lines
+
+Message = namedtuple('Message', ['topic', 'payload'])
+
+
+def replay(capture_file, db_file, speed=None, start=None, end=None):
+    """Feed a capture through SmartHomeMQTTReceiver.on_message. `speed` None = as fast as possible,
+    otherwise a multiple of real time; `start` / `end` are epoch seconds."""
+    # The liveness wheel starts at the receiver's clock, so that clock starts at the first replayed message
+    captured_at = [datetime.fromtimestamp(_first_timestamp(capture_file, start, end) or time.time())]
+
+    mqtt_receiver.DB_FILE = db_file
+    receiver = mqtt_receiver.SmartHomeMQTTReceiver(clock=lambda: captured_at[0])
+    receiver.registry.on_change = None  # No broker to publish liveness transitions to
+    receiver.start_background()
+
+    writer = receiver.writer
+    headroom = writer.queue.maxsize - REPLAY_QUEUE_HEADROOM
+    started = time.monotonic()
+    next_report = started + REPORT_INTERVAL
+    first = None
+    count = 0
+    try:
+        for timestamp, topic, payload in CaptureReader(capture_file):
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp >= end:
+                break
+            first = timestamp if first is None else first
+
+            if speed:
+                delay = (timestamp - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            while writer.queue.qsize() > headroom:
+                time.sleep(REPLAY_BACKOFF)
+
+            captured_at[0] = datetime.fromtimestamp(timestamp)
+            receiver.registry.expire()  # Nodes that went quiet before this message, at captured time
+            receiver.on_message(None, None, Message(topic, payload))
+            count += 1
+
+            now = time.monotonic()
+            if now >= next_report:
+                logger.info(f"Replayed {count:,} messages, up to {captured_at[0]} ({count / (now - started):,.0f} msg/s)")
+                next_report = now + REPORT_INTERVAL
+    finally:
+        receiver.shutdown()
+
+    elapsed = time.monotonic() - started
+    result = {
+        'messages': count,
+        'seconds': round(elapsed, 2),
+        'messages_per_s': round(count / elapsed, 1) if elapsed else None,
+        'writer': writer.stats(),
+    }
+    logger.info(f"Replay of {capture_file} into {db_file} finished: {result}")
+    return result
+
+
+def _first_timestamp(capture_file, start=None, end=None):
+    for timestamp, _, _ in CaptureReader(capture_file):
+        if start is not None and timestamp < start:
+            continue
+        return timestamp if end is None or timestamp < end else None
+    return None
+
+
+def _epoch(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {'--speed': 'max', '--db': None, '--start': None, '--end': None}
+    for name in options:
+        if name in args:
+            i = args.index(name)
+            options[name] = args[i + 1]
+            del args[i:i + 2]
+    if len(args) != 1:
+        sys.exit(__doc__)
+
+    capture_file = args[0]
+    db_file = options['--db'] or os.path.splitext(capture_file)[0] + "_replay.db"
+    if os.path.abspath(db_file) == os.path.abspath(mqtt_receiver.DB_FILE):
+        sys.exit("Refusing to replay into the live database; pass another --db")
+
+    speed = None if options['--speed'] == 'max' else float(options['--speed'])
+    replay(capture_file, db_file, speed, _epoch(options['--start']), _epoch(options['--end']))
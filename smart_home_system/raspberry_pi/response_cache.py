@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Dashboard Response Cache
+Cache TTL + LRU cho các API đọc database; tự vô hiệu khi receiver ghi dữ liệu mới
+(PRAGMA data_version + bảng table_versions) và cung cấp ETag/Last-Modified cho 304
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+
+class TableVersions:
+    """Per-table change counters written by db_writer, re-read only when the database changed"""
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._conn = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._versions = {}
+        self._changed_at = {}  # table -> wall time we first saw its current version
+        self._started = time.time()
+
+    def current(self, tables):
+        """(versions tuple, last-modified timestamp) for the given tables"""
+        with self._lock:
+            self._refresh()
+            versions = tuple(self._versions.get(t, 0) for t in tables)
+            if not self._versions:
+                # Database not migrated to table_versions yet: any commit invalidates
+                versions += (self._data_version,)
+            last_modified = max((self._changed_at.get(t, self._started) for t in tables), default=self._started)
+            return versions, last_modified
+
+    def _refresh(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+
+        # data_version moves whenever another connection commits; one pragma, no table read
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        try:
+            rows = self._conn.execute("SELECT name, version FROM table_versions").fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        now = time.time()
+        for name, version in rows:
+            if self._versions.get(name) != version:
+                self._versions[name] = version
+                self._changed_at[name] = now
+
+
+class CacheEntry:
+    __slots__ = ('body', 'etag', 'last_modified', 'versions', 'expires')
+
+    def __init__(self, body, versions, last_modified, expires):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = formatdate(last_modified, usegmt=True)
+        self.versions = versions
+        self.expires = expires
+
+
+class ResponseCache:
+    """LRU of rendered response bodies; an entry is stale after its TTL or once its tables change"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.versions == versions and entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, versions, body, last_modified, ttl):
+        entry = CacheEntry(body, versions, last_modified, time.monotonic() + ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Sensor History Retention & Compaction
+Xoá dữ liệu cũ theo từng bảng (chia nhỏ transaction), incremental VACUUM và giữ file WAL gọn
+
+Usage:
+    python3 retention.py [db_file]                              # Run all policies once
+    python3 retention.py --enable-incremental-vacuum [db_file]  # One-off: switch an old database
+                                                                # to auto_vacuum=INCREMENTAL (full VACUUM,
+                                                                # stop the receiver first)
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+
+# ===== RETENTION CONFIGURATION =====
+# 'key' identifies rows for the chunked DELETE (rollup tables are WITHOUT ROWID)
+RETENTION_POLICIES = [
+    {'table': 'environmental_data', 'column': 'timestamp', 'days': 7},
+    {'table': 'door_status', 'column': 'timestamp', 'days': 30},
+    {'table': 'system_status', 'column': 'timestamp', 'days': 1},
+    {'table': 'alerts', 'column': 'timestamp', 'days': 90, 'where': 'resolved = 1'},
+    {'table': 'environmental_rollup_1m', 'column': 'bucket', 'days': 30, 'key': 'room, node, bucket'},
+    {'table': 'environmental_rollup_1h', 'column': 'bucket', 'days': 365, 'key': 'room, node, bucket'},
+    {'table': 'environmental_rollup_1d', 'column': 'bucket', 'days': 365, 'key': 'room, node, bucket'},
+]
+DELETE_CHUNK_SIZE = 500       # Rows per transaction; keeps the write lock for milliseconds
+CHUNK_PAUSE = 0.05            # Seconds between chunks so the ingest writer can get the lock
+VACUUM_PAGES = 1000           # Free pages returned to the filesystem per incremental_vacuum
+WAL_SIZE_LIMIT = 8 * 1024 * 1024
+
+
+class RetentionEngine:
+    """Apply RETENTION_POLICIES in small transactions next to the live ingest writer"""
+
+    def __init__(self, db_file, policies=RETENTION_POLICIES, chunk_size=DELETE_CHUNK_SIZE,
+                 chunk_pause=CHUNK_PAUSE):
+        self.db_file = db_file
+        self.policies = policies
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.execute(f"PRAGMA journal_size_limit={WAL_SIZE_LIMIT}")
+        return conn
+
+    def _disk_usage(self):
+        total = 0
+        for suffix in ('', '-wal'):
+            try:
+                total += os.path.getsize(self.db_file + suffix)
+            except OSError:
+                pass
+        return total
+
+    def prune_table(self, conn, policy):
+        """Delete expired rows of one table chunk by chunk. Returns rows deleted."""
+        table = policy['table']
+        column = policy['column']
+        key = policy.get('key', 'id')
+        cutoff = (datetime.now() - timedelta(days=policy['days'])).strftime('%Y-%m-%d %H:%M:%S')
+
+        where = f"{column} < ?"
+        if policy.get('where'):
+            where += f" AND {policy['where']}"
+        sql = f'''
+            DELETE FROM {table} WHERE ({key}) IN (
+                SELECT {key} FROM {table} WHERE {where} LIMIT ?
+            )
+        '''
+
+        deleted = 0
+        while True:
+            try:
+                count = conn.execute(sql, (cutoff, self.chunk_size)).rowcount
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if "no such table" in str(e):
+                    return deleted
+                raise
+            deleted += count
+            if count < self.chunk_size:
+                return deleted
+            time.sleep(self.chunk_pause)
+
+    def compact(self, conn):
+        """Give free pages back to the filesystem and truncate the WAL"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while True:
+                free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if not free:
+                    break
+                # incremental_vacuum frees one page per step, and sqlite3 steps a statement without result
+                # columns only once: run it until the chunk is free, in one transaction, then pause
+                conn.execute("BEGIN")
+                for _ in range(min(free, VACUUM_PAGES)):
+                    conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+                conn.commit()
+                time.sleep(self.chunk_pause)
+        # TRUNCATE waits for readers; if the writer is busy the checkpoint is just partial
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def run_once(self):
+        """Run every policy, then compact. Returns a report of rows and bytes reclaimed."""
+        started = time.monotonic()
+        size_before = self._disk_usage()
+        conn = self._connect()
+        rows = {}
+
+        try:
+            for policy in self.policies:
+                rows[policy['table']] = self.prune_table(conn, policy)
+            self.compact(conn)
+        finally:
+            conn.close()
+
+        report = {
+            'rows_deleted': rows,
+            'bytes_reclaimed': max(0, size_before - self._disk_usage()),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+        logger.info(f"Retention run: {sum(rows.values())} rows deleted, "
+                    f"{report['bytes_reclaimed']} bytes reclaimed in {report['seconds']}s {rows}")
+        return report
+
+    def run_forever(self, stop_event, interval):
+        """Background loop: run every `interval` seconds until stop_event is set"""
+        while not stop_event.wait(interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention error: {e}")
+
+
+def enable_incremental_vacuum(db_file):
+    """Switch an existing database to auto_vacuum=INCREMENTAL (rewrites the whole file)"""
+    conn = sqlite3.connect(db_file)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    conn.close()
+    return mode == 2
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    args = sys.argv[1:]
+    enable = "--enable-incremental-vacuum" in args
+    args = [a for a in args if a != "--enable-incremental-vacuum"]
+    db_file = args[0] if args else DB_FILE
+
+    if enable:
+        print("auto_vacuum=INCREMENTAL enabled" if enable_incremental_vacuum(db_file)
+              else "Failed to enable incremental vacuum")
+    else:
+        RetentionEngine(db_file).run_once()
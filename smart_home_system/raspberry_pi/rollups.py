@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Environmental Data Rollups
+Bảng tổng hợp theo phút / giờ / ngày (min/max/avg/count) cho biểu đồ dài hạn
+"""
+
+from datetime import datetime, timedelta
+
+# Aggregated columns of environmental_data
+METRICS = ('temperature', 'humidity', 'gas_analog')
+
+# (name, table, bucket length in seconds, strftime format of the bucket start), finest first
+RESOLUTIONS = [
+    ('1m', 'environmental_rollup_1m', 60, '%Y-%m-%d %H:%M:00'),
+    ('1h', 'environmental_rollup_1h', 3600, '%Y-%m-%d %H:00:00'),
+    ('1d', 'environmental_rollup_1d', 86400, '%Y-%m-%d 00:00:00'),
+]
+
+# A chart never needs more points than this; the query picks the finest resolution under it
+MAX_POINTS = 500
+
+
+def _upsert_sql(table):
+    columns = ['room', 'node', 'bucket', 'readings']
+    updates = ['readings = readings + excluded.readings']
+    for m in METRICS:
+        columns += [f'{m}_count', f'{m}_sum', f'{m}_min', f'{m}_max']
+        updates += [
+            f'{m}_count = {m}_count + excluded.{m}_count',
+            # NULL-safe: a bucket (or a reading) may not have this metric yet
+            f'{m}_sum = COALESCE({m}_sum + excluded.{m}_sum, {m}_sum, excluded.{m}_sum)',
+            f'{m}_min = COALESCE(MIN({m}_min, excluded.{m}_min), {m}_min, excluded.{m}_min)',
+            f'{m}_max = COALESCE(MAX({m}_max, excluded.{m}_max), {m}_max, excluded.{m}_max)',
+        ]
+    return f'''
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT (room, node, bucket) DO UPDATE SET {', '.join(updates)}
+    '''
+
+
+_UPSERTS = {table: _upsert_sql(table) for _, table, _, _ in RESOLUTIONS}
+
+
+def rollup_statements(room, node, timestamp, temperature, humidity, gas_analog):
+    """(sql, params) upserts that fold one reading into every rollup resolution"""
+    values = []
+    for value in (temperature, humidity, gas_analog):
+        values += [0 if value is None else 1, value, value, value]
+
+    return [
+        (_UPSERTS[table], (room, node, timestamp.strftime(fmt), 1, *values))
+        for _, table, _, fmt in RESOLUTIONS
+    ]
+
+
+def choose_resolution(span_seconds, max_points=MAX_POINTS):
+    """Finest resolution that fits the span in max_points buckets (falls back to the coarsest)"""
+    for resolution in RESOLUTIONS:
+        if span_seconds / resolution[2] <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+def query_rollup(conn, room, hours, node=None, max_points=MAX_POINTS):
+    """Aggregated history of one room over the last `hours`. Returns (resolution name, rows)."""
+    name, table, _, fmt = choose_resolution(hours * 3600, max_points)
+    since = (datetime.now() - timedelta(hours=hours)).strftime(fmt)
+
+    selects = ['room', 'node', 'bucket', 'readings']
+    for m in METRICS:
+        selects += [
+            f'ROUND({m}_sum / NULLIF({m}_count, 0), 2) AS {m}_avg',
+            f'{m}_min',
+            f'{m}_max',
+        ]
+
+    query = f"SELECT {', '.join(selects)} FROM {table} WHERE room = ? AND bucket >= ?"
+    params = [room, since]
+    if node:
+        query += " AND node = ?"
+        params.append(node)
+    query += " ORDER BY bucket"
+
+    return name, conn.execute(query, params).fetchall()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Smart Home Database Schema & Migrations
+Quản lý phiên bản schema của smart_home.db và nâng cấp database đang chạy tại chỗ
+
+Usage:
+    python3 schema.py [db_file]            # Apply pending migrations
+    python3 -m pytest test_schema.py       # Fail if a dashboard query scans or sorts a table
+"""
+
+import sqlite3
+import sys
+
+DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+
+def _rollup_table(table, bucket_format):
+    """DDL + backfill from existing raw rows for one environmental rollup resolution"""
+    metrics = ('temperature', 'humidity', 'gas_analog')
+    columns = ',\n'.join(
+        f"            {m}_count INTEGER NOT NULL DEFAULT 0, {m}_sum REAL, {m}_min REAL, {m}_max REAL"
+        for m in metrics)
+    aggregates = ', '.join(
+        f"COUNT({m}), SUM({m}), MIN({m}), MAX({m})" for m in metrics)
+    return [
+        f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            room TEXT NOT NULL,
+            node TEXT NOT NULL,
+            bucket DATETIME NOT NULL,
+            readings INTEGER NOT NULL DEFAULT 0,
+{columns},
+            PRIMARY KEY (room, node, bucket)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        INSERT OR IGNORE INTO {table}
+        SELECT room, node, strftime('{bucket_format}', timestamp) AS bucket, COUNT(*), {aggregates}
+        FROM environmental_data
+        GROUP BY room, node, bucket
+        ''',
+    ]
+
+
+# ===== MIGRATIONS =====
+# Ordered (version, description, statements). Never edit an applied migration, append a new one.
+MIGRATIONS = [
+    (1, "base tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS environmental_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL,
+            node TEXT NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            gas_analog INTEGER,
+            gas_status TEXT,
+            fire_detected BOOLEAN,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS door_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL,
+            node TEXT NOT NULL,
+            door_state TEXT,
+            door_angle INTEGER,
+            presence_detected BOOLEAN,
+            last_action TEXT,
+            manual_override BOOLEAN,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS system_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT,
+            node TEXT,
+            device_type TEXT,
+            status TEXT,
+            ip_address TEXT,
+            uptime INTEGER,
+            free_heap INTEGER,
+            wifi_rssi INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL,
+            node TEXT NOT NULL,
+            alert_type TEXT NOT NULL,
+            message TEXT,
+            severity TEXT,
+            resolved BOOLEAN DEFAULT FALSE,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, "indexes for dashboard and receiver queries", [
+        # Per-node history, per-room history, and "latest N readings" without a room filter
+        "CREATE INDEX IF NOT EXISTS idx_env_room_node_time ON environmental_data (room, node, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_env_room_time ON environmental_data (room, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_env_time ON environmental_data (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_door_room_node_time ON door_status (room, node, timestamp)",
+        # Online devices: partial, heartbeats with any other status never enter the index
+        "CREATE INDEX IF NOT EXISTS idx_system_online_time ON system_status (timestamp) WHERE status = 'online'",
+        # Alert list and open alerts by severity (resolved = ? is a bound parameter, so not partial)
+        "CREATE INDEX IF NOT EXISTS idx_alerts_resolved ON alerts (resolved, severity, timestamp)",
+    ]),
+    (3, "environmental rollups (1 minute / 1 hour / 1 day)",
+        _rollup_table("environmental_rollup_1m", "%Y-%m-%d %H:%M:00")
+        + _rollup_table("environmental_rollup_1h", "%Y-%m-%d %H:00:00")
+        + _rollup_table("environmental_rollup_1d", "%Y-%m-%d 00:00:00")),
+    (4, "alert state tracking", [
+        "ALTER TABLE alerts ADD COLUMN occurrences INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE alerts ADD COLUMN resolved_at DATETIME",
+        # Escalate / resolve updates address the single open row of a (room, node, alert_type)
+        "CREATE INDEX IF NOT EXISTS idx_alerts_open_key ON alerts (room, node, alert_type) WHERE resolved = 0",
+    ]),
+    (5, "per-table change counters", [
+        # Bumped by the DB writer in the same transaction as the data; the dashboard cache reads it
+        '''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (6, "materialized system stats", [
+        # One JSON document maintained by the receiver (system_stats.py), read by /api/system_stats
+        '''
+        CREATE TABLE IF NOT EXISTS system_stats (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at DATETIME
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (7, "node registry (one row per node, see node_registry.py)", [
+        '''
+        CREATE TABLE IF NOT EXISTS node_registry (
+            room TEXT NOT NULL,
+            node TEXT NOT NULL,
+            device_type TEXT,
+            status TEXT NOT NULL,
+            ip_address TEXT,
+            uptime INTEGER,
+            free_heap INTEGER,
+            wifi_rssi INTEGER,
+            last_seen DATETIME,
+            status_since DATETIME,
+            PRIMARY KEY (room, node)
+        ) WITHOUT ROWID
+        ''',
+        # Latest system_status row of every node (bare columns come from the MAX row)
+        '''
+        INSERT OR IGNORE INTO node_registry
+        (room, node, device_type, status, ip_address, uptime, free_heap, wifi_rssi, last_seen, status_since)
+        SELECT room, node, device_type, status, ip_address, uptime, free_heap, wifi_rssi,
+               MAX(timestamp), MAX(timestamp)
+        FROM system_status
+        WHERE room IS NOT NULL AND node IS NOT NULL AND status IS NOT NULL
+        GROUP BY room, node
+        ''',
+    ]),
+    (8, "time-ordered indexes for streaming exports", [
+        # export_stream.py walks one of these in time order instead of sorting the whole table
+        "CREATE INDEX IF NOT EXISTS idx_door_time ON door_status (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_system_time ON system_status (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1m_bucket ON environmental_rollup_1m (bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1h_bucket ON environmental_rollup_1h (bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1d_bucket ON environmental_rollup_1d (bucket)",
+    ]),
+    (9, "indexes for sorted dashboard queries", [
+        # Alert list: newest first among resolved = ?, without sorting every open alert
+        "CREATE INDEX IF NOT EXISTS idx_alerts_resolved_time ON alerts (resolved, timestamp)",
+        # Room history without a node filter (the primary key is room, node, bucket)
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1m_room_bucket ON environmental_rollup_1m (room, bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1h_room_bucket ON environmental_rollup_1h (room, bucket)",
+        "CREATE INDEX IF NOT EXISTS idx_rollup_1d_room_bucket ON environmental_rollup_1d (room, bucket)",
+    ]),
+]
+
+# One row per node / per stats publisher: reading the whole table is what those queries are for
+SMALL_TABLES = ('node_registry', 'system_stats')
+
+def get_version(conn):
+    """Current schema version (0 for a database that predates migrations)"""
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """Apply pending migrations in order, one transaction each. Returns the final version."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    for version, description, statements in MIGRATIONS:
+        # IMMEDIATE takes the write lock first, so receiver and tools can't apply the same step twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return get_version(conn)
+
+
+def find_full_scans(conn, queries):
+    """Return [(name, plan_detail)] for every (name, sql, params) query whose plan scans a table
+    without an index or sorts its result (a temp B-tree for ORDER BY)"""
+    offenders = []
+    for name, sql, params in queries:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[-1]
+            if detail.startswith("SCAN ") and ("INDEX" in detail or detail.split()[1] in SMALL_TABLES):
+                continue
+            if detail.startswith("SCAN ") or "TEMP B-TREE FOR ORDER BY" in detail:
+                offenders.append((name, detail))
+    return offenders
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DB_FILE)
+    print(f"Schema version: {migrate(conn)}")
+    conn.close()
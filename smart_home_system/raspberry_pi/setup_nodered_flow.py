@@ -9,6 +9,24 @@ import requests
 import time
 import subprocess
 
+# Decodes telemetry.py's v1 binary tick (home/<room>/node1/telemetry/tick, 9 bytes little-endian)
+# into [temperature, humidity, gas status] messages for the gauges; fields the node didn't send are skipped
+TELEMETRY_DECODE_JS = """
+const b = msg.payload;
+if (!Buffer.isBuffer(b) || b.length !== 9 || b[0] !== 1) {
+    node.warn("Unsupported telemetry tick");
+    return null;
+}
+const present = b.readUInt8(1);
+const flags = b.readUInt8(8);
+const levels = ["SAFE", "WARNING", "DANGER"];
+return [
+    present & 0x01 ? {payload: b.readInt16LE(2) / 10} : null,
+    present & 0x02 ? {payload: b.readInt16LE(4) / 10} : null,
+    present & 0x08 ? {payload: levels[flags & 0x03] || "UNKNOWN"} : null
+];
+"""
+
 # Node-RED flow configuration
 NODERED_FLOW = [
     {
@@ -76,7 +94,60 @@ NODERED_FLOW = [
         "wires": [["door_status_bedroom"]]
     },
     
+    # Binary ticks (sketches with PUBLISH_TEXT_TOPICS 0 only send these)
+    {
+        "id": "mqtt_bedroom_tick",
+        "type": "mqtt in",
+        "z": "smart_home_tab",
+        "name": "Bedroom Telemetry Tick",
+        "topic": "home/bedroom/node1/telemetry/tick",
+        "qos": "0",
+        "datatype": "buffer",
+        "broker": "mqtt_broker",
+        "x": 180,
+        "y": 40,
+        "wires": [["decode_bedroom_tick"]]
+    },
+    
+    {
+        "id": "decode_bedroom_tick",
+        "type": "function",
+        "z": "smart_home_tab",
+        "name": "Decode Tick",
+        "func": TELEMETRY_DECODE_JS,
+        "outputs": 3,
+        "x": 330,
+        "y": 40,
+        "wires": [["temp_gauge_bedroom"], ["humidity_gauge_bedroom"], ["gas_status_bedroom"]]
+    },
+    
     # Living Room MQTT Inputs
+    {
+        "id": "mqtt_living_tick",
+        "type": "mqtt in",
+        "z": "smart_home_tab",
+        "name": "Living Room Telemetry Tick",
+        "topic": "home/livingroom/node1/telemetry/tick",
+        "qos": "0",
+        "datatype": "buffer",
+        "broker": "mqtt_broker",
+        "x": 180,
+        "y": 520,
+        "wires": [["decode_living_tick"]]
+    },
+    
+    {
+        "id": "decode_living_tick",
+        "type": "function",
+        "z": "smart_home_tab",
+        "name": "Decode Tick",
+        "func": TELEMETRY_DECODE_JS,
+        "outputs": 3,
+        "x": 330,
+        "y": 520,
+        "wires": [["temp_gauge_living"], ["humidity_gauge_living"], []]
+    },
+    
     {
         "id": "mqtt_living_temp",
         "type": "mqtt in",
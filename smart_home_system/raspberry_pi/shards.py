@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Multi-Home Database Shards
+Mỗi nhà (căn hộ) một file SQLite riêng: topic homes/<home>/<room>/<node>/... ghi vào shard của nhà đó,
+nhà mặc định vẫn dùng topic home/... và DB_FILE như trước
+
+Usage:
+    python3 shards.py [shard_dir]   # List shards and their sizes
+"""
+
+import os
+import re
+import sys
+
+# ===== SHARD CONFIGURATION =====
+SHARD_DIR = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/homes"
+DEFAULT_HOME = "default"      # The original single house: topics home/..., database DB_FILE
+HOMES_TOPIC_ROOT = "homes"    # homes/<home>/<room>/<node>/<device>/<attribute>, homes/<home>/system/...
+MAX_HOMES = 32                # Shards one receiver process will open (each has its own writer thread)
+
+# Home names become file names and topic levels: keep them plain
+HOME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def valid_home(home):
+    return bool(HOME_PATTERN.match(home or ''))
+
+
+def shard_file(home, default_db, shard_dir=SHARD_DIR):
+    """Database file of `home`; raises ValueError for names that aren't valid homes"""
+    if home == DEFAULT_HOME:
+        return default_db
+    if not valid_home(home):
+        raise ValueError(f"Invalid home name {home!r}")
+    return os.path.join(shard_dir, f"{home}.db")
+
+
+def list_homes(shard_dir=SHARD_DIR):
+    """DEFAULT_HOME plus every home that has a shard file, sorted"""
+    try:
+        names = os.listdir(shard_dir)
+    except FileNotFoundError:
+        names = []
+    homes = sorted(name[:-3] for name in names if name.endswith('.db') and valid_home(name[:-3]))
+    return [DEFAULT_HOME] + [home for home in homes if home != DEFAULT_HOME]
+
+
+def topic_prefix(home):
+    """Topic root the nodes of `home` publish under"""
+    return "home" if home == DEFAULT_HOME else f"{HOMES_TOPIC_ROOT}/{home}"
+
+
+if __name__ == "__main__":
+    shard_dir = sys.argv[1] if len(sys.argv) > 1 else SHARD_DIR
+    for home in list_homes(shard_dir)[1:]:
+        path = shard_file(home, None, shard_dir)
+        size = sum(os.path.getsize(f) for f in (path, path + "-wal") if os.path.exists(f))
+        print(f"{home:<24} {size / 2 ** 20:10.1f} MB  {path}")
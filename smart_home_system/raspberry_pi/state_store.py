@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Versioned In-Memory State Store
+Trạng thái real-time của tất cả room/node cho dashboard: tự phát hiện node mới, cập nhật
+copy-on-write (đọc không cần lock), version tăng dần cho từng key và snapshot JSON có cache
+"""
+
+import json
+import threading
+
+
+class StateStore:
+    """room -> node -> field state with a monotonically increasing version per field"""
+
+    def __init__(self, defaults=None):
+        # (version, {(room, node): {field: (value, version)}}). Every level is replaced, never
+        # mutated, and swapped in one assignment, so readers see a consistent pair without locking
+        self._state = (0, {})
+        self._write_lock = threading.Lock()
+        self._json_cache = (None, None)  # (version, serialized snapshot)
+
+        for room, nodes in (defaults or {}).items():
+            for node, fields in nodes.items():
+                self.update(room, node, fields)
+
+    @property
+    def version(self):
+        return self._state[0]
+
+    def update(self, room, node, fields):
+        """Merge fields into one node (created on first sight). Returns the store version;
+        unchanged values don't bump it."""
+        key = (room, node)
+        with self._write_lock:
+            version, nodes = self._state
+            current = nodes.get(key, {})
+            changed = {f: v for f, v in fields.items() if f not in current or current[f][0] != v}
+            if not changed:
+                return version
+
+            version += 1
+            merged = dict(current)
+            for field, value in changed.items():
+                merged[field] = (value, version)
+
+            nodes = dict(nodes)
+            nodes[key] = merged
+            self._state = (version, nodes)
+            return version
+
+    def snapshot(self, nodes=None):
+        """Nested {room: {node: {field: value}}} copy of the current state"""
+        nodes = self._state[1] if nodes is None else nodes
+        result = {}
+        for (room, node), fields in nodes.items():
+            result.setdefault(room, {})[node] = {f: value for f, (value, _) in fields.items()}
+        return result
+
+    def snapshot_json(self):
+        """(version, JSON text) of snapshot(); serialized at most once per version"""
+        cached_version, text = self._json_cache
+        version, nodes = self._state
+        if cached_version != version:
+            text = json.dumps(self.snapshot(nodes))
+            self._json_cache = (version, text)
+        return version, text
+
+    def changes_since(self, since):
+        """(current version, nested dict of fields updated after `since`)"""
+        current, nodes = self._state
+        changes = {}
+        for (room, node), fields in nodes.items():
+            changed = {f: value for f, (value, version) in fields.items() if version > since}
+            if changed:
+                changes.setdefault(room, {})[node] = changed
+        return current, changes
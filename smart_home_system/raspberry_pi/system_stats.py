@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Materialized System Statistics
+Receiver tự duy trì các bộ đếm cho /api/system_stats (readings/giờ, node online, cảnh báo
+đang mở theo severity) và ghi một dòng vào bảng system_stats; đối chiếu với database khi khởi động
+
+Usage:
+    python3 system_stats.py [db_file]      # Compare the stored counters with the database
+"""
+
+import json
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from node_registry import HEARTBEAT_INTERVAL, MISSED_HEARTBEATS
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+
+# ===== STATS CONFIGURATION =====
+READINGS_WINDOW = 3600        # recent_readings: environmental rows in the last hour...
+READINGS_BUCKET = 60          # ...counted in one-minute buckets
+STATS_PUBLISH_INTERVAL = 5    # Seconds between writes of the stats row (only when it changed)...
+STATS_REFRESH_INTERVAL = 15   # ...and at least this often, so readers can tell a stopped receiver
+STATS_STALE_AFTER = 3 * STATS_REFRESH_INTERVAL  # Readers ignore a stored row older than this
+
+STATS_NAME = 'current'          # Row of a single receiver; ingest_supervisor.py workers write 'worker-<i>'
+
+STATS_UPSERT = '''
+    INSERT INTO system_stats (name, value, updated_at) VALUES (?, ?, ?)
+    ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+'''
+
+
+class SlidingWindowCounter:
+    """Events in the last `window` seconds as fixed buckets plus a running total (O(1) reads)"""
+
+    def __init__(self, window=READINGS_WINDOW, bucket=READINGS_BUCKET):
+        self.window = window
+        self.bucket = bucket
+        self._buckets = deque()  # [bucket start, count], oldest first
+        self._total = 0
+
+    def add(self, count=1, now=None):
+        now = time.time() if now is None else now
+        start = now - now % self.bucket
+        if self._buckets and self._buckets[-1][0] >= start:
+            self._buckets[-1][1] += count
+        else:
+            self._buckets.append([start, count])
+        self._total += count
+
+    def total(self, now=None):
+        now = time.time() if now is None else now
+        horizon = now - self.window
+        while self._buckets and self._buckets[0][0] + self.bucket <= horizon:
+            self._total -= self._buckets.popleft()[1]
+        return self._total
+
+    def clear(self):
+        self._buckets.clear()
+        self._total = 0
+
+
+def count_from_database(conn, now=None, owns=None):
+    """The three aggregates the stats endpoint used to run, with the same windows as the counters.
+    Returns (alerts by severity, {(room, node): last online time}, readings per minute).
+    With `owns(room, node)` only those nodes are counted (an ingest_supervisor.py worker's share)."""
+    now = datetime.now() if now is None else now
+
+    if owns is None:
+        alerts = dict(conn.execute('''
+            SELECT severity, COUNT(*) FROM alerts WHERE resolved = 0 GROUP BY severity
+        ''').fetchall())
+    else:
+        alerts = Counter()
+        for room, node, severity, count in conn.execute('''
+            SELECT room, node, severity, COUNT(*) FROM alerts WHERE resolved = 0 GROUP BY room, node, severity
+        '''):
+            if owns(room, node):
+                alerts[severity] += count
+        alerts = dict(alerts)
+
+    # Liveness is tracked by node_registry.py (offline after missed heartbeats); without a running
+    # receiver nobody marks nodes offline, so a node past its heartbeat deadline isn't counted
+    heard_since = now - timedelta(seconds=HEARTBEAT_INTERVAL * MISSED_HEARTBEATS)
+    last_seen = {
+        (room, node): datetime.fromisoformat(seen).timestamp() if seen else None
+        for room, node, seen in conn.execute('''
+            SELECT room, node, last_seen FROM node_registry WHERE status = 'online' AND last_seen >= ?
+        ''', (heard_since,))
+        if owns is None or owns(room, node)
+    }
+
+    # From the start of the oldest minute bucket the sliding counter still holds
+    since = (now - timedelta(seconds=READINGS_WINDOW)).replace(second=0, microsecond=0)
+    if owns is None:
+        per_minute = conn.execute('''
+            SELECT strftime('%Y-%m-%d %H:%M:00', timestamp) AS minute, COUNT(*)
+            FROM environmental_data WHERE timestamp >= ?
+            GROUP BY minute ORDER BY minute
+        ''', (since,)).fetchall()
+    else:
+        counts = Counter()
+        for room, node, minute, count in conn.execute('''
+            SELECT room, node, strftime('%Y-%m-%d %H:%M:00', timestamp) AS minute, COUNT(*)
+            FROM environmental_data WHERE timestamp >= ?
+            GROUP BY room, node, minute
+        ''', (since,)):
+            if owns(room, node):
+                counts[minute] += count
+        per_minute = sorted(counts.items())
+    readings = [(datetime.fromisoformat(minute).timestamp(), count) for minute, count in per_minute]
+    return alerts, last_seen, readings
+
+
+def stats_document(alerts, online_devices, recent_readings):
+    """The /api/system_stats response body"""
+    return {
+        'alerts': [{'severity': s, 'count': c} for s, c in sorted(alerts.items()) if c],
+        'online_devices': online_devices,
+        'recent_readings': recent_readings,
+    }
+
+
+def load_stored(conn, max_age=None, name=None):
+    """Stored stats document, or None if no receiver has published one yet (or, with `max_age`
+    in seconds, not recently: it isn't running and the counters are frozen). The rows of
+    ingest_supervisor.py workers each count their own nodes and are added up; `name` reads one row."""
+    try:
+        if name is None:
+            rows = conn.execute("SELECT value, updated_at FROM system_stats").fetchall()
+        else:
+            rows = conn.execute("SELECT value, updated_at FROM system_stats WHERE name = ?", (name,)).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    if max_age is not None:
+        now = datetime.now()
+        rows = [(value, updated_at) for value, updated_at in rows
+                if updated_at and (now - datetime.fromisoformat(updated_at)).total_seconds() <= max_age]
+    if not rows:
+        return None
+    if len(rows) == 1:
+        return json.loads(rows[0][0])
+
+    alerts = Counter()
+    online_devices = recent_readings = 0
+    for value, _ in rows:
+        document = json.loads(value)
+        for alert in document.get('alerts', []):
+            alerts[alert['severity']] += alert['count']
+        online_devices += document.get('online_devices', 0)
+        recent_readings += document.get('recent_readings', 0)
+    return stats_document(alerts, online_devices, recent_readings)
+
+
+class SystemStats:
+    """Counters behind /api/system_stats, updated by the receiver as messages are processed.
+    Published as row `name`; `owns(room, node)` limits the reconcile count to the nodes this
+    receiver handles (ingest_supervisor.py workers)."""
+
+    def __init__(self, alert_engine, registry, name=STATS_NAME, owns=None):
+        self.alert_engine = alert_engine
+        self.registry = registry
+        self.name = name
+        self.owns = owns
+        self.readings = SlidingWindowCounter()
+        self._lock = threading.Lock()
+        self._published = None
+        self._published_at = 0.0
+
+    def record_readings(self, count, now=None):
+        if count:
+            with self._lock:
+                self.readings.add(count, now)
+
+    def snapshot(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            readings = self.readings.total(now)
+        alerts = Counter(self.alert_engine.open_alerts().values())
+        return stats_document(alerts, self.registry.online_count(), readings)
+
+    def reconcile(self, conn):
+        """Rebuild the counters from the database, log how far the stored row had drifted.
+        Returns {stat: (stored, database)} for the stats that differed. Call after the alert
+        engine and node registry have loaded."""
+        alerts, _, readings = count_from_database(conn, owns=self.owns)
+        with self._lock:
+            self.readings.clear()
+            for minute, count in readings:
+                self.readings.add(count, minute)
+
+        actual = self.snapshot()
+        # The engine has just loaded (and de-duplicated) the open alerts; the table must agree
+        engine_alerts = {a['severity']: a['count'] for a in actual['alerts']}
+        if engine_alerts != alerts:
+            logger.warning(f"Open alert counts differ: engine {engine_alerts}, database {alerts}")
+
+        stored = load_stored(conn, name=self.name) or {}
+        drift = {key: (stored.get(key), value) for key, value in actual.items() if stored.get(key) != value}
+        if drift:
+            logger.info(f"System stats reconciled with database: {drift}")
+        return drift
+
+    def publish(self, writer, refresh=STATS_REFRESH_INTERVAL):
+        """Queue the stats row if anything changed since the last publish, or to refresh updated_at"""
+        document = self.snapshot()
+        now = time.monotonic()
+        if document == self._published and now - self._published_at < refresh:
+            return False
+        if writer.submit(STATS_UPSERT, (self.name, json.dumps(document), datetime.now())):
+            self._published = document
+            self._published_at = now
+            return True
+        return False
+
+    def run_forever(self, writer, stop_event, interval=STATS_PUBLISH_INTERVAL):
+        """Background loop for the receiver: windows age even when no message arrives"""
+        self.publish(writer)
+        while not stop_event.wait(interval):
+            self.publish(writer)
+
+
+def check(db_file):
+    """Print stored counters next to a fresh count from the database"""
+    conn = sqlite3.connect(db_file)
+    alerts, last_seen, readings = count_from_database(conn)
+    stored = load_stored(conn, STATS_STALE_AFTER)
+    conn.close()
+
+    actual = stats_document(alerts, len(last_seen), sum(count for _, count in readings))
+    if stored is None:
+        print("No recent stored system stats (receiver not running, not upgraded or not started yet)")
+        stored = {}
+    ok = True
+    for key, value in actual.items():
+        mark = "OK  " if stored.get(key) == value else "DIFF"
+        ok = ok and mark == "OK  "
+        print(f"{mark} {key}: stored={stored.get(key)} database={value}")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if check(sys.argv[1] if len(sys.argv) > 1 else DB_FILE) else 1)
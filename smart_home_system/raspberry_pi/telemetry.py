@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Binary Tick Telemetry
+Định dạng nhị phân có version cho topic home/<room>/<node>/telemetry/tick: một message 9 byte
+chứa cả nhịp đo (nhiệt độ, độ ẩm, gas, trạng thái gas, lửa) thay cho 5 message text
+
+Usage:
+    python3 telemetry.py 011f09016202d20401  # Decode a hex payload
+"""
+
+import struct
+import sys
+
+# ===== TELEMETRY FORMAT =====
+# v1, little-endian, 9 bytes (must match encodeTelemetryTick() in the .ino sketches):
+#   B  version       1
+#   B  present       bit per field below; a missing field is sent as 0 and decoded as None
+#   h  temperature   degrees C x 10
+#   h  humidity      % x 10
+#   H  gas_analog    raw ADC value
+#   B  flags         bits 0-1 gas level (0 SAFE, 1 WARNING, 2 DANGER), bit 2 fire detected
+TELEMETRY_VERSION = 1
+TELEMETRY_V1 = struct.Struct('<BBhhHB')
+
+PRESENT_TEMPERATURE = 0x01
+PRESENT_HUMIDITY = 0x02
+PRESENT_GAS_ANALOG = 0x04
+PRESENT_GAS_STATUS = 0x08
+PRESENT_FIRE = 0x10
+
+GAS_LEVELS = ('SAFE', 'WARNING', 'DANGER')
+GAS_LEVEL_MASK = 0x03
+FIRE_FLAG = 0x04
+
+# Field -> (device, attribute, text payload) of the per-field topic it replaces
+LEGACY_TOPICS = {
+    'temperature': ('temperature_sensor', 'value', lambda v: f"{v:.1f}"),
+    'humidity': ('humidity_sensor', 'value', lambda v: f"{v:.1f}"),
+    'gas_analog': ('gas_sensor', 'analog_value', str),
+    'gas_status': ('gas_sensor', 'status', str),
+    'fire_detected': ('flame_sensor', 'alert', lambda v: "FIRE_DETECTED" if v else "NO_FIRE"),
+}
+
+
+def decode(payload):
+    """Binary tick -> {field: value} (None for fields the node didn't send); raises ValueError"""
+    if not payload or payload[0] != TELEMETRY_VERSION:
+        raise ValueError(f"Unsupported telemetry version {payload[:1].hex() or 'empty'}")
+    if len(payload) != TELEMETRY_V1.size:
+        raise ValueError(f"Telemetry v1 is {TELEMETRY_V1.size} bytes, got {len(payload)}")
+
+    _, present, temperature, humidity, gas_analog, flags = TELEMETRY_V1.unpack(payload)
+    level = flags & GAS_LEVEL_MASK
+    if level >= len(GAS_LEVELS):
+        raise ValueError(f"Unknown gas level {level}")
+    return {
+        'temperature': temperature / 10 if present & PRESENT_TEMPERATURE else None,
+        'humidity': humidity / 10 if present & PRESENT_HUMIDITY else None,
+        'gas_analog': gas_analog if present & PRESENT_GAS_ANALOG else None,
+        'gas_status': GAS_LEVELS[level] if present & PRESENT_GAS_STATUS else None,
+        'fire_detected': bool(flags & FIRE_FLAG) if present & PRESENT_FIRE else None,
+    }
+
+
+def encode(fields):
+    """{field: value} -> binary tick (what the nodes send; used by tools and simulators)"""
+    present = 0
+    temperature = fields.get('temperature')
+    humidity = fields.get('humidity')
+    gas_analog = fields.get('gas_analog')
+    gas_status = fields.get('gas_status')
+    fire = fields.get('fire_detected')
+
+    flags = 0
+    if temperature is not None:
+        present |= PRESENT_TEMPERATURE
+    if humidity is not None:
+        present |= PRESENT_HUMIDITY
+    if gas_analog is not None:
+        present |= PRESENT_GAS_ANALOG
+    if gas_status is not None:
+        present |= PRESENT_GAS_STATUS
+        flags |= GAS_LEVELS.index(gas_status)
+    if fire is not None:
+        present |= PRESENT_FIRE
+        flags |= FIRE_FLAG if fire else 0
+
+    return TELEMETRY_V1.pack(TELEMETRY_VERSION, present,
+                             round(temperature * 10) if temperature is not None else 0,
+                             round(humidity * 10) if humidity is not None else 0,
+                             gas_analog or 0, flags)
+
+
+def legacy_messages(fields):
+    """(device, attribute, text payload) for each present field, as the per-field topics carry them"""
+    return [(device, attribute, fmt(fields[field]))
+            for field, (device, attribute, fmt) in LEGACY_TOPICS.items()
+            if fields.get(field) is not None]
+
+
+if __name__ == "__main__":
+    for arg in sys.argv[1:]:
+        print(decode(bytes.fromhex(arg)))
@@ -0,0 +1,118 @@
+"""Query plan regression test: every hot dashboard / receiver query must use an index and not sort"""
+
+import sqlite3
+
+import pytest
+
+import analytics
+import export_stream
+import rollups
+import schema
+import system_stats
+import web_dashboard
+from alert_engine import AlertEngine
+
+# Sample parameters for EXPLAIN QUERY PLAN
+SAMPLE_ROOM = 'bedroom'
+SAMPLE_NODE = 'node1'
+SAMPLE_TIME = '2024-01-01 00:00:00'
+
+
+class _QueryRecorder:
+    """Connection stand-in: records (sql, params) and returns an empty result instead of running them"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.queries = []
+
+    def execute(self, sql, params=()):
+        self.queries.append((sql, tuple(params)))
+        return self.conn.execute("SELECT NULL WHERE 0")
+
+    def submit(self, sql, params=()):
+        # DatabaseWriter interface, for the alert engine's statements
+        self.queries.append((sql, tuple(params)))
+        return True
+
+
+def hot_queries(conn):
+    """[(name, sql, params)] of the queries behind the dashboard API and the receiver's alert path,
+    taken from the code that issues them (the constants, or the functions run against a recorder)"""
+    queries = []
+
+    def record(name, run):
+        recorder = _QueryRecorder(conn)
+        run(recorder)
+        queries.extend((name, sql, params) for sql, params in recorder.queries)
+
+    for (room, before), sql in web_dashboard.RECENT_DATA_SQL.items():
+        params = ['-24 hours'] + [SAMPLE_ROOM] * room + [SAMPLE_TIME, 1] * before + [100]
+        queries.append((f"recent_data (room={room}, next page={before})", sql, tuple(params)))
+    queries.append(("alerts", web_dashboard.ALERTS_SQL, (False,)))
+    queries.append(("nodes", web_dashboard.NODES_SQL, ()))
+
+    for hours in (1, 48, 24 * 90):
+        for node in (None, SAMPLE_NODE):
+            record(f"history ({hours} h, node={node})",
+                   lambda c: rollups.query_rollup(c, SAMPLE_ROOM, hours, node))
+    for resolution in ('raw',) + tuple(r[0] for r in rollups.RESOLUTIONS):
+        record(f"analytics ({resolution}, per node)",
+               lambda c: analytics.load_series(c, SAMPLE_ROOM, 24, SAMPLE_NODE, resolution))
+
+    for table in export_stream.EXPORT_TABLES:
+        for room in (None, SAMPLE_ROOM):
+            for node in (None, SAMPLE_NODE):
+                for start, end in ((None, None), (SAMPLE_TIME, None), (SAMPLE_TIME, SAMPLE_TIME)):
+                    sql, params = export_stream.export_query(table, room, node, start, end)
+                    queries.append((f"export {table} (room={room}, node={node}, start={start}, end={end})",
+                                    sql, tuple(params)))
+
+    record("system_stats", lambda c: system_stats.load_stored(c))
+    record("system_stats reconcile", lambda c: system_stats.count_from_database(c))
+    record("system_stats reconcile (worker)", lambda c: (system_stats.load_stored(c, name='worker-0'),
+                                                         system_stats.count_from_database(c, owns=lambda r, n: True)))
+
+    def alert_transitions(recorder):
+        engine = AlertEngine(recorder, clear_debounce=0)
+        engine.observe(SAMPLE_ROOM, SAMPLE_NODE, 'GAS_ALERT', "Gas level: WARNING", 'MEDIUM')
+        engine.observe(SAMPLE_ROOM, SAMPLE_NODE, 'GAS_ALERT', "Gas level: DANGER", 'HIGH')
+        engine.observe(SAMPLE_ROOM, SAMPLE_NODE, 'GAS_ALERT', None, None)
+        engine.observe(SAMPLE_ROOM, SAMPLE_NODE, 'GAS_ALERT', None, None)
+    record("alert engine", alert_transitions)
+
+    return queries
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    schema.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def test_migrations_reach_latest_version(conn):
+    assert schema.get_version(conn) == schema.MIGRATIONS[-1][0]
+    assert schema.migrate(conn) == schema.MIGRATIONS[-1][0]  # Re-running is a no-op
+
+
+def test_hot_queries_cover_the_dashboard(conn):
+    names = {name for name, _, _ in hot_queries(conn)}
+    for expected in ("recent_data (room=True, next page=True)", "alerts", "alert engine"):
+        assert expected in names
+    assert any(name.startswith("history (") and "node=None" in name for name in names)
+    assert any(name.startswith("analytics (raw") for name in names)
+    assert any(name.startswith("export alerts") for name in names)
+
+
+def test_hot_queries_use_indexes(conn):
+    assert schema.find_full_scans(conn, hot_queries(conn)) == []
+
+
+def test_sorts_and_scans_are_reported(conn):
+    offenders = schema.find_full_scans(conn, [
+        ("sorted", "SELECT * FROM alerts WHERE resolved = ? ORDER BY message", (0,)),
+        ("scan", "SELECT * FROM door_status WHERE door_angle = ?", (90,)),
+    ])
+    assert ("sorted", "USE TEMP B-TREE FOR ORDER BY") in offenders
+    assert ("scan", "SCAN door_status") in offenders
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+MQTT Topic Router
+Bảng dispatch dùng chung cho mqtt_receiver.py và web_dashboard.py:
+home/<room>/<node>/<device>/<attribute> → route (kind, field, decoder), tra cứu O(1)
+(homes/<home>/<room>/... cho các nhà khác, xem shards.py)
+"""
+
+import json
+import sys
+from collections import namedtuple
+
+import telemetry
+from shards import DEFAULT_HOME, HOMES_TOPIC_ROOT, valid_home
+
+# kind:   what the message is ('reading', 'telemetry', 'door', 'liveness', 'heartbeat', 'status')
+# field:  column / state key it updates (None when the payload is a document / whole tick)
+# decode: payload text -> typed value (raw bytes for BINARY_KINDS)
+Route = namedtuple('Route', ['kind', 'field', 'decode'])
+
+# room/node/device/attribute are interned; route is None for topics nobody handles (led_system, buzzer...);
+# home is DEFAULT_HOME for home/... topics and <home> for homes/<home>/...
+Match = namedtuple('Match', ['room', 'node', 'device', 'attribute', 'route', 'home'], defaults=(DEFAULT_HOME,))
+
+
+def decode_fire(payload):
+    return payload == "FIRE_DETECTED"
+
+
+# ===== ROUTE TABLES =====
+SENSOR_ROUTES = {
+    ('temperature_sensor', 'value'): Route('reading', 'temperature', float),
+    ('humidity_sensor', 'value'): Route('reading', 'humidity', float),
+    ('gas_sensor', 'analog_value'): Route('reading', 'gas_analog', int),
+    ('gas_sensor', 'status'): Route('reading', 'gas_status', str),
+    ('flame_sensor', 'alert'): Route('reading', 'fire_detected', decode_fire),
+    # Whole sampling tick in one binary message (see telemetry.py); the topics above stay accepted
+    ('telemetry', 'tick'): Route('telemetry', None, telemetry.decode),
+    ('door', 'status'): Route('door', None, json.loads),
+    # Published (retained) by the receiver's node registry: online / offline per node
+    ('liveness', 'status'): Route('liveness', None, json.loads),
+}
+
+SYSTEM_ROUTES = {
+    'home/system/heartbeat': Route('heartbeat', None, json.loads),
+    'home/system/status': Route('status', None, json.loads),
+}
+
+# Kinds whose decoder takes the raw payload bytes instead of UTF-8 text
+BINARY_KINDS = frozenset({'telemetry'})
+
+TOPIC_CACHE_SIZE = 4096       # Distinct topics remembered; a real house has a few dozen
+
+
+class TopicRouter:
+    """Resolve a topic string to a Match once, then serve repeats from a dict"""
+
+    def __init__(self, sensor_routes=SENSOR_ROUTES, system_routes=SYSTEM_ROUTES, cache_size=TOPIC_CACHE_SIZE):
+        self.sensor_routes = dict(sensor_routes)
+        self.system_routes = dict(system_routes)
+        self.cache_size = cache_size
+        self._cache = {}
+
+    def register(self, device, attribute, route):
+        """Add a sensor type; existing cache entries for it are rebuilt on next use"""
+        self.sensor_routes[(device, attribute)] = route
+        self._cache.clear()
+
+    def resolve(self, topic):
+        """Match for a topic, or None if it isn't a home/... topic we know the shape of"""
+        match = self._cache.get(topic)
+        if match is None and topic not in self._cache:
+            match = self._compile(topic)
+            if len(self._cache) >= self.cache_size:
+                # Garbage topics shouldn't grow memory forever; the real ones come straight back
+                self._cache.clear()
+            self._cache[topic] = match
+        return match
+
+    def _compile(self, topic):
+        home = DEFAULT_HOME
+        if topic.startswith(HOMES_TOPIC_ROOT + '/'):
+            # homes/<home>/<rest> is handled exactly like home/<rest>
+            parts = topic.split('/', 2)
+            if len(parts) < 3 or not valid_home(parts[1]):
+                return None
+            home = sys.intern(parts[1])
+            topic = "home/" + parts[2]
+
+        route = self.system_routes.get(topic)
+        if route is not None:
+            return Match(None, None, 'system', sys.intern(topic.rsplit('/', 1)[-1]), route, home)
+
+        parts = topic.split('/')
+        if len(parts) < 5 or parts[0] != "home":
+            return None
+
+        room, node, device, attribute = (sys.intern(p) for p in parts[1:5])
+        return Match(room, node, device, attribute, self.sensor_routes.get((device, attribute)), home)
+
+
+def payload_for(match, payload):
+    """Raw MQTT payload as the route's decoder expects it: bytes for binary routes, text otherwise"""
+    if match is not None and match.route is not None and match.route.kind in BINARY_KINDS:
+        return payload
+    return payload.decode('utf-8')
+
+
+# Shared default instance
+ROUTER = TopicRouter()
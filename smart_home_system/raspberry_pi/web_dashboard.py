@@ -4,15 +4,31 @@ Smart Home Web Dashboard
 Dashboard web để quản lý và điều khiển toàn bộ hệ thống IoT Home
 """
 
-from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, g
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import paho.mqtt.client as mqtt
 import sqlite3
 import json
 import threading
+import functools
+import time
 from datetime import datetime, timedelta
 import os
 
+import analytics
+import export_stream
+import metrics
+import rollups
+import shards
+import system_stats
+import telemetry
+from metrics import MQTT_FAILURES, MQTT_MESSAGES, REGISTRY
+from read_pool import ReadPool
+from response_cache import ResponseCache, TableVersions
+from shards import DEFAULT_HOME, SHARD_DIR
+from state_store import StateStore
+from topic_router import ROUTER, payload_for
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'smart_home_secret_key'
 socketio = SocketIO(app, cors_allowed_origins="*")
@@ -23,9 +39,20 @@ MQTT_PORT = 1883
 MQTT_USERNAME = "pi101"
 MQTT_PASSWORD = "1234"
 DB_FILE = "/home/pi/project/IoT_Home_SIC/smart_home_system/raspberry_pi/smart_home.db"
+BROADCAST_FRAME = 0.2  # Seconds; sensor updates are coalesced into one 'sensor_batch' per frame
+CACHE_TTL = 30  # Seconds a cached API response may be served while its tables are unchanged
+CACHE_MAX_ENTRIES = 256
+MAX_RANGE_HOURS = 24 * 365  # Longest ?hours= range; rollups keep a year, and huge values overflow timedelta
+
+HTTP_SECONDS = REGISTRY.histogram('smarthome_http_request_seconds',
+                                  'API request latency per route (streamed exports: until the first chunk)',
+                                  ('endpoint', 'method', 'status'))
+SOCKETIO_EMITS = REGISTRY.counter('smarthome_socketio_emits_total', 'Socket.IO emits per event', ('event',))
+SOCKETIO_UPDATES = REGISTRY.counter('smarthome_socketio_updates_total', 'Sensor updates sent in sensor_batch emits')
 
-# Global variables for real-time data
-current_data = {
+# Real-time state per home: the original house is seeded with the known layout; other homes,
+# rooms and nodes appear on their first message
+DEFAULT_LAYOUT = {
     'bedroom': {
         'node1': {'temperature': 0, 'humidity': 0, 'gas_status': 'SAFE', 'fire': False},
         'node2': {'door_state': 'closed', 'presence': False}
@@ -35,6 +62,175 @@ current_data = {
         'node2': {'door_state': 'closed', 'presence': False}
     }
 }
+states = {DEFAULT_HOME: StateStore(DEFAULT_LAYOUT)}  # home -> StateStore
+ignored_messages = 0  # Messages of homes with invalid names or past MAX_HOMES
+
+def state_for(home):
+    """Live state of `home`, created on its first message (only the MQTT thread creates); None if the
+    name isn't a valid home or MAX_HOMES homes are tracked already (any client can publish homes/...)"""
+    global ignored_messages
+    store = states.get(home)
+    if store is None:
+        if not shards.valid_home(home) or len(states) >= shards.MAX_HOMES:
+            ignored_messages += 1
+            if ignored_messages == 1 or ignored_messages % 1000 == 0:
+                print(f"Ignoring messages of home {home!r}: invalid name or already tracking "
+                      f"{shards.MAX_HOMES} homes ({ignored_messages} ignored so far)")
+            return None
+        store = states.setdefault(home, StateStore())
+    return store
+
+# ===== CLIENT SUBSCRIPTIONS =====
+# A view is (home, rooms, nodes, devices): one home plus frozensets where an empty set means "any".
+# Clients with the same view share one Socket.IO room, so each distinct view costs one emit per frame.
+
+# State key -> device that produces it (for device-filtered snapshots)
+STATE_DEVICES = {
+    'temperature': 'temperature_sensor',
+    'humidity': 'humidity_sensor',
+    'gas_status': 'gas_sensor',
+    'fire': 'flame_sensor',
+    'door_state': 'door',
+    'presence': 'door',
+    'online': 'liveness',
+}
+
+def normalize_view(spec):
+    """Canonical view from a subscribe payload like
+    {'home': 'apt12', 'rooms': [...], 'nodes': ['bedroom/node1'], 'devices': [...]} (no home: the original house)"""
+    spec = spec if isinstance(spec, dict) else {}
+    home = spec.get('home') or DEFAULT_HOME
+    if home != DEFAULT_HOME and not shards.valid_home(home):
+        home = DEFAULT_HOME
+    return (home,) + tuple(frozenset(spec.get(key) or ()) for key in ('rooms', 'nodes', 'devices'))
+
+def view_matches(view, home, room, node, device):
+    view_home, rooms, nodes, devices = view
+    return (view_home == home
+            and (not rooms or room in rooms)
+            and (not nodes or f"{room}/{node}" in nodes)
+            and (not devices or device in devices))
+
+def view_room_name(view):
+    return 'view:' + json.dumps([view[0]] + [sorted(part) for part in view[1:]], separators=(',', ':'))
+
+class SubscriptionRegistry:
+    """Which view each connected client is looking at"""
+    
+    def __init__(self):
+        self._client_view = {}
+        self._members = {}  # view -> number of clients
+        self._lock = threading.Lock()
+        
+    def set_view(self, sid, view):
+        """Move a client to a view; returns its previous view (or None)"""
+        with self._lock:
+            old = self._client_view.get(sid)
+            if old is not None:
+                self._leave(old)
+            self._client_view[sid] = view
+            self._members[view] = self._members.get(view, 0) + 1
+            return old
+            
+    def view_of(self, sid):
+        with self._lock:
+            return self._client_view.get(sid)
+            
+    def remove(self, sid):
+        with self._lock:
+            old = self._client_view.pop(sid, None)
+            if old is not None:
+                self._leave(old)
+                
+    def views(self):
+        with self._lock:
+            return list(self._members)
+            
+    def _leave(self, view):
+        self._members[view] -= 1
+        if not self._members[view]:
+            del self._members[view]
+
+subscriptions = SubscriptionRegistry()
+
+class BroadcastScheduler:
+    """Coalesce sensor updates per (home, room, node, device, attribute) into one sensor_batch per frame"""
+    
+    def __init__(self, frame=BROADCAST_FRAME):
+        self.frame = frame
+        self._pending = {}
+        self._last_sent = {}
+        self._active_rooms = set()  # (home, room)
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.skipped = 0
+        
+    def publish(self, home, room, node, device, attribute, value, urgent=False):
+        """Queue an update for the next frame; a changed urgent value (fire / gas) goes out immediately"""
+        key = (home, room, node, device, attribute)
+        
+        with self._lock:
+            self._active_rooms.add((home, room))
+            if self._last_sent.get(key) == value:
+                # Unchanged since the last emit: drop it (and any newer value that reverted)
+                self._pending.pop(key, None)
+                self.skipped += 1
+                return
+            if not urgent:
+                self._pending[key] = value
+                return
+            self._pending.pop(key, None)
+            self._last_sent[key] = value
+            
+        # Fire / gas alarms go to every client of that home, whatever room it is looking at
+        for view in subscriptions.views():
+            if view[0] == home:
+                self._emit(home, [key[1:] + (value,)], [room], to=view_room_name(view))
+        
+    def flush(self):
+        """Emit everything gathered during the last frame"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            active, self._active_rooms = self._active_rooms, set()
+            self._last_sent.update(pending)
+            
+        if not (pending or active):
+            return
+            
+        # One batch per distinct view, containing only what that view shows
+        for view in subscriptions.views():
+            home, view_rooms = view[0], view[1]
+            updates = [key[1:] + (value,) for key, value in pending.items() if view_matches(view, *key[:4])]
+            rooms = sorted(room for room_home, room in active
+                           if room_home == home and (not view_rooms or room in view_rooms))
+            if updates or rooms:
+                self._emit(home, updates, rooms, to=view_room_name(view))
+            
+    def _emit(self, home, updates, active_rooms, to=None):
+        SOCKETIO_EMITS.inc(('sensor_batch',))
+        SOCKETIO_UPDATES.inc(amount=len(updates))
+        socketio.emit('sensor_batch', {
+            'home': home,
+            'updates': [
+                {'room': room, 'node': node, 'device': device, 'attribute': attribute, 'value': value}
+                for room, node, device, attribute, value in updates
+            ],
+            # Rooms that reported this frame, even if nothing changed ("Last updated" on the page)
+            'active_rooms': active_rooms,
+            'timestamp': datetime.now().isoformat()
+        }, to=to)
+        self.batches += 1
+        
+    def run(self):
+        """Background task: flush once per frame"""
+        while True:
+            socketio.sleep(self.frame)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Broadcast error: {e}")
+
+broadcaster = BroadcastScheduler()
 
 # MQTT Client setup
 mqtt_client = mqtt.Client()
@@ -43,94 +239,223 @@ mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
 def on_mqtt_connect(client, userdata, flags, rc):
     if rc == 0:
         print("Connected to MQTT broker")
-        # Subscribe to all topics
-        client.subscribe("home/+/+/+/+")
-        client.subscribe("home/system/+")
+        # Subscribe to all topics, of the original house and of every homes/<home>/... shard
+        for topic in ("home/+/+/+/+", "home/system/+",
+                      f"{shards.HOMES_TOPIC_ROOT}/+/+/+/+/+", f"{shards.HOMES_TOPIC_ROOT}/+/system/+"):
+            client.subscribe(topic)
     else:
         print(f"Failed to connect to MQTT broker: {rc}")
 
+# Reading field (topic_router) -> key in the dashboard state
+DASHBOARD_FIELDS = {
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'gas_status': 'gas_status',
+    'fire_detected': 'fire',
+}
+
+# Reading payloads that are broadcast immediately instead of waiting for the frame
+ALARM_PAYLOADS = frozenset({"FIRE_DETECTED", "WARNING", "DANGER"})
+
 def on_mqtt_message(client, userdata, msg):
+    match = None
     try:
         topic = msg.topic
-        payload = msg.payload.decode('utf-8')
-        topic_parts = topic.split('/')
+        match = ROUTER.resolve(topic)
+        MQTT_MESSAGES.inc((match.route.kind if match is not None and match.route is not None else 'other',))
         
-        if len(topic_parts) >= 5:
-            room = topic_parts[1]
-            node = topic_parts[2]
-            device = topic_parts[3]
-            attribute = topic_parts[4]
+        if match is not None and match.device != 'system':
+            room, node, route = match.room, match.node, match.route
+            state = state_for(match.home)
+            if state is None:
+                return
+            payload = payload_for(match, msg.payload)
             
+            if route is not None and route.kind == 'telemetry':
+                # One binary tick fans out into the same updates the per-field text topics produce
+                fields = route.decode(payload)
+                state.update(room, node, {DASHBOARD_FIELDS[f]: v for f, v in fields.items()
+                                          if f in DASHBOARD_FIELDS and v is not None})
+                for device, attribute, text in telemetry.legacy_messages(fields):
+                    broadcaster.publish(match.home, room, node, device, attribute, text, text in ALARM_PAYLOADS)
+                return
+                
             # Update current data
-            if room in current_data and node in current_data[room]:
-                if device == "temperature_sensor" and attribute == "value":
-                    current_data[room][node]['temperature'] = float(payload)
-                elif device == "humidity_sensor" and attribute == "value":
-                    current_data[room][node]['humidity'] = float(payload)
-                elif device == "gas_sensor" and attribute == "status":
-                    current_data[room][node]['gas_status'] = payload
-                elif device == "flame_sensor" and attribute == "alert":
-                    current_data[room][node]['fire'] = (payload == "FIRE_DETECTED")
-                elif device == "door" and attribute == "status":
-                    door_data = json.loads(payload)
-                    current_data[room][node]['door_state'] = door_data.get('state', 'unknown')
-                    current_data[room][node]['presence'] = door_data.get('presence', False)
+            if route is not None:
+                if route.kind == 'reading':
+                    key = DASHBOARD_FIELDS.get(route.field)
+                    if key:
+                        state.update(room, node, {key: route.decode(payload)})
+                elif route.kind == 'door':
+                    door_data = route.decode(payload)
+                    state.update(room, node, {
+                        'door_state': door_data.get('state', 'unknown'),
+                        'presence': door_data.get('presence', False)
+                    })
+                elif route.kind == 'liveness':
+                    state.update(room, node, {'online': route.decode(payload).get('status') == 'online'})
             
-            # Emit real-time data to connected clients
-            socketio.emit('sensor_update', {
-                'room': room,
-                'node': node,
-                'device': device,
-                'attribute': attribute,
-                'value': payload,
-                'timestamp': datetime.now().isoformat()
-            })
+            # Fire / gas alarms and nodes going offline skip the frame; everything else is coalesced
+            urgent = route is not None and (
+                route.kind == 'liveness'
+                or (route.kind == 'reading' and payload in ALARM_PAYLOADS))
+            broadcaster.publish(match.home, room, node, match.device, match.attribute, payload, urgent)
             
     except Exception as e:
+        MQTT_FAILURES.inc((match.route.kind if match is not None and match.route is not None else 'unknown',))
         print(f"Error processing MQTT message: {e}")
 
 mqtt_client.on_connect = on_mqtt_connect
 mqtt_client.on_message = on_mqtt_message
 
 # Database functions
-def get_db_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_recent_data(room=None, hours=24):
-    """Get recent sensor data from database"""
-    conn = get_db_connection()
-    
-    query = '''
-        SELECT * FROM environmental_data 
-        WHERE timestamp > datetime('now', '-{} hours')
-    '''.format(hours)
-    
+read_pools = {}  # home -> ReadPool of its shard
+read_pools_lock = threading.Lock()
+
+def request_home():
+    """Home the current request is about (?home=, validated in select_home)"""
+    return g.get('home', DEFAULT_HOME)
+
+def get_read_pool(home=None):
+    """Read-only connection pool of a home's database (opened on first use, after DB_FILE is final)"""
+    home = home or request_home()
+    pool = read_pools.get(home)
+    if pool is None:
+        with read_pools_lock:
+            pool = read_pools.get(home)
+            if pool is None:
+                pool = read_pools[home] = ReadPool(shards.shard_file(home, DB_FILE, SHARD_DIR))
+    return pool
+
+# Fixed SQL text with bound parameters, so each pooled connection prepares it once
+RECENT_DATA_SQL = {
+    (False, False): '''
+        SELECT * FROM environmental_data
+        WHERE timestamp > datetime('now', ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''',
+    (True, False): '''
+        SELECT * FROM environmental_data
+        WHERE timestamp > datetime('now', ?) AND room = ?
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''',
+    (False, True): '''
+        SELECT * FROM environmental_data
+        WHERE timestamp > datetime('now', ?) AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''',
+    (True, True): '''
+        SELECT * FROM environmental_data
+        WHERE timestamp > datetime('now', ?) AND room = ? AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC LIMIT ?
+    ''',
+}
+RECENT_DATA_LIMIT = 100
+RECENT_DATA_MAX_LIMIT = 1000
+
+def get_recent_data(room=None, hours=24, before=None, before_id=None, limit=RECENT_DATA_LIMIT):
+    """Get recent sensor data from database, newest first; pass the last row's timestamp and id as
+    `before` / `before_id` to get the next page (rows sharing that timestamp are not skipped)"""
+    params = [f"-{float(hours)} hours"]
     if room:
-        query += f" AND room = '{room}'"
-        
-    query += " ORDER BY timestamp DESC LIMIT 100"
+        params.append(room)
+    if before:
+        # Without an id (older clients) the whole `before` second is excluded, like before
+        params += [before, -1 if before_id is None else before_id]
+    params.append(max(1, min(int(limit), RECENT_DATA_MAX_LIMIT)))
     
-    data = conn.execute(query).fetchall()
-    conn.close()
-    
-    return [dict(row) for row in data]
+    return get_read_pool().query(RECENT_DATA_SQL[(bool(room), bool(before))], params)
+
+ALERTS_SQL = '''
+    SELECT * FROM alerts
+    WHERE resolved = ?
+    ORDER BY timestamp DESC LIMIT 50
+'''
+NODES_SQL = '''
+    SELECT * FROM node_registry ORDER BY room, node
+'''
 
 def get_alerts(resolved=False):
     """Get alerts from database"""
-    conn = get_db_connection()
-    
-    query = '''
-        SELECT * FROM alerts 
-        WHERE resolved = ?
-        ORDER BY timestamp DESC LIMIT 50
-    '''
-    
-    alerts = conn.execute(query, (resolved,)).fetchall()
-    conn.close()
-    
-    return [dict(row) for row in alerts]
+    return get_read_pool().query(ALERTS_SQL, (resolved,))
+
+# Response cache: invalidated by the receiver's per-table version counters, TTL bounds
+# "last N hours" queries that age without any write
+response_cache = ResponseCache(CACHE_MAX_ENTRIES)
+table_versions = {}  # home -> TableVersions of its shard
+
+def cached_response(tables, ttl=CACHE_TTL):
+    """Serve a JSON endpoint from the cache with ETag / Last-Modified (304 on revalidation)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            home = request_home()
+            if home not in table_versions:
+                table_versions[home] = TableVersions(shards.shard_file(home, DB_FILE, SHARD_DIR))
+            versions, last_modified = table_versions[home].current(tables)
+            
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+            entry = response_cache.get(key, versions)
+            if entry is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = response_cache.put(key, versions, response.get_data(), last_modified, ttl)
+                
+            response = app.response_class(entry.body, mimetype='application/json')
+            response.set_etag(entry.etag)
+            response.headers['Last-Modified'] = entry.last_modified
+            response.cache_control.no_cache = True  # Browsers keep it but revalidate every time
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+ROLLUP_TABLES = tuple(table for _, table, _, _ in rollups.RESOLUTIONS)
+
+# ===== METRICS =====
+REGISTRY.callback('smarthome_response_cache', 'Response cache entries / hits / misses',
+                  lambda: {(name,): value for name, value in response_cache.stats().items()}, labels=('stat',))
+REGISTRY.callback('smarthome_socketio_views', 'Distinct dashboard views (one Socket.IO room each)',
+                  lambda: len(subscriptions.views()))
+REGISTRY.callback('smarthome_broadcast_skipped_total', 'Sensor updates dropped as unchanged since the last emit',
+                  lambda: broadcaster.skipped, kind='counter')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def select_home():
+    """?home=<name> points the API at that home's shard (see shards.py); default is the original house"""
+    home = request.args.get('home', DEFAULT_HOME)
+    if home != DEFAULT_HOME:
+        if not shards.valid_home(home) or not os.path.exists(shards.shard_file(home, DB_FILE, SHARD_DIR)):
+            return jsonify({'error': f'Unknown home {home}'}), 404
+    g.home = home
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - started,
+                             (request.endpoint or 'unmatched', request.method, str(response.status_code)))
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return app.response_class(REGISTRY.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Sample all thread stacks for ?seconds=N (default 10); folded output for flame graphs"""
+    if not metrics.profile_allowed(request.remote_addr):
+        return jsonify({'error': 'profiling is only served to local clients'}), 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+    except ValueError:
+        return jsonify({'error': 'seconds must be a number'}), 400
+    return app.response_class(metrics.sample_stacks(seconds), mimetype='text/plain')
 
 # Routes
 @app.route('/')
@@ -139,18 +464,126 @@ def dashboard():
 
 @app.route('/api/current_data')
 def api_current_data():
-    return jsonify(current_data)
+    """Full state of the home, or with ?since=<version> only the fields changed after that version"""
+    since = request.args.get('since', type=int)
+    state = states.get(request_home()) or StateStore()
+    
+    if since is None:
+        version, body = state.snapshot_json()
+        response = app.response_class(body, mimetype='application/json')
+    else:
+        version, changes = state.changes_since(since)
+        response = jsonify({'version': version, 'changes': changes})
+        
+    response.headers['X-State-Version'] = str(version)
+    return response
 
 @app.route('/api/recent_data/<room>')
+@cached_response(('environmental_data',))
 def api_recent_data(room):
-    data = get_recent_data(room, hours=24)
-    return jsonify(data)
+    """Last 24 h for a room, newest first (a list); ?before=<timestamp>&before_id=<id>&limit=N pages
+    backwards. With ?cursor=1 the body is {room, data, next}, `next` holding those parameters for the
+    following page (null on the last one)"""
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    limit = max(1, min(request.args.get('limit', RECENT_DATA_LIMIT, type=int), RECENT_DATA_MAX_LIMIT))
+    data = get_recent_data(room, hours=24, before=before, before_id=before_id, limit=limit)
+    if not request.args.get('cursor', 0, type=int):
+        return jsonify(data)
+    
+    last = data[-1] if len(data) == limit else None
+    return jsonify({
+        'room': room,
+        'data': data,
+        'next': {'before': last['timestamp'], 'before_id': last['id']} if last else None
+    })
+
+@app.route('/api/history/<room>')
+@cached_response(ROLLUP_TABLES)
+def api_history(room):
+    """Aggregated history from the rollup tables, resolution chosen from the time range"""
+    hours = max(0.1, min(request.args.get('hours', 24, type=float), MAX_RANGE_HOURS))
+    node = request.args.get('node')
+    
+    with get_read_pool().connection() as conn:
+        resolution, rows = rollups.query_rollup(conn, room, hours, node)
+    
+    return jsonify({
+        'room': room,
+        'resolution': resolution,
+        'data': [dict(row) for row in rows]
+    })
+
+@app.route('/api/analytics/<room>')
+@cached_response(('environmental_data',) + ROLLUP_TABLES)
+def api_analytics(room):
+    """Moving averages, rate of change, percentiles and z-score anomalies per node.
+    ?hours=24&node=&resolution=auto|raw|1m|1h|1d&window=15&z=3&points=500"""
+    hours = max(0.1, min(request.args.get('hours', 24, type=float), MAX_RANGE_HOURS))
+    node = request.args.get('node')
+    resolution = request.args.get('resolution', 'auto')
+    window = max(2, request.args.get('window', analytics.MOVING_WINDOW, type=int))
+    threshold = request.args.get('z', analytics.ZSCORE_THRESHOLD, type=float)
+    points = max(10, min(request.args.get('points', analytics.SERIES_POINTS, type=int), 5000))
+    
+    if resolution != 'auto' and resolution != 'raw' and resolution not in {r[0] for r in rollups.RESOLUTIONS}:
+        return jsonify({'error': f'Unknown resolution {resolution}'}), 400
+        
+    with get_read_pool().connection() as conn:
+        resolution, series = analytics.load_series(conn, room, hours, node, resolution)
+        
+    return jsonify({
+        'room': room,
+        'resolution': resolution,
+        'window': window,
+        'threshold': threshold,
+        'nodes': analytics.analyze(series, window, threshold, points)
+    })
+
+@app.route('/api/export/<table>')
+def api_export(table):
+    """Stream a table: ?format=csv|ndjson&room=&node=&start=&end=&gzip=1 (start/end like 2024-01-31 or
+    2024-01-31 12:00:00, end exclusive). Rows are fetched and sent in chunks, never held in memory."""
+    if table not in export_stream.EXPORT_TABLES:
+        return jsonify({'error': f'Unknown table {table}'}), 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export_stream.FORMATS:
+        return jsonify({'error': f'Unknown format {fmt}'}), 400
+        
+    sql, params = export_stream.export_query(
+        table, request.args.get('room'), request.args.get('node'),
+        request.args.get('start'), request.args.get('end'))
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    mimetype, extension = export_stream.FORMATS[fmt]
+    
+    pool = get_read_pool()  # The generator runs after the request context is gone
+    
+    def generate():
+        # Own connection: a long download must not hold one of the pooled request connections
+        with pool.dedicated() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(sql, params)
+            chunks = export_stream.iter_csv(cursor) if fmt == 'csv' else export_stream.iter_ndjson(cursor)
+            yield from (export_stream.gzip_chunks(chunks) if compress else chunks)
+            
+    filename = f"{table}.{extension}" + (".gz" if compress else "")
+    return app.response_class(generate(), mimetype='application/gzip' if compress else mimetype,
+                              headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/api/alerts')
+@cached_response(('alerts',))
 def api_alerts():
     alerts = get_alerts(resolved=False)
     return jsonify(alerts)
 
+@app.route('/api/nodes')
+@cached_response(('node_registry',))
+def api_nodes():
+    """Registry row of every node (status, last heartbeat, uptime, free heap, RSSI, IP)"""
+    nodes = get_read_pool().query(NODES_SQL)
+    return jsonify(nodes)
+
 @app.route('/api/control_door', methods=['POST'])
 def api_control_door():
     try:
@@ -162,7 +595,7 @@ def api_control_door():
             return jsonify({'error': 'Missing room or action'}), 400
         
         # Publish MQTT command
-        topic = f"home/{room}/node2/door/command"
+        topic = f"{shards.topic_prefix(request_home())}/{room}/node2/door/command"
         command = {
             'action': action,
             'source': 'web',
@@ -177,58 +610,98 @@ def api_control_door():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/system_stats')
+@cached_response(('system_stats',))
 def api_system_stats():
-    """Get system statistics"""
-    conn = get_db_connection()
-    
-    # Count alerts by severity
-    alert_stats = conn.execute('''
-        SELECT severity, COUNT(*) as count 
-        FROM alerts 
-        WHERE resolved = 0 
-        GROUP BY severity
-    ''').fetchall()
-    
-    # Count online devices
-    online_devices = conn.execute('''
-        SELECT COUNT(*) as count 
-        FROM system_status 
-        WHERE timestamp > datetime('now', '-5 minutes') 
-        AND status = 'online'
-    ''').fetchone()
-    
-    # Recent environmental readings
-    recent_readings = conn.execute('''
-        SELECT COUNT(*) as count 
-        FROM environmental_data 
-        WHERE timestamp > datetime('now', '-1 hour')
-    ''').fetchone()
-    
-    conn.close()
-    
-    return jsonify({
-        'alerts': [dict(row) for row in alert_stats],
-        'online_devices': dict(online_devices)['count'],
-        'recent_readings': dict(recent_readings)['count']
-    })
+    """Get system statistics (counters maintained by the receiver, see system_stats.py)"""
+    with get_read_pool().connection() as conn:
+        document = system_stats.load_stored(conn, system_stats.STATS_STALE_AFTER)
+        if document is not None:
+            return jsonify(document)
+            
+        # Receiver hasn't published yet, or has stopped: count directly, like it does on startup
+        alerts, last_seen, readings = system_stats.count_from_database(conn)
+    return jsonify(system_stats.stats_document(alerts, len(last_seen), sum(count for _, count in readings)))
+
+@app.route('/api/fleet/stats')
+def api_fleet_stats():
+    """System statistics of every home shard, plus fleet totals"""
+    homes = {}
+    totals = {'homes': 0, 'online_devices': 0, 'recent_readings': 0, 'alerts': {}}
+    for home in shards.list_homes(SHARD_DIR):
+        try:
+            with get_read_pool(home).connection() as conn:
+                document = system_stats.load_stored(conn, system_stats.STATS_STALE_AFTER)
+                if document is None:
+                    alerts, last_seen, readings = system_stats.count_from_database(conn)
+                    document = system_stats.stats_document(alerts, len(last_seen), sum(count for _, count in readings))
+        except sqlite3.Error as e:
+            print(f"Fleet stats: home {home} unreadable: {e}")
+            continue
+            
+        homes[home] = document
+        totals['homes'] += 1
+        totals['online_devices'] += document.get('online_devices', 0)
+        totals['recent_readings'] += document.get('recent_readings', 0)
+        for alert in document.get('alerts', []):
+            totals['alerts'][alert['severity']] = totals['alerts'].get(alert['severity'], 0) + alert['count']
+            
+    totals['alerts'] = [{'severity': s, 'count': c} for s, c in sorted(totals['alerts'].items())]
+    return jsonify({'homes': homes, 'totals': totals})
 
 # SocketIO events
+def snapshot_for(view, previous=None):
+    """Part of the state inside `view`, minus what `previous` already showed (delta snapshot)"""
+    home = view[0]
+    snapshot = {}
+    state = states.get(home)
+    for room, nodes in (state.snapshot() if state is not None else {}).items():
+        for node, node_state in nodes.items():
+            fields = {
+                key: value for key, value in node_state.items()
+                if view_matches(view, home, room, node, STATE_DEVICES.get(key))
+                and not (previous and view_matches(previous, home, room, node, STATE_DEVICES.get(key)))
+            }
+            if fields:
+                snapshot.setdefault(room, {})[node] = fields
+    return snapshot
+
+def subscribe_client(view):
+    """Put the calling client in the Socket.IO room of `view` and send it what it's missing"""
+    previous = subscriptions.set_view(request.sid, view)
+    if previous is not None:
+        leave_room(view_room_name(previous))
+    join_room(view_room_name(view))
+    emit('current_data', snapshot_for(view, previous))
+
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
+    # Clients may pass their view in the connect auth; without one they get everything (old pages)
     print('Client connected')
-    emit('current_data', current_data)
+    subscribe_client(normalize_view(auth))
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """data: {'home': ..., 'rooms': [...], 'nodes': ['room/node', ...], 'devices': [...]}; empty lists mean all"""
+    view = normalize_view(data)
+    subscribe_client(view)
+    emit('subscribed', dict({key: sorted(part) for key, part in zip(('rooms', 'nodes', 'devices'), view[1:])},
+                            home=view[0]))
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected')
+    subscriptions.remove(request.sid)
 
 @socketio.on('request_door_control')
 def handle_door_control(data):
     room = data.get('room')
     action = data.get('action')
+    # The home the client asks for, else the one it is viewing
+    view = subscriptions.view_of(request.sid)
+    home = data.get('home') or (view[0] if view else DEFAULT_HOME)
     
-    if room and action:
-        topic = f"home/{room}/node2/door/command"
+    if room and action and (home == DEFAULT_HOME or shards.valid_home(home)):
+        topic = f"{shards.topic_prefix(home)}/{room}/node2/door/command"
         command = {
             'action': action,
             'source': 'web',
@@ -236,7 +709,7 @@ def handle_door_control(data):
         }
         
         mqtt_client.publish(topic, json.dumps(command))
-        emit('door_command_sent', {'room': room, 'action': action})
+        emit('door_command_sent', {'home': home, 'room': room, 'action': action})
 
 def start_mqtt_client():
     """Start MQTT client in background thread"""
@@ -250,6 +723,9 @@ if __name__ == '__main__':
     # Ensure database exists
     os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
     
+    # Coalesced Socket.IO fan-out
+    socketio.start_background_task(broadcaster.run)
+    
     # Start MQTT client in background thread
     mqtt_thread = threading.Thread(target=start_mqtt_client)
     mqtt_thread.daemon = True